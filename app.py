@@ -2,6 +2,7 @@ from flask import Flask, render_template, redirect, url_for, flash, request, jso
 from flask_login import LoginManager, login_required, current_user, login_user
 from datetime import datetime, date, timedelta
 from jinja2 import TemplateNotFound
+import logging
 import os
 
 # =========================
@@ -23,10 +24,17 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['WTF_CSRF_ENABLED'] = True
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB para uploads
 
-# SQLite com threads (debug server)
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    "connect_args": {"check_same_thread": False}
-}
+# Backend (DATABASE_URL / DB_PERFIL=sqlite|mysql|postgresql), engine/pool por modo de
+# implantação (DB_MODO) + pragmas do SQLite (WAL, busy_timeout...)
+from utils.banco import configurar_banco
+DB_MODO = configurar_banco(app)
+
+# Logs estruturados em fila assíncrona (LOG_NIVEL: DEBUG em desenvolvimento, WARNING em produção)
+try:
+    from utils.logs import configurar_logs
+    print(f"✅ Logs configurados (nível {configurar_logs(app)})")
+except Exception as e:
+    print(f"⚠️ Erro ao configurar logs: {e}")
 
 # Configurações de sessão para melhor persistência
 app.config['SESSION_COOKIE_SECURE'] = False  # HTTP em desenvolvimento
@@ -101,20 +109,25 @@ def internal_error(error):
 # ==========================
 # Middleware para debug de requisições
 # ==========================
+logger_requisicoes = logging.getLogger('requisicoes')
+logger_auth = logging.getLogger('auth')
+
 @app.before_request
 def before_request():
+    # Em produção (LOG_NIVEL acima de DEBUG) nada é montado nem escrito aqui
+    if not logger_requisicoes.isEnabledFor(logging.DEBUG):
+        return
     from flask import session
     from flask_login import current_user
 
-    print(f"DEBUG: Requisição para {request.path}")
     if request.path.startswith('/static/'):
         return  # Skip static files
 
     # Debug de sessão
-    print(f"DEBUG: current_user.is_authenticated: {current_user.is_authenticated}")
-    print(f"DEBUG: Session user_id: {session.get('user_id')}")
-    print(f"DEBUG: Session _user_id: {session.get('_user_id')}")
-    print(f"DEBUG: Session logged_in: {session.get('logged_in')}")
+    logger_requisicoes.debug(
+        "Requisição para %s", request.path,
+        extra={'autenticado': current_user.is_authenticated, 'user_id': session.get('user_id'),
+               '_user_id': session.get('_user_id'), 'logged_in': session.get('logged_in')})
 
     # Reautenticação automática desabilitada para permitir logout correto
     # if not current_user.is_authenticated:
@@ -125,9 +138,9 @@ def before_request():
     #             user = User.query.get(uid)
     #             if user:
     #                 login_user(user, remember=True)
-    #                 print(f"DEBUG: Usuário reautenticado: {user.username}")
+    #                 logger_auth.debug("Usuário reautenticado: %s", user.username)
     #         except Exception as e:
-    #             print(f"DEBUG: Erro na reautenticação: {e}")
+    #             logger_auth.debug("Erro na reautenticação: %s", e)
 
 # ==========================
 # Infra / inicialização
@@ -138,7 +151,7 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
 
 # Importação dos modelos
 print("📊 Importando modelos...")
-from models import db, User, Empenho, Contrato, AditivoContratual
+from models import db, User, Empenho, Contrato, AditivoContratual, StatusContrato
 # Importar modelos de chat
 try:
     # from models_chat_rooms import ChatRoom, ChatMember, ChatRoomMessage
@@ -159,6 +172,19 @@ except ImportError:
 print("⚙️ Inicializando extensões...")
 # Inicialização das extensões
 db.init_app(app)
+try:
+    from utils.banco import init_banco
+    _engine = init_banco(app, db)
+    print(f"✅ Banco configurado ({_engine.dialect.name}, modo {DB_MODO})")
+except Exception as e:
+    print(f"⚠️ Erro ao configurar o banco: {e}")
+# Gravações curtas e frequentes (chat, presença) agrupadas por um único gravador
+try:
+    from utils.gravador import init_gravador
+    print("✅ Fila de gravação ativa (commit em lote)" if init_gravador(app).agrupar
+          else "✅ Fila de gravação em modo direto")
+except Exception as e:
+    print(f"⚠️ Erro ao iniciar a fila de gravação: {e}")
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
@@ -168,18 +194,94 @@ login_manager.session_protection = 'basic'  # Proteção básica
 login_manager.remember_cookie_duration = timedelta(days=1)  # timedelta aqui também
 print("✅ Extensões inicializadas")
 
+from utils.versao_dados import etag_condicional
+
+# Agregados materializados do painel (mantidos por hooks do SQLAlchemy)
+try:
+    from models import DashboardAgregado
+    from utils.agregados import registrar_hooks_agregados, garantir_agregados
+    registrar_hooks_agregados()
+    with app.app_context():
+        DashboardAgregado.__table__.create(db.engine, checkfirst=True)
+    print("✅ Agregados do painel ativos")
+except Exception as e:
+    print(f"⚠️ Erro ao preparar agregados do painel: {e}")
+
+def construir_agregados():
+    """Primeira construção dos agregados: na inicialização, nunca na leitura do painel"""
+    try:
+        with app.app_context():
+            if garantir_agregados():
+                print("✅ Agregados do painel construídos")
+    except Exception as e:
+        # Banco novo: as tabelas de origem só existem depois de create_tables()
+        print(f"⚠️ Agregados do painel não construídos: {e}")
+
+construir_agregados()
+
+# Checkpoints de importação em lotes (retomada após falha)
+try:
+    from models import ImportacaoCheckpoint
+    with app.app_context():
+        ImportacaoCheckpoint.__table__.create(db.engine, checkfirst=True)
+except Exception as e:
+    print(f"⚠️ Erro ao preparar checkpoints de importação: {e}")
+
+# Índices FTS5 de contratos, empenhos e notas (busca/autocomplete)
+from utils.busca import buscar, buscar_geral, TAMANHO_MINIMO
+
+def preparar_busca():
+    """Índices de prefixo e FTS5; repetido em create_tables() porque num banco novo as tabelas ainda não existem"""
+    try:
+        from utils.busca import garantir_fts, garantir_indices_prefixo
+        with app.app_context():
+            garantir_indices_prefixo()
+            if garantir_fts():
+                print("✅ Índices de busca FTS5 prontos")
+            else:
+                print("⚠️ FTS5 indisponível - busca usando ILIKE")
+    except Exception as e:
+        # Sem FTS a busca continua funcionando por ILIKE (fts_disponivel() fica False)
+        print(f"⚠️ Erro ao preparar índices de busca: {e}")
+
+preparar_busca()
+
+# Cache de relatórios (memória, sqlite ou redis via CACHE_BACKEND)
+try:
+    from utils.cache import init_cache, registrar_invalidacao
+    cache_relatorios = init_cache(app)
+    registrar_invalidacao((Empenho, Contrato, NotaFiscal))
+    print(f"✅ Cache de relatórios: {type(cache_relatorios.backend).__name__}")
+except Exception as e:
+    print(f"⚠️ Erro ao inicializar cache de relatórios: {e}")
+
+# Eventos em tempo real do chat (SSE); broker memory, sqlite ou redis via EVENTOS_BROKER
+try:
+    from utils.eventos import init_eventos
+    central_eventos = init_eventos(app)
+    print(f"✅ Eventos em tempo real: {type(central_eventos.broker).__name__}")
+except Exception as e:
+    print(f"⚠️ Erro ao inicializar eventos em tempo real: {e}")
+
+# Presença do chat: online por sala em memória, último sinal gravado em lote
+try:
+    from utils.presenca import init_presenca
+    init_presenca(app)
+    print("✅ Serviço de presença ativo")
+except Exception as e:
+    print(f"⚠️ Erro ao iniciar serviço de presença: {e}")
+
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        print(f"DEBUG LOAD_USER: Tentando carregar usuário ID: {user_id}")
         user = User.query.get(int(user_id))
         if user:
-            print(f"DEBUG LOAD_USER: Usuário carregado: {user.username}")
+            logger_auth.debug("Usuário carregado: %s", user.username, extra={'user_id': user_id})
         else:
-            print(f"DEBUG LOAD_USER: Usuário não encontrado para ID: {user_id}")
+            logger_auth.debug("Usuário não encontrado", extra={'user_id': user_id})
         return user
     except (TypeError, ValueError) as e:
-        print(f"DEBUG LOAD_USER: Erro ao carregar usuário: {e}")
+        logger_auth.debug("Erro ao carregar usuário: %s", e, extra={'user_id': user_id})
         return None
 
 # ==========================
@@ -199,6 +301,18 @@ try:
     from routes.contratos_original_backup import contratos_original_bp
     from routes.relatorios import relatorios_bp
     from routes.notas import notas_bp
+    
+    # Injetar dependências nos módulos que as recebem do app principal
+    import routes.empenhos as empenhos_module
+    empenhos_module.Empenho = Empenho
+    empenhos_module.Contrato = Contrato
+    empenhos_module.AditivoContratual = AditivoContratual
+    empenhos_module.db = db
+    
+    import routes.notas as notas_module
+    notas_module.NotaFiscal = NotaFiscal
+    notas_module.Empenho = Empenho
+    notas_module.db = db
     print("✅ Usando blueprints das rotas existentes")
 except ImportError as e:
     print(f"⚠️ Erro ao importar rotas existentes: {e}")
@@ -238,6 +352,16 @@ except NameError:
 
 print("✅ Blueprints principais registrados")
 
+# Fila de jobs em segundo plano (exportações, importações e backup)
+try:
+    from utils.jobs import init_jobs
+    from routes.jobs import jobs_bp
+    init_jobs(app)
+    app.register_blueprint(jobs_bp)
+    print("✅ Fila de jobs registrada")
+except Exception as e:
+    print(f"⚠️ Erro ao registrar fila de jobs: {e}")
+
 print("📋 Registrando blueprints opcionais...")
 # Importar e registrar o blueprint do chat IA
 try:
@@ -297,6 +421,27 @@ except Exception as e:
 
 print("✅ Todos os blueprints processados")
 
+# Migrações versionadas de schema (uma vez por inicialização; nenhuma DDL nas rotas)
+try:
+    from utils.migracoes import aplicar_migracoes
+    with app.app_context():
+        aplicadas = aplicar_migracoes()
+    print(f"✅ Schema atualizado ({len(aplicadas)} migrações aplicadas)" if aplicadas else "✅ Schema em dia")
+except Exception as e:
+    print(f"⚠️ Erro ao aplicar migrações de schema: {e}")
+
+# Índices compostos dos filtros quentes (models + chat) em bancos já existentes
+try:
+    from utils.indices import migrar_indices, ConsultorIndices
+    with app.app_context():
+        migrar_indices()
+    # INDEX_ADVISOR=1 captura as consultas por rota para verificar_indices.py / EXPLAIN QUERY PLAN
+    if os.environ.get('INDEX_ADVISOR') or app.config.get('INDEX_ADVISOR'):
+        ConsultorIndices(app)
+        print("✅ Consultor de índices ativo")
+except Exception as e:
+    print(f"⚠️ Erro ao preparar índices: {e}")
+
 # Sanidade imediata: Testar URLs dos chats
 from flask import url_for
 with app.app_context():
@@ -371,6 +516,7 @@ def painel():
 
 @app.route('/api/kpis')
 @login_required
+@etag_condicional('kpis')
 def api_kpis():
     """API para fornecer KPIs em JSON para os widgets"""
     total_empenhos = 0
@@ -382,24 +528,18 @@ def api_kpis():
     contratos_ativos = 0
 
     try:
-        # Importar modelos dinamicamente
-        from models import Empenho, Contrato, NotaFiscal
+        from utils.kpis import kpi_snapshot
+        snap = kpi_snapshot()
 
-        # Totais
-        total_empenhos = db.session.query(Empenho).count()
-        total_contratos = db.session.query(Contrato).count()
-        total_notas_fiscais = db.session.query(NotaFiscal).count()
+        total_empenhos = snap['empenhos']['total']
+        total_contratos = snap['contratos']['total']
+        total_notas_fiscais = snap['notas']['total']
 
-        # Somatórios
-        valor_total_empenhos = db.session.query(db.func.coalesce(db.func.sum(Empenho.valor_empenhado), 0.0)).scalar() or 0.0
-        valor_total_contratos = db.session.query(db.func.coalesce(db.func.sum(Contrato.valor_total), 0.0)).scalar() or 0.0
-        valor_total_notas_fiscais = db.session.query(db.func.coalesce(db.func.sum(NotaFiscal.valor_liquido), 0.0)).scalar() or 0.0
+        valor_total_empenhos = snap['empenhos']['valor_total']
+        valor_total_contratos = snap['contratos']['valor_total']
+        valor_total_notas_fiscais = snap['notas']['valor_total']
 
-        # Contratos ativos
-        if hasattr(Contrato, 'status'):
-            contratos_ativos = db.session.query(Contrato).filter(Contrato.status == 'ATIVO').count()
-        elif hasattr(Contrato, 'data_fim'):
-            contratos_ativos = db.session.query(Contrato).filter(Contrato.data_fim >= datetime.utcnow().date()).count()
+        contratos_ativos = snap['contratos']['ativos']
 
     except Exception as e:
         print(f"[API_KPIS] Erro ao calcular KPIs: {e}")
@@ -414,6 +554,21 @@ def api_kpis():
         'contratos_ativos': contratos_ativos
     })
 
+@app.route('/api/buscar')
+@login_required
+def api_buscar():
+    """Busca unificada em contratos, empenhos e notas fiscais, ordenada por relevância"""
+    termo = request.args.get('q', '').strip()
+    if len(termo) < TAMANHO_MINIMO:
+        return jsonify({'error': 'Termo de busca muito curto', 'results': []})
+    
+    tipos = [t for t in request.args.get('tipos', '').split(',') if t] or None
+    limite = min(request.args.get('limite', 10, type=int), 50)
+    try:
+        return jsonify({'results': buscar_geral(termo, tipos, limite)})
+    except Exception as e:
+        return jsonify({'error': str(e), 'results': []})
+
 @app.route('/api/buscar/contratos')
 @login_required
 def api_buscar_contratos():
@@ -423,16 +578,8 @@ def api_buscar_contratos():
         return jsonify({'error': 'Termo de busca muito curto', 'results': []})
     
     try:
-        from models import Contrato
-        # Busca em múltiplos campos
-        contratos = db.session.query(Contrato).filter(
-            db.or_(
-                Contrato.numero_contrato.ilike(f'%{termo}%'),
-                Contrato.objeto.ilike(f'%{termo}%'),
-                Contrato.fornecedor.ilike(f'%{termo}%'),
-                Contrato.numero_pregao.ilike(f'%{termo}%')
-            )
-        ).limit(10).all()
+        # Índice FTS5 ordenado por relevância (ILIKE fora do SQLite)
+        contratos = buscar('contratos', termo, limite=10)
         
         results = []
         for contrato in contratos:
@@ -458,16 +605,7 @@ def api_buscar_empenhos():
         return jsonify({'error': 'Termo de busca muito curto', 'results': []})
     
     try:
-        from models import Empenho
-        # Busca em múltiplos campos
-        empenhos = db.session.query(Empenho).filter(
-            db.or_(
-                Empenho.numero_empenho.ilike(f'%{termo}%'),
-                Empenho.resumo_objeto.ilike(f'%{termo}%'),
-                Empenho.fornecedores.ilike(f'%{termo}%'),
-                Empenho.numero_pregao.ilike(f'%{termo}%')
-            )
-        ).limit(10).all()
+        empenhos = buscar('empenhos', termo, limite=10)
         
         results = []
         for empenho in empenhos:
@@ -493,16 +631,7 @@ def api_buscar_notas_fiscais():
         return jsonify({'error': 'Termo de busca muito curto', 'results': []})
     
     try:
-        from models import NotaFiscal
-        # Busca em múltiplos campos
-        notas = db.session.query(NotaFiscal).filter(
-            db.or_(
-                NotaFiscal.numero_nota.ilike(f'%{termo}%'),
-                NotaFiscal.fornecedor_nome.ilike(f'%{termo}%'),
-                NotaFiscal.fornecedor_cnpj.ilike(f'%{termo}%'),
-                NotaFiscal.chave_acesso.ilike(f'%{termo}%')
-            )
-        ).limit(10).all()
+        notas = buscar('notas', termo, limite=10)
         
         results = []
         for nota in notas:
@@ -609,81 +738,41 @@ def debug_login():
 # ==========================
 @app.route('/api/stats/empenhos')
 @login_required
+@etag_condicional('stats-empenhos')
 def api_stats_empenhos():
     """API para estatísticas de empenhos"""
     try:
-        from sqlalchemy import func
-        
-        total = Empenho.query.count()
-        valor_total = (db.session.query(func.sum(Empenho.valor_empenhado))
-                      .scalar()) or 0
-        
-        # Estatísticas por status
-        pendentes = Empenho.query.filter(func.upper(Empenho.status) == 'PENDENTE').count()
-        aprovados = Empenho.query.filter(func.upper(Empenho.status) == 'APROVADO').count()
-        pagos = Empenho.query.filter(func.upper(Empenho.status) == 'PAGO').count()
-        rejeitados = Empenho.query.filter(func.upper(Empenho.status) == 'REJEITADO').count()
-        
-        # Novos este mês
-        inicio_mes = date.today().replace(day=1)
-        col_data = getattr(Empenho, 'data_criacao', Empenho.data_empenho)
-        novos_mes = Empenho.query.filter(col_data >= inicio_mes).count()
-        
+        from utils.kpis import snapshot_empenhos
+        snap = snapshot_empenhos()
+
         return jsonify({
-            'total': total,
-            'valor_total': float(valor_total),
-            'pendentes': pendentes,
-            'aprovados': aprovados,
-            'pagos': pagos,
-            'rejeitados': rejeitados,
-            'novos_mes': novos_mes
+            'total': snap['total'],
+            'valor_total': snap['valor_total'],
+            'pendentes': snap['pendentes'],
+            'aprovados': snap['aprovados'],
+            'pagos': snap['pagos'],
+            'rejeitados': snap['rejeitados'],
+            'novos_mes': snap['novos_mes']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/stats/contratos')
 @login_required
+@etag_condicional('stats-contratos')
 def api_stats_contratos():
     """API para estatísticas de contratos"""
     try:
-        from sqlalchemy import func
-        
-        total = Contrato.query.count()
-        ativos = Contrato.query.filter(func.upper(Contrato.status) == 'ATIVO').count()
-        
-        # Valor total dos contratos ativos
-        valor_total = (db.session.query(func.sum(Contrato.valor_total))
-                       .filter(func.upper(Contrato.status) == 'ATIVO')
-                       .scalar()) or 0
-        
-        # Contratos por categoria de tempo
-        hoje = date.today()
-        contratos = Contrato.query.filter(
-            func.upper(Contrato.status) == 'ATIVO',
-            Contrato.data_fim.isnot(None)
-        ).all()
-        
-        criticos = 0
-        atencao = 0
-        normais = 0
-        
-        for contrato in contratos:
-            if contrato.data_fim:
-                dias_restantes = (contrato.data_fim - hoje).days
-                if dias_restantes <= 30:
-                    criticos += 1
-                elif dias_restantes <= 60:
-                    atencao += 1
-                else:
-                    normais += 1
-        
+        from utils.kpis import snapshot_contratos
+        snap = snapshot_contratos()
+
         return jsonify({
-            'total': total,
-            'ativos': ativos,
-            'valor_total': float(valor_total),
-            'criticos': criticos,
-            'atencao': atencao,
-            'normais': normais
+            'total': snap['total'],
+            'ativos': snap['ativos'],
+            'valor_total': snap['valor_ativos'],
+            'criticos': snap['criticos'],
+            'atencao': snap['atencao'],
+            'normais': snap['normais']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -714,6 +803,7 @@ def api_empenhos_recentes():
 # API para widgets específicos do dashboard drag-drop
 @app.route('/relatorios/api/widget-data/<widget_id>')
 @login_required
+@etag_condicional('widget-data')
 def api_widget_data(widget_id):
     """API genérica para dados de widgets do dashboard"""
     try:
@@ -727,24 +817,20 @@ def api_widget_data(widget_id):
             })
         
         elif widget_id == 'kpi-empenhos':
-            total = Empenho.query.count()
-            valor_total = (db.session.query(func.sum(Empenho.valor_empenhado))
-                          .scalar()) or 0
+            from utils.kpis import snapshot_empenhos
+            snap = snapshot_empenhos()
             return jsonify({
-                'total': total,
-                'valor_total': float(valor_total)
+                'total': snap['total'],
+                'valor_total': snap['valor_total']
             })
         
         elif widget_id == 'kpi-contratos':
-            total = Contrato.query.count()
-            ativos = Contrato.query.filter(func.upper(Contrato.status) == 'ATIVO').count()
-            valor_total = (db.session.query(func.sum(Contrato.valor_total))
-                           .filter(func.upper(Contrato.status) == 'ATIVO')
-                           .scalar()) or 0
+            from utils.kpis import snapshot_contratos
+            snap = snapshot_contratos()
             return jsonify({
-                'total': total,
-                'ativos': ativos,
-                'valor_total': float(valor_total)
+                'total': snap['total'],
+                'ativos': snap['ativos'],
+                'valor_total': snap['valor_ativos']
             })
         
         elif widget_id == 'grafico-mensal':
@@ -854,7 +940,7 @@ def dashboard_executivo():
         # Estatísticas básicas
         total_empenhos = Empenho.query.count()
         total_contratos = Contrato.query.count()
-        contratos_ativos = Contrato.query.filter(func.upper(Contrato.status) == 'ATIVO').count()
+        contratos_ativos = Contrato.query.filter(Contrato.status == StatusContrato.ATIVO.value).count()
 
         # Cálculo do valor total (sum of valor_total)
         valor_total = db.session.query(db.func.sum(Contrato.valor_total)).scalar() or 0
@@ -864,7 +950,7 @@ def dashboard_executivo():
 
         # Buscar todos os contratos ativos com datas de fim
         contratos = Contrato.query.filter(
-            func.upper(Contrato.status) == 'ATIVO',
+            Contrato.status == StatusContrato.ATIVO.value,
             Contrato.data_fim.isnot(None)
         ).all()
 
@@ -979,6 +1065,9 @@ def create_tables():
         except Exception as e:
             print(f"⚠️ Aviso ao criar tabelas: {e}")
 
+        preparar_busca()
+        construir_agregados()
+
         try:
             # Criar usuário admin padrão se não existir
             admin = User.query.filter_by(username='admin').first()
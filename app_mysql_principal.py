@@ -6,6 +6,9 @@ Sistema de Empenhos/Contratos/Notas – versão corrigida e consolidada
 - Ajusta LoginManager (login_view = 'login')
 - Ajusta filtros de busca usando sqlalchemy.or_
 - KPIs compatíveis com colunas dos modelos
+
+Obs.: o app.py principal também roda em MySQL/PostgreSQL pelo perfil de banco
+(DB_PERFIL=mysql python app.py; ver utils/banco.py) - prefira-o a esta cópia.
 """
 
 from datetime import datetime, date, timedelta
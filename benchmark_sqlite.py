@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark de concorrência leitura/gravação no SQLite, antes e depois da
+configuração de utils/banco.py (WAL, synchronous=NORMAL, busy_timeout, pool)
+e com a separação leitura/gravação + fila de gravação (utils/gravador.py).
+
+Simula o waitress do run_alta_demanda.py: N threads lendo (consultas de
+painel) e M threads gravando (mensagens de chat, edições) ao mesmo tempo num
+banco temporário, e mostra operações/s, latência p95 e quantas operações
+falharam com "database is locked".
+
+Uso: python benchmark_sqlite.py [--leitores 24] [--gravadores 6] [--segundos 5]
+                               [--synchronous NORMAL|FULL]
+     (--gravadores 24 --leitores 6 para carga de chat, com muitas gravações;
+      --synchronous FULL para commits duráveis, onde o commit em lote rende mais)
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from utils.banco import PRAGMAS_SQLITE, opcoes_engine, registrar_pragmas, pragmas_atuais, criar_engine_leitura
+from utils.gravador import FilaGravacao
+
+LINHAS_INICIAIS = 20000
+
+
+def _engine_configurado(uri):
+    engine = create_engine(uri, **opcoes_engine(uri, 'alta_demanda'))
+    registrar_pragmas(engine)
+    return engine
+
+
+def _mesmo_engine(engine):
+    """Leituras e gravações (uma transação por gravação) no mesmo pool."""
+    def ler():
+        with engine.connect() as conn:
+            _leitura(conn)
+
+    def gravar():
+        with engine.begin() as conn:
+            _gravacao(conn)
+    return engine, ler, gravar
+
+
+def _separado(uri):
+    """Leituras no pool só de leitura; gravações pela fila com commit em lote."""
+    engine = _engine_configurado(uri)
+    leitura = criar_engine_leitura(uri, 'alta_demanda')
+    fila = FilaGravacao(engine).iniciar()
+
+    def ler():
+        with leitura.connect() as conn:
+            _leitura(conn)
+    return engine, ler, lambda: fila.executar(_gravacao)
+
+
+CONFIGURACOES = {
+    # Como o app.py configurava antes: só check_same_thread, journal padrão (DELETE)
+    'antes': lambda uri: _mesmo_engine(create_engine(uri, connect_args={'check_same_thread': False})),
+    'depois': lambda uri: _mesmo_engine(_engine_configurado(uri)),
+    'fila_gravacao': _separado,
+}
+
+
+def preparar(uri):
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE lancamentos (id INTEGER PRIMARY KEY, sala INTEGER, valor REAL, criado_em REAL)'))
+        conn.execute(text('CREATE INDEX ix_lancamentos_sala ON lancamentos (sala, id)'))
+        conn.execute(text('INSERT INTO lancamentos (sala, valor, criado_em) VALUES (:s, :v, :t)'),
+                     [{'s': i % 50, 'v': i * 1.5, 't': time.time()} for i in range(LINHAS_INICIAIS)])
+    engine.dispose()
+
+
+def _leitura(conn):
+    sala = random.randrange(50)
+    conn.execute(text('SELECT COUNT(*), SUM(valor) FROM lancamentos WHERE sala = :s'), {'s': sala}).fetchone()
+    conn.execute(text('SELECT id, valor FROM lancamentos WHERE sala = :s ORDER BY id DESC LIMIT 50'), {'s': sala}).fetchall()
+
+
+def _gravacao(conn):
+    conn.execute(text('INSERT INTO lancamentos (sala, valor, criado_em) VALUES (:s, :v, :t)'),
+                 {'s': random.randrange(50), 'v': random.random() * 1000, 't': time.time()})
+
+
+def _trabalhador(operacao, fim, resultado, lock):
+    latencias, erros = [], 0
+    while time.monotonic() < fim:
+        inicio = time.perf_counter()
+        try:
+            operacao()
+            latencias.append(time.perf_counter() - inicio)
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            erros += 1
+    with lock:
+        resultado['latencias'].extend(latencias)
+        resultado['erros'] += erros
+
+
+def _p95(valores):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[int(len(valores) * 0.95) - 1 if len(valores) > 1 else 0] * 1000
+
+
+def medir(nome, leitores, gravadores, segundos):
+    pasta = tempfile.mkdtemp(prefix='bench_sqlite_')
+    uri = f"sqlite:///{os.path.join(pasta, 'bench.db')}"
+    try:
+        preparar(uri)
+        engine, ler, gravar = CONFIGURACOES[nome](uri)
+        resultados = {tipo: {'latencias': [], 'erros': 0} for tipo in ('leitura', 'gravacao')}
+        lock = threading.Lock()
+        fim = time.monotonic() + segundos
+        threads = [threading.Thread(target=_trabalhador, args=(ler, fim, resultados['leitura'], lock))
+                   for _ in range(leitores)]
+        threads += [threading.Thread(target=_trabalhador, args=(gravar, fim, resultados['gravacao'], lock))
+                    for _ in range(gravadores)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        pragmas = pragmas_atuais(engine)
+        engine.dispose()
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    print(f"\n📊 {nome} (journal_mode={pragmas.get('journal_mode')}, synchronous={pragmas.get('synchronous')}, "
+          f"busy_timeout={pragmas.get('busy_timeout')})")
+    for tipo, r in resultados.items():
+        qtd = len(r['latencias'])
+        print(f"   - {tipo:9s}: {qtd / segundos:8.0f} ops/s | p95 {_p95(r['latencias']):7.1f} ms | "
+              f"{r['erros']} 'database is locked'")
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--leitores', type=int, default=24)
+    parser.add_argument('--gravadores', type=int, default=6)
+    parser.add_argument('--segundos', type=float, default=5)
+    parser.add_argument('--synchronous', default=PRAGMAS_SQLITE['synchronous'], choices=('NORMAL', 'FULL'))
+    args = parser.parse_args()
+    PRAGMAS_SQLITE['synchronous'] = args.synchronous
+
+    print(f"🔄 {args.leitores} threads lendo + {args.gravadores} gravando por {args.segundos:g}s em cada configuração")
+    for nome in CONFIGURACOES:
+        medir(nome, args.leitores, args.gravadores, args.segundos)
+
+
+if __name__ == '__main__':
+    main()
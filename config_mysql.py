@@ -1,5 +1,9 @@
 # Configuração MySQL para XAMPP
-# Substitua as configurações do SQLite por MySQL
+# O app principal já roda em MySQL sem editar código: defina DB_PERFIL=mysql
+# (e DB_HOST, DB_PORTA, DB_USUARIO, DB_SENHA, DB_NOME) ou DATABASE_URL antes de
+# iniciar o app.py / run_production.py - ver utils/banco.py. Os valores abaixo
+# seguem as mesmas variáveis, com os padrões do XAMPP.
+import os
 
 # 1. Instalar dependências MySQL
 # pip install mysql-connector-python
@@ -7,11 +11,11 @@
 
 # 2. Configurações de conexão
 MYSQL_CONFIG = {
-    'host': 'localhost',
-    'port': 3306,
-    'user': 'root',
-    'password': '',  # Deixe vazio se não tem senha no XAMPP
-    'database': 'chat_empenhos',
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'port': int(os.environ.get('DB_PORTA', 3306)),
+    'user': os.environ.get('DB_USUARIO', 'root'),
+    'password': os.environ.get('DB_SENHA', ''),  # Deixe vazio se não tem senha no XAMPP
+    'database': os.environ.get('DB_NOME', 'chat_empenhos'),
     'charset': 'utf8mb4'
 }
 
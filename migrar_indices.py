@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Cria os índices compostos dos filtros quentes (empenhos, notas fiscais,
+contratos e mensagens do chat) em bancos já existentes e atualiza as
+estatísticas do planner (ANALYZE).
+
+Os índices são os declarados nos modelos; a inicialização do app também os
+cria, este script existe para rodar a migração (e o ANALYZE) explicitamente.
+"""
+
+import time
+from utils.app_principal import carregar_app
+from utils.indices import migrar_indices, indices_gerenciados
+
+app = carregar_app()
+
+def main():
+    print("🔧 Criando índices gerenciados...")
+    with app.app_context():
+        inicio = time.time()
+        for indice in indices_gerenciados():
+            colunas = ', '.join(str(c) for c in indice.expressions)
+            print(f"   - {indice.name} ({colunas})")
+        executados = migrar_indices(analisar=True)
+        print(f"✅ {executados} índices verificados/criados e ANALYZE concluído em {time.time() - inicio:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Aplica as migrações de schema pendentes (utils/migracoes.py) e lista o
+histórico registrado em schema_migracoes.
+
+A inicialização do app também aplica as pendentes; este script permite
+rodar a migração explicitamente (deploy, banco restaurado de backup).
+Use --listar para só mostrar o que está pendente.
+"""
+
+import sys
+from utils.app_principal import carregar_app
+from utils.migracoes import MIGRACOES, aplicar_migracoes, pendentes
+
+app = carregar_app()
+
+def main():
+    with app.app_context():
+        faltando = pendentes()
+        print(f"🔧 {len(MIGRACOES)} migrações conhecidas, {len(faltando)} pendentes")
+        for versao in faltando:
+            print(f"   - {versao}")
+        if '--listar' in sys.argv or not faltando:
+            return
+        aplicadas = aplicar_migracoes()
+        print(f"✅ {len(aplicadas)} migrações aplicadas")
+
+if __name__ == '__main__':
+    main()
@@ -1,236 +1,146 @@
 #!/usr/bin/env python3
 """
-Script para migrar dados do SQLite para MySQL (XAMPP)
+Migra os dados do SQLite para MySQL/PostgreSQL (ou outro SQLite, para testar).
+
+Copia todas as tabelas do banco de origem em blocos, com INSERTs em lote,
+várias tabelas em paralelo e retomada automática: se a cópia parar no meio,
+basta rodar o mesmo comando de novo. No fim, confere contagem de linhas e
+checksum de cada tabela nos dois bancos (utils/copia_banco.py).
+
+O destino vem de --destino ou do mesmo perfil usado pelo app
+(DATABASE_URL, ou DB_PERFIL=mysql|postgresql + DB_HOST/DB_PORTA/DB_USUARIO/
+DB_SENHA/DB_NOME - ver utils/banco.py). As tabelas que ainda não existem no
+destino são criadas com a estrutura da origem.
+
+Uso:
+    DB_PERFIL=mysql DB_SENHA=... python migrate_to_mysql.py
+    python migrate_to_mysql.py --destino sqlite:///copia.db      # teste local
+    python migrate_to_mysql.py --verificar                        # só confere
+    python migrate_to_mysql.py --reiniciar --tabelas empenhos,notas_fiscais
 """
 
-import sqlite3
-import mysql.connector
-from mysql.connector import Error
+import argparse
 import os
+import sys
+import time
 from datetime import datetime
 
-class DataMigrator:
-    def __init__(self):
-        # Configuração SQLite
-        self.sqlite_db = 'instance/data.db'
-        self.sqlite_chat_db = 'chat_msn.db'
-        
-        # Configuração MySQL
-        self.mysql_config = {
-            'host': 'localhost',
-            'port': 3306,
-            'user': 'root',
-            'password': '',  # Senha padrão XAMPP (vazia)
-            'database': 'chat_empenhos',
-            'charset': 'utf8mb4'
-        }
-    
-    def connect_sqlite(self, db_path):
-        """Conecta ao SQLite"""
-        try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row  # Para acessar colunas por nome
-            return conn
-        except Exception as e:
-            print(f"❌ Erro ao conectar SQLite {db_path}: {e}")
-            return None
-    
-    def connect_mysql(self):
-        """Conecta ao MySQL"""
-        try:
-            conn = mysql.connector.connect(**self.mysql_config)
-            return conn
-        except Error as e:
-            print(f"❌ Erro ao conectar MySQL: {e}")
-            return None
-    
-    def check_mysql_connection(self):
-        """Verifica se MySQL está rodando"""
-        print("🔍 Verificando conexão MySQL...")
-        conn = self.connect_mysql()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT VERSION()")
-            version = cursor.fetchone()
-            print(f"✅ MySQL conectado! Versão: {version[0]}")
-            conn.close()
-            return True
-        return False
-    
-    def backup_sqlite_data(self):
-        """Faz backup dos dados SQLite"""
-        print("💾 Fazendo backup dos dados SQLite...")
-        
-        backup_dir = f"backup_sqlite_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # Backup banco principal
-        if os.path.exists(self.sqlite_db):
-            os.system(f'copy "{self.sqlite_db}" "{backup_dir}\\data_backup.db"')
-            print(f"✅ Backup principal: {backup_dir}\\data_backup.db")
-        
-        # Backup banco chat
-        if os.path.exists(self.sqlite_chat_db):
-            os.system(f'copy "{self.sqlite_chat_db}" "{backup_dir}\\chat_backup.db"')
-            print(f"✅ Backup chat: {backup_dir}\\chat_backup.db")
-    
-    def migrate_main_tables(self):
-        """Migra tabelas principais (empenhos, contratos, etc.)"""
-        print("📊 Migrando dados principais...")
-        
-        sqlite_conn = self.connect_sqlite(self.sqlite_db)
-        mysql_conn = self.connect_mysql()
-        
-        if not sqlite_conn or not mysql_conn:
-            return False
-        
-        try:
-            # Migrar tabela users
-            self.migrate_table(
-                sqlite_conn, mysql_conn, 
-                'users', 
-                ['id', 'username', 'email', 'password_hash', 'role', 'created_at']
-            )
-            
-            # Migrar tabela empenho
-            self.migrate_table(
-                sqlite_conn, mysql_conn,
-                'empenho',
-                ['id', 'numero', 'valor', 'data_emissao', 'descricao', 'responsavel']
-            )
-            
-            # Migrar tabela contrato
-            self.migrate_table(
-                sqlite_conn, mysql_conn,
-                'contrato',
-                ['id', 'numero', 'objeto', 'valor', 'data_inicio', 'data_fim', 'empresa']
-            )
-            
-            # Migrar tabela nota_fiscal
-            self.migrate_table(
-                sqlite_conn, mysql_conn,
-                'nota_fiscal',
-                ['id', 'numero', 'valor', 'data_emissao', 'fornecedor', 'descricao']
-            )
-            
-            print("✅ Migração de dados principais concluída!")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Erro na migração: {e}")
-            return False
-        finally:
-            sqlite_conn.close()
-            mysql_conn.close()
-    
-    def migrate_chat_tables(self):
-        """Migra tabelas do chat MSN"""
-        print("💬 Migrando dados do chat...")
-        
-        sqlite_conn = self.connect_sqlite(self.sqlite_chat_db)
-        mysql_conn = self.connect_mysql()
-        
-        if not sqlite_conn or not mysql_conn:
-            return False
-        
-        try:
-            # Migrar salas de chat
-            self.migrate_table(
-                sqlite_conn, mysql_conn,
-                'chat_msn_room',
-                ['id', 'name', 'description', 'created_at', 'is_active']
-            )
-            
-            # Migrar mensagens
-            self.migrate_table(
-                sqlite_conn, mysql_conn,
-                'chat_msn_message',
-                ['id', 'room_id', 'user_id', 'content', 'message_type', 'created_at']
-            )
-            
-            print("✅ Migração do chat concluída!")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Erro na migração do chat: {e}")
-            return False
-        finally:
-            sqlite_conn.close()
-            mysql_conn.close()
-    
-    def migrate_table(self, sqlite_conn, mysql_conn, table_name, columns):
-        """Migra uma tabela específica"""
-        print(f"📋 Migrando tabela: {table_name}")
-        
-        # Ler dados do SQLite
-        cursor_sqlite = sqlite_conn.cursor()
-        cursor_sqlite.execute(f"SELECT * FROM {table_name}")
-        rows = cursor_sqlite.fetchall()
-        
-        if not rows:
-            print(f"⚠️  Tabela {table_name} está vazia")
-            return
-        
-        # Inserir no MySQL
-        cursor_mysql = mysql_conn.cursor()
-        
-        # Montar query de inserção
-        placeholders = ', '.join(['%s'] * len(columns))
-        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-        
-        # Inserir dados
-        data_to_insert = []
-        for row in rows:
-            # Converter Row para lista
-            row_data = [row[col] if col in row.keys() else None for col in columns]
-            data_to_insert.append(tuple(row_data))
-        
-        cursor_mysql.executemany(query, data_to_insert)
-        mysql_conn.commit()
-        
-        print(f"✅ {len(data_to_insert)} registros migrados para {table_name}")
-    
-    def run_migration(self):
-        """Executa a migração completa"""
-        print("🚀 INICIANDO MIGRAÇÃO SQLITE → MYSQL")
-        print("=" * 50)
-        
-        # 1. Verificar conexão MySQL
-        if not self.check_mysql_connection():
-            print("❌ MySQL não está acessível!")
-            print("Verifique se:")
-            print("- XAMPP está rodando")
-            print("- MySQL está iniciado")
-            print("- Banco 'chat_empenhos' foi criado")
-            return False
-        
-        # 2. Fazer backup
-        self.backup_sqlite_data()
-        
-        # 3. Migrar dados principais
-        if os.path.exists(self.sqlite_db):
-            print(f"\n📊 Migrando banco principal: {self.sqlite_db}")
-            self.migrate_main_tables()
-        else:
-            print("⚠️  Banco principal não encontrado")
-        
-        # 4. Migrar dados do chat
-        if os.path.exists(self.sqlite_chat_db):
-            print(f"\n💬 Migrando banco chat: {self.sqlite_chat_db}")
-            self.migrate_chat_tables()
+from utils.banco import uri_banco
+from utils.copia_banco import (LOTE_PADRAO, backup_sqlite, copiar_tabela, criar_engine,
+                               criar_esquema, executar_em_paralelo, niveis_dependencia, reiniciar,
+                               tabelas_copiaveis, verificar_tabela)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--origem', default=os.path.join(BASE_DIR, 'empenhos.db'), help='arquivo SQLite de origem')
+    parser.add_argument('--destino', help='URL SQLAlchemy do destino (padrão: perfil do ambiente)')
+    parser.add_argument('--tabelas', help='só estas tabelas (separadas por vírgula)')
+    parser.add_argument('--lote', type=int, default=LOTE_PADRAO, help='linhas por bloco/transação')
+    parser.add_argument('--processos', type=int, default=min(4, os.cpu_count() or 1),
+                        help='tabelas copiadas ao mesmo tempo')
+    parser.add_argument('--reiniciar', action='store_true', help='apaga o que já foi copiado e começa do zero')
+    parser.add_argument('--verificar', action='store_true', help='só confere contagens e checksums')
+    parser.add_argument('--sem-backup', action='store_true', help='não copia o arquivo SQLite antes')
+    return parser.parse_args()
+
+
+def _verificar(origem_url, destino_url, nomes, args):
+    print(f"\n🔍 Conferindo {len(nomes)} tabelas (contagem + checksum)...")
+    divergentes = 0
+    tarefas = [(origem_url, destino_url, nome, args.lote) for nome in nomes]
+    for r in sorted(executar_em_paralelo(verificar_tabela, tarefas, args.processos), key=lambda r: r['tabela']):
+        if r['erro']:
+            divergentes += 1
+            print(f"   ❌ {r['tabela']}: {r['erro']}")
+        elif r['ok']:
+            print(f"   ✅ {r['tabela']}: {r['origem'][0]} linhas, checksum {r['origem'][1]}")
         else:
-            print("⚠️  Banco chat não encontrado")
-        
-        print("\n🎉 MIGRAÇÃO CONCLUÍDA!")
-        print("Agora você pode usar os aplicativos com MySQL:")
-        print("- python app_mysql_principal.py")
-        print("- python app_mysql_chat.py")
-        
-        return True
+            divergentes += 1
+            print(f"   ❌ {r['tabela']}: origem {r['origem'][0]} linhas/{r['origem'][1]}, "
+                  f"destino {r['destino'][0]} linhas/{r['destino'][1]}")
+    return divergentes == 0
+
 
 def main():
-    migrator = DataMigrator()
-    migrator.run_migration()
+    args = _argumentos()
+    if not os.path.exists(args.origem):
+        print(f"❌ Banco de origem não encontrado: {args.origem}")
+        return 1
+    origem_url = f"sqlite:///{os.path.abspath(args.origem)}"
+    destino_url = args.destino or uri_banco(None, None)
+    if not destino_url or destino_url == origem_url:
+        print("❌ Informe o destino (--destino URL, DATABASE_URL ou DB_PERFIL=mysql|postgresql)")
+        return 1
+
+    origem, destino = criar_engine(origem_url), criar_engine(destino_url)
+    print("🚀 MIGRAÇÃO DE DADOS")
+    print("=" * 50)
+    print(f"   Origem : {origem_url}")
+    print(f"   Destino: {destino.url.render_as_string(hide_password=True)}")
+    try:
+        with destino.connect():
+            pass
+    except Exception as e:
+        print(f"❌ Destino não está acessível: {e}")
+        return 1
+
+    nomes = tabelas_copiaveis(origem)
+    if args.tabelas:
+        pedidas = {n.strip() for n in args.tabelas.split(',') if n.strip()}
+        nomes = [n for n in nomes if n in pedidas]
+    if not nomes:
+        print("⚠️ Nenhuma tabela para copiar")
+        return 0
+
+    if args.verificar:
+        return 0 if _verificar(origem_url, destino_url, nomes, args) else 2
+
+    if not args.sem_backup:
+        pasta = os.path.join(BASE_DIR, f"backup_sqlite_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        print(f"💾 Backup: {backup_sqlite(args.origem, pasta)}")
+    if args.reiniciar:
+        reiniciar(destino_url, nomes)
+        print("🧹 Dados copiados anteriormente removidos")
+
+    criadas = criar_esquema(origem, destino, nomes)
+    if criadas:
+        print(f"🏗️ {len(criadas)} tabelas criadas no destino")
+    niveis = niveis_dependencia(origem, nomes)
+    origem.dispose()
+    destino.dispose()
+
+    inicio = time.monotonic()
+    total = 0
+    for i, nivel in enumerate(niveis, 1):
+        print(f"\n📋 Nível {i}/{len(niveis)}: {len(nivel)} tabelas")
+        tarefas = [(origem_url, destino_url, nome, args.lote) for nome in nivel]
+        erros = 0
+        for r in executar_em_paralelo(copiar_tabela, tarefas, args.processos):
+            if r['erro']:
+                erros += 1
+                print(f"   ❌ {r['tabela']}: {r['erro']}")
+                continue
+            total += r['copiadas']
+            situacao = 'já copiada' if r['retomada'] and not r['copiadas'] else (
+                'retomada' if r['retomada'] else 'copiada')
+            print(f"   ✅ {r['tabela']}: {r['copiadas']} linhas ({situacao}, {r['linhas']} no total)")
+        if erros:
+            # Os próximos níveis dependem deste; rodar de novo continua de onde parou
+            print(f"\n❌ {erros} tabelas com erro; corrija e execute novamente para continuar")
+            return 1
+
+    decorrido = time.monotonic() - inicio
+    print(f"\n⏱️ {total} linhas em {decorrido:.1f}s ({total / max(decorrido, 0.001):.0f} linhas/s)")
+    if not _verificar(origem_url, destino_url, nomes, args):
+        print("\n❌ Há tabelas divergentes entre origem e destino")
+        return 2
+    print("\n🎉 MIGRAÇÃO CONCLUÍDA!")
+    print("Para usar o novo banco, inicie o app com o mesmo DATABASE_URL/DB_PERFIL.")
+    return 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
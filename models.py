@@ -3,15 +3,61 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from decimal import Decimal
+from sqlalchemy.orm import validates
+import enum
+import json
 
-# Inicializar SQLAlchemy diretamente
-db = SQLAlchemy()
+from utils.banco import SessaoRoteada
+
+# Inicializar SQLAlchemy diretamente (SELECTs no pool de leitura quando configurado; ver utils/banco.py)
+db = SQLAlchemy(session_options={"class_": SessaoRoteada})
 
 def create_models(database_instance):
     """Cria e retorna todas as classes de modelo com a instância db fornecida"""
     global db
     db = database_instance
 
+
+def normalizar_status(valor):
+    """Status gravado sempre em maiúsculas, sem espaços nas pontas ('em aberto ' -> 'EM_ABERTO').
+
+    Com o valor canônico no banco os filtros comparam a coluna direto
+    (``status == 'ATIVO'``) e usam os índices ``ix_*_status_*``, em vez de
+    ``upper(status)`` que obriga a varrer a tabela.
+    """
+    if valor is None:
+        return None
+    valor = str(valor.value if isinstance(valor, enum.Enum) else valor).strip().upper()
+    return '_'.join(valor.split())
+
+
+class StatusContrato(str, enum.Enum):
+    ATIVO = 'ATIVO'
+    INATIVO = 'INATIVO'
+    VENCIDO = 'VENCIDO'
+    RESCINDIDO = 'RESCINDIDO'
+    FINALIZADO = 'FINALIZADO'
+    ENCERRADO = 'ENCERRADO'
+
+
+class StatusEmpenho(str, enum.Enum):
+    PENDENTE = 'PENDENTE'
+    APROVADO = 'APROVADO'
+    PAGO = 'PAGO'
+    REJEITADO = 'REJEITADO'
+    ATIVO = 'ATIVO'
+    PARCIAL = 'PARCIAL'
+    LIQUIDADO = 'LIQUIDADO'
+    CANCELADO = 'CANCELADO'
+
+
+class StatusNota(str, enum.Enum):
+    EM_ABERTO = 'EM_ABERTO'
+    PROCESSANDO = 'PROCESSANDO'
+    PAGO = 'PAGO'
+    CANCELADO = 'CANCELADO'
+    VENCIDO = 'VENCIDO'
+
 class User(UserMixin, db.Model):
     """Modelo para usuários do sistema"""
     __tablename__ = 'users'
@@ -47,6 +93,11 @@ class User(UserMixin, db.Model):
 class Contrato(db.Model):
     """Modelo para contratos"""
     __tablename__ = 'contratos'
+    __table_args__ = (
+        # Filtros quentes: contratos ativos/vencendo (painel, alertas, workflow)
+        db.Index('ix_contratos_status_data_fim', 'status', 'data_fim'),
+        db.Index('ix_contratos_data_fim', 'data_fim'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -95,7 +146,7 @@ class Contrato(db.Model):
     fiscal_suplente = db.Column(db.String(200))  # Fiscal suplente
     gestor_fiscal = db.Column(db.String(200))  # Campo legado - compatibilidade
     gestor_superior = db.Column(db.String(200))  # Campo legado - compatibilidade
-    status = db.Column(db.String(20), default='ATIVO')
+    status = db.Column(db.String(20), default=StatusContrato.ATIVO.value)  # valores de StatusContrato
     
     # Informações adicionais de contratos municipais
     modalidade_licitacao = db.Column(db.String(50))  # Pregão, Tomada de Preços, etc.
@@ -136,6 +187,10 @@ class Contrato(db.Model):
         """Calcula o prazo total incluindo prorrogações"""
         return self.data_fim  # Já inclui as prorrogações
     
+    @validates('status')
+    def _validar_status(self, chave, valor):
+        return normalizar_status(valor)
+    
     def __repr__(self):
         return f'<Contrato {self.numero_contrato}>'
 
@@ -185,6 +240,15 @@ class AditivoContratual(db.Model):
 class Empenho(db.Model):
     """Modelo para empenhos"""
     __tablename__ = 'empenhos'
+    __table_args__ = (
+        # Chaves da paginação por cursor (utils/paginacao.py)
+        db.Index('ix_empenhos_data_criacao_id', 'data_criacao', 'id'),
+        # Filtros quentes: status + vencimento (alertas), período (relatórios), empenhos do contrato
+        db.Index('ix_empenhos_status_data_vencimento', 'status', 'data_vencimento'),
+        db.Index('ix_empenhos_data_vencimento', 'data_vencimento'),
+        db.Index('ix_empenhos_data_empenho_id', 'data_empenho', 'id'),
+        db.Index('ix_empenhos_contrato_id', 'contrato_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -220,7 +284,7 @@ class Empenho(db.Model):
     periodo_referencia = db.Column(db.String(20))
     
     # Status e observações
-    status = db.Column(db.String(20), default='PENDENTE')
+    status = db.Column(db.String(20), default=StatusEmpenho.PENDENTE.value)  # valores de StatusEmpenho
     nota_fiscal = db.Column(db.String(50))
     observacoes = db.Column(db.Text)
     saldo_remanescente = db.Column(db.Numeric(15, 2), default=0)
@@ -238,7 +302,7 @@ class Empenho(db.Model):
     cpf_cnpj_credor = db.Column(db.String(20))  # CPF/CNPJ do credor
     
     # Metadados
-    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # chave do cursor da listagem
     data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     contrato_id = db.Column(db.Integer, db.ForeignKey('contratos.id'))
@@ -246,6 +310,10 @@ class Empenho(db.Model):
     # Relacionamentos
     usuario = db.relationship('User', backref='empenhos')
     
+    @validates('status')
+    def _validar_status(self, chave, valor):
+        return normalizar_status(valor)
+    
     def __repr__(self):
         return f'<Empenho {self.numero_empenho}>'
     
@@ -305,6 +373,12 @@ class Empenho(db.Model):
 class NotaFiscal(db.Model):
     """Modelo para gerenciar notas fiscais"""
     __tablename__ = 'notas_fiscais'
+    __table_args__ = (
+        db.Index('ix_notas_fiscais_data_emissao_id', 'data_emissao', 'id'),
+        db.Index('ix_notas_fiscais_empenho_id', 'empenho_id'),
+        db.Index('ix_notas_fiscais_status_data_vencimento', 'status', 'data_vencimento'),
+        db.Index('ix_notas_fiscais_data_vencimento', 'data_vencimento'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -337,8 +411,8 @@ class NotaFiscal(db.Model):
     valor_liquido = db.Column(db.Numeric(15, 2), nullable=False)
     
     # Status e controle
-    status = db.Column(db.String(20), nullable=False, default='EM_ABERTO')
-    # Status possíveis: EM_ABERTO, PROCESSANDO, PAGO, CANCELADO, VENCIDO
+    status = db.Column(db.String(20), nullable=False, default=StatusNota.EM_ABERTO.value)
+    # Status possíveis: EM_ABERTO, PROCESSANDO, PAGO, CANCELADO, VENCIDO (StatusNota)
     
     # Informações de pagamento
     forma_pagamento = db.Column(db.String(50))  # PIX, TED, CHEQUE, etc.
@@ -357,6 +431,10 @@ class NotaFiscal(db.Model):
     usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     usuario = db.relationship('User', backref=db.backref('notas_fiscais', lazy=True))
     
+    @validates('status')
+    def _validar_status(self, chave, valor):
+        return normalizar_status(valor)
+    
     def __repr__(self):
         return f'<NotaFiscal {self.numero_nota} - {self.status}>'
     
@@ -580,3 +658,91 @@ class Comunicacao(db.Model):
     
     def __repr__(self):
         return f'<Comunicacao {self.id}: {self.titulo}>'
+
+
+class DashboardAgregado(db.Model):
+    """Agregados materializados do painel (mantidos por hooks em utils/agregados.py)"""
+    __tablename__ = 'dashboard_agregados'
+    __table_args__ = (
+        db.UniqueConstraint('dimensao', 'chave', name='uq_dashboard_agregados_dim_chave'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dimensao = db.Column(db.String(40), nullable=False)  # empenho_mes, contrato_status, etc.
+    chave = db.Column(db.String(255), nullable=False, default='')  # valor da dimensão (mês, status, fornecedor...)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DashboardAgregado {self.dimensao}:{self.chave} = {self.quantidade}>'
+
+
+class PresencaUsuario(db.Model):
+    """Último sinal de vida de cada usuário no chat (gravado em lote por utils/presenca.py)"""
+    __tablename__ = 'presenca_usuarios'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_seen = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<PresencaUsuario {self.user_id} {self.last_seen}>'
+
+
+class Job(db.Model):
+    """Tarefa pesada executada em segundo plano (utils/jobs.py)"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    tipo = db.Column(db.String(40), nullable=False)  # exportar_pdf, exportar_excel, importar_planilha, backup_csv
+    status = db.Column(db.String(20), nullable=False, default='PENDENTE', index=True)  # PENDENTE, EXECUTANDO, CONCLUIDO, ERRO
+    progresso = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    mensagem = db.Column(db.String(255))
+    parametros = db.Column(db.Text)  # JSON
+    resultado = db.Column(db.Text)  # JSON
+    arquivo = db.Column(db.String(500))  # caminho do arquivo gerado
+    nome_download = db.Column(db.String(255))
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    iniciado_em = db.Column(db.DateTime)
+    concluido_em = db.Column(db.DateTime)
+    
+    usuario = db.relationship('User', backref=db.backref('jobs', lazy='dynamic'))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'status': self.status,
+            'progresso': self.progresso,
+            'mensagem': self.mensagem,
+            'resultado': json.loads(self.resultado) if self.resultado else None,
+            'pronto': self.status == 'CONCLUIDO' and bool(self.arquivo),
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'iniciado_em': self.iniciado_em.isoformat() if self.iniciado_em else None,
+            'concluido_em': self.concluido_em.isoformat() if self.concluido_em else None,
+        }
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.tipo} {self.status} {self.progresso}%>'
+
+
+class ImportacaoCheckpoint(db.Model):
+    """Ponto de retomada de importações em lotes (ImportUtils.import_from_file)"""
+    __tablename__ = 'importacoes_checkpoint'
+    __table_args__ = (
+        db.Index('ix_importacoes_checkpoint_assinatura', 'assinatura', 'usuario_id', 'status'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    assinatura = db.Column(db.String(40), nullable=False)  # sha1 do conteúdo do arquivo
+    nome_arquivo = db.Column(db.String(255))
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='EM_ANDAMENTO')  # EM_ANDAMENTO, CONCLUIDA
+    linhas_processadas = db.Column(db.Integer, nullable=False, default=0)  # linhas de dados já gravadas (commit)
+    importados = db.Column(db.Integer, nullable=False, default=0)
+    erros = db.Column(db.Integer, nullable=False, default=0)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<ImportacaoCheckpoint {self.nome_arquivo} {self.linhas_processadas} linhas {self.status}>'
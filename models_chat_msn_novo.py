@@ -29,12 +29,18 @@ class ChatMsnRoom(db.Model):
 
 class ChatMsnMember(db.Model):
     __tablename__ = "chat_msn_members"
+    __table_args__ = (
+        # Salas do usuário (lista de salas / contagem de não lidas)
+        db.Index("ix_chat_msn_members_user_room", "user_id", "room_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey("chat_msn_rooms.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     role = db.Column(db.String(20), nullable=False, default="member")  # 'owner' | 'admin' | 'member'
     joined_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Última mensagem lida (marca d'água): as de id maior são as não lidas
+    last_read_message_id = db.Column(db.Integer, default=0, nullable=False)
 
     room = db.relationship("ChatMsnRoom", back_populates="members")
     user = db.relationship("User", foreign_keys=[user_id])
@@ -45,12 +51,19 @@ class ChatMsnMember(db.Model):
             "room_id": self.room_id, 
             "user_id": self.user_id,
             "role": self.role, 
-            "joined_at": self.joined_at.isoformat() if self.joined_at else None
+            "joined_at": self.joined_at.isoformat() if self.joined_at else None,
+            "last_read_message_id": self.last_read_message_id
         }
 
 
 class ChatMsnMessage(db.Model):
     __tablename__ = "chat_msn_messages"
+    __table_args__ = (
+        # Histórico da sala em ordem cronológica
+        db.Index("ix_chat_msn_messages_room_created", "room_id", "created_at"),
+        # Janelas por id (since_id/before_id) e catch-up dos streams
+        db.Index("ix_chat_msn_messages_room_id", "room_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey("chat_msn_rooms.id"), nullable=False)
@@ -81,7 +94,7 @@ class ChatMsnAttachment(db.Model):
     __tablename__ = "chat_msn_attachments"
 
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer, db.ForeignKey("chat_msn_messages.id"), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey("chat_msn_messages.id"), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
@@ -30,6 +30,8 @@ class ChatMemberOffline(db.Model):
     __tablename__ = "chat_members"
     __table_args__ = (
         UniqueConstraint("room_id", "user_id", name="uq_room_user"),
+        # Salas do usuário (contagem de não lidas)
+        db.Index("ix_chat_members_user_room", "user_id", "room_id"),
         {"extend_existing": True},
     )
 
@@ -38,6 +40,8 @@ class ChatMemberOffline(db.Model):
     user_id  = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     role     = db.Column(db.String(20), nullable=False, default="member")  # 'owner' | 'admin' | 'member'
     joined_at= db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Última mensagem lida (marca d'água): as de id maior são as não lidas
+    last_read_message_id = db.Column(db.Integer, default=0, nullable=False)
 
     room = db.relationship("ChatRoomOffline", back_populates="members")
     user = db.relationship("User", foreign_keys=[user_id])
@@ -45,13 +49,18 @@ class ChatMemberOffline(db.Model):
     def to_dict(self):
         return {
             "id": self.id, "room_id": self.room_id, "user_id": self.user_id,
-            "role": self.role, "joined_at": self.joined_at.isoformat() if self.joined_at else None
+            "role": self.role, "joined_at": self.joined_at.isoformat() if self.joined_at else None,
+            "last_read_message_id": self.last_read_message_id
         }
 
 
 class ChatRoomMessageOffline(db.Model):
     __tablename__ = "chat_room_messages"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # Não lidas / catch-up por sala a partir de um id
+        db.Index("ix_chat_room_messages_room_id", "room_id", "id"),
+        {"extend_existing": True},
+    )
 
     id        = db.Column(db.Integer, primary_key=True)
     room_id   = db.Column(db.Integer, db.ForeignKey("chat_rooms.id"), nullable=False)
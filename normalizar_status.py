@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Normaliza o status já gravado em contratos, empenhos e notas fiscais
+('ativo', ' Pago', 'em aberto' -> 'ATIVO', 'PAGO', 'EM_ABERTO').
+
+Os modelos normalizam na gravação (models.normalizar_status) e a migração
+0005_normalizar_status corrige as linhas antigas na inicialização; este
+script serve para as que entrarem depois por SQL manual, para que os filtros
+por igualdade de status encontrem tudo pelo índice.
+Use --simular para só listar o que seria alterado.
+"""
+
+import sys
+import time
+from utils.app_principal import carregar_app
+from models import db, Contrato, Empenho, NotaFiscal, normalizar_status
+from utils.cache import cache, TAG_DADOS
+
+app = carregar_app()
+
+# modelo -> coluna de última atualização (muda a versão dos dados/ETag do painel)
+MODELOS = (
+    (Contrato, Contrato.data_atualizacao),
+    (Empenho, Empenho.data_atualizacao),
+    (NotaFiscal, NotaFiscal.updated_at),
+)
+
+def normalizar(simular=False):
+    """Retorna {tabela: linhas alteradas}; cada valor distinto vira um UPDATE pelo índice de status."""
+    alteradas = {}
+    agora = db.func.current_timestamp()
+    for modelo, col_atualizacao in MODELOS:
+        tabela = modelo.__tablename__
+        alteradas[tabela] = 0
+        valores = [v for (v,) in db.session.query(modelo.status).group_by(modelo.status)]
+        for antigo in valores:
+            novo = normalizar_status(antigo)
+            if antigo is None or novo == antigo:
+                continue
+            if simular:
+                qtd = modelo.query.filter(modelo.status == antigo).count()
+            else:
+                qtd = modelo.query.filter(modelo.status == antigo).update(
+                    {modelo.status: novo, col_atualizacao: agora}, synchronize_session=False)
+            print(f"   - {tabela}: '{antigo}' -> '{novo}' ({qtd} linhas)")
+            alteradas[tabela] += qtd
+    if simular:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        cache.invalidate_tag(TAG_DADOS)
+    return alteradas
+
+def main():
+    simular = '--simular' in sys.argv
+    print("🔄 Normalizando status" + (" (simulação)" if simular else "") + "...")
+    with app.app_context():
+        inicio = time.time()
+        alteradas = normalizar(simular)
+        total = sum(alteradas.values())
+        print(f"✅ {total} linhas {'a alterar' if simular else 'alteradas'} em {time.time() - inicio:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Reconstrói a tabela de agregados do painel (dashboard_agregados)
+a partir de empenhos, contratos e notas fiscais.
+
+Use após importações em massa, SQL manual ou migrações que não passam
+pelos hooks do SQLAlchemy.
+"""
+
+import time
+from utils.app_principal import carregar_app
+from models import db
+from utils.agregados import reconstruir_agregados
+
+app = carregar_app()
+
+def main():
+    print("🔄 Reconstruindo agregados do painel...")
+    with app.app_context():
+        db.create_all()
+        inicio = time.time()
+        linhas = reconstruir_agregados()
+        print(f"✅ {linhas} linhas de agregados geradas em {time.time() - inicio:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ API endpoints para acessar dados integrados entre contratos, empenhos e notas fi
 from flask import Blueprint, jsonify, request
 from sqlalchemy import text
 from extensions import db
+from utils.versao_dados import etag_condicional
 
 api_integracoes = Blueprint('api_integracoes', __name__, url_prefix='/api/integracoes')
 
@@ -125,6 +126,7 @@ def notas_integradas():
         }), 500
 
 @api_integracoes.route('/dashboard-summary')
+@etag_condicional('dashboard-summary')
 def dashboard_summary():
     """Retorna resumo para dashboard com dados integrados"""
     try:
@@ -2,6 +2,12 @@ from flask import Blueprint, render_template, request, jsonify, send_from_direct
 from flask_login import login_required, current_user
 from models import db, User
 from models_chat_msn_novo import ChatMsnRoom, ChatMsnMember, ChatMsnMessage, ChatMsnAttachment
+from utils.gravador import gravador
+from utils.eventos import (eventos, canal_sala, canal_usuario, resposta_sse, resposta_sem_stream,
+                           ultimo_id_da_requisicao, LimiteConexoes)
+from utils.nao_lidas import contador_nao_lidas, contar_nao_lidas, contar_nao_lidas_sala, marcar_lida
+from utils.paginacao import janela_por_id
+from utils.presenca import presenca
 from datetime import datetime
 import uuid
 import os
@@ -14,6 +20,10 @@ chat_msn = Blueprint('chat_msn', __name__, url_prefix='/chat-msn')
 UPLOAD_FOLDER = 'uploads/chat_msn'
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt', 'jpg', 'jpeg', 'png', 'gif'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+CATCHUP_MAXIMO = 200  # mensagens reenviadas quando um stream reconecta
+MENSAGENS_POR_PAGINA = 50
+MENSAGENS_MAXIMO = 100  # teto do ?limit= no histórico
+ESCOPO_NAO_LIDAS = 'msn'  # chave do chat MSN no contador de não lidas
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -28,76 +38,92 @@ def ensure_member(room_id, user_id):
         member = ChatMsnMember(room_id=room_id, user_id=user_id, role='member')
         db.session.add(member)
         db.session.commit()
+        contador_nao_lidas.invalidar(ESCOPO_NAO_LIDAS, user_id)
 
-def _ensure_chat_msn_schema():
-    """Garante que as tabelas MSN existem"""
-    from sqlalchemy import text
+def _nao_lidas(user_id):
+    """{room_id: não lidas} do usuário (contador em memória; consulta agregada só ao carregar)"""
+    return contador_nao_lidas.obter(ESCOPO_NAO_LIDAS, user_id,
+                                    lambda: contar_nao_lidas(ChatMsnMember, ChatMsnMessage, user_id))
+
+def _anexos_por_mensagem(message_ids):
+    """Anexos de várias mensagens em uma única consulta: {message_id: [dict]}"""
+    anexos = {}
+    if message_ids:
+        for att in ChatMsnAttachment.query.filter(ChatMsnAttachment.message_id.in_(message_ids)):
+            anexos.setdefault(att.message_id, []).append(att.to_dict())
+    return anexos
+
+def _mensagem_dict(m, u, attachments):
+    return {
+        "id": m.id,
+        "room_id": m.room_id,
+        "user_id": m.user_id,
+        "username": u.nome or u.username or u.email,
+        "content": m.content or '',
+        "message_type": m.message_type or 'text',
+        "created_at": (m.created_at or datetime.utcnow()).isoformat(),
+        "attachments": attachments
+    }
+
+def _publicar_mensagem(payload):
+    """Entrega a mensagem nova aos streams da sala e, em DMs, aos streams dos dois usuários"""
+    room_id = payload["room_id"]
+    contador_nao_lidas.nova_mensagem(ESCOPO_NAO_LIDAS, room_id, payload["user_id"])
+    eventos.publicar(canal_sala(room_id), 'message_created', payload, id=payload["id"])
+    room = ChatMsnRoom.query.get(room_id)
+    if room is not None and room.kind == 'dm':
+        for member in room.members:
+            eventos.publicar(canal_usuario(member.user_id), 'message_created', payload, id=payload["id"])
+
+def _valores(msg):
+    return {c.key: getattr(msg, c.key) for c in ChatMsnMessage.__table__.columns if getattr(msg, c.key) is not None}
+
+def _inserir_mensagem(conn, valores):
+    return conn.execute(ChatMsnMessage.__table__.insert().values(**valores)).inserted_primary_key[0]
+
+def _mensagens_da_sala(room_id):
+    return (
+        db.session.query(ChatMsnMessage, User)
+        .join(User, User.id == ChatMsnMessage.user_id)
+        .filter(ChatMsnMessage.room_id == room_id)
+        .filter(ChatMsnMessage.deleted == False)
+    )
+
+def _eventos_desde(filtro, desde):
+    """Mensagens com id > desde (catch-up de reconexão) como eventos (tipo, dados, id)"""
+    rows = (
+        db.session.query(ChatMsnMessage, User)
+        .join(User, User.id == ChatMsnMessage.user_id)
+        .filter(filtro, ChatMsnMessage.id > desde, ChatMsnMessage.deleted == False)
+        .order_by(ChatMsnMessage.id.asc())
+        .limit(CATCHUP_MAXIMO)
+        .all()
+    )
+    anexos = _anexos_por_mensagem([m.id for m, _ in rows])
+    return [('message_created', _mensagem_dict(m, u, anexos.get(m.id, [])), m.id) for m, u in rows]
+
+def _nome(user):
+    return user.nome or user.username or user.email
+
+def _stream(canais, filtro, ao_ping=None):
+    """Assina antes do catch-up para não perder mensagens gravadas entre os dois"""
+    desde = ultimo_id_da_requisicao(request)
     try:
-        # Criar tabelas MSN
-        db.session.execute(text("""
-            CREATE TABLE IF NOT EXISTS chat_msn_rooms (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                kind TEXT NOT NULL DEFAULT 'group',
-                created_by INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                dm_key TEXT UNIQUE
-            )
-        """))
-        
-        db.session.execute(text("""
-            CREATE TABLE IF NOT EXISTS chat_msn_members (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                role TEXT NOT NULL DEFAULT 'member',
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (room_id) REFERENCES chat_msn_rooms (id),
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(room_id, user_id)
-            )
-        """))
-        
-        db.session.execute(text("""
-            CREATE TABLE IF NOT EXISTS chat_msn_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                content TEXT,
-                message_type TEXT DEFAULT 'text',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                deleted BOOLEAN DEFAULT 0,
-                FOREIGN KEY (room_id) REFERENCES chat_msn_rooms (id),
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """))
-        
-        db.session.execute(text("""
-            CREATE TABLE IF NOT EXISTS chat_msn_attachments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_id INTEGER NOT NULL,
-                filename TEXT NOT NULL,
-                original_filename TEXT NOT NULL,
-                file_size INTEGER NOT NULL,
-                content_type TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (message_id) REFERENCES chat_msn_messages (id)
-            )
-        """))
-        
-        db.session.commit()
-        print("✅ Tabelas Chat MSN criadas com sucesso!")
-        
-    except Exception as e:
-        print(f"⚠️ Erro ao criar tabelas MSN: {e}")
+        assinatura = eventos.assinar(canais)
+    except LimiteConexoes:
+        return resposta_sem_stream()  # página volta ao polling
+    try:
+        iniciais = _eventos_desde(filtro, desde) if desde else []
+    except Exception:
+        assinatura.fechar()
+        raise
+    ultimo = iniciais[-1][2] if iniciais else desde
+    return resposta_sse(assinatura, iniciais, ultimo, ao_ping=ao_ping)
 
 @chat_msn.route('/')
 @login_required
 def index():
     """Página principal do chat MSN Style"""
-    _ensure_chat_msn_schema()
-    
     # Buscar ou criar sala geral MSN
     geral_room = ChatMsnRoom.query.filter_by(name='Chat MSN Geral', kind='group').first()
     if not geral_room:
@@ -108,21 +134,12 @@ def index():
     # Garantir que o usuário seja membro
     ensure_member(geral_room.id, current_user.id)
     
-    # Buscar mensagens recentes com anexos
-    messages_query = (
-        db.session.query(ChatMsnMessage, User)
-        .join(User, User.id == ChatMsnMessage.user_id)
-        .filter(ChatMsnMessage.room_id == geral_room.id)
-        .filter(ChatMsnMessage.deleted == False)
-        .order_by(ChatMsnMessage.created_at.desc())
-        .limit(50)
-    )
+    # Buscar mensagens recentes com anexos (mais antigas primeiro)
+    rows, _ = janela_por_id(_mensagens_da_sala(geral_room.id), ChatMsnMessage.id, limite=MENSAGENS_POR_PAGINA)
+    anexos = _anexos_por_mensagem([msg.id for msg, _ in rows])
     
     messages = []
-    for msg, user in messages_query.all():
-        # Buscar anexos da mensagem
-        attachments = ChatMsnAttachment.query.filter_by(message_id=msg.id).all()
-        
+    for msg, user in rows:
         messages.append({
             'id': msg.id,
             'user_id': user.id,
@@ -130,22 +147,13 @@ def index():
             'message': msg.content or '',
             'message_type': msg.message_type or 'text',
             'timestamp': msg.created_at.strftime('%d/%m/%Y %H:%M'),
-            'attachments': [att.to_dict() for att in attachments]
+            'attachments': anexos.get(msg.id, [])
         })
     
-    messages.reverse()  # Mais antigas primeiro
-    
-    # Buscar usuários online
-    online_users = []
-    members = db.session.query(ChatMsnMember, User).join(User).filter(
-        ChatMsnMember.room_id == geral_room.id
-    ).all()
-    
-    for member, user in members:
-        online_users.append({
-            'id': user.id,
-            'username': user.nome or user.username or user.email
-        })
+    # Usuários online (serviço de presença, sem consultar membros/usuários)
+    canal = canal_sala(geral_room.id)
+    presenca.sinal(current_user.id, [canal], _nome(current_user))
+    online_users = presenca.online(canal)
     
     return render_template('chat_msn_standalone.html', 
                          messages=messages,
@@ -157,37 +165,35 @@ def index():
 @chat_msn.route('/rooms/<int:room_id>/messages')
 @login_required
 def list_messages_room(room_id):
-    """GET /rooms/<room_id>/messages - Listar mensagens da sala"""
+    """GET /rooms/<room_id>/messages - Janela do histórico da sala
+
+    ?since_id=N: mensagens novas após N (busca incremental);
+    ?before_id=N: mensagens anteriores a N (rolar para cima);
+    sem nenhum dos dois: as mais recentes. ?limit= até MENSAGENS_MAXIMO.
+    """
     if not is_member(room_id, current_user.id):
         return jsonify(error="not_a_member"), 403
 
-    q = (
-        db.session.query(ChatMsnMessage, User)
-        .join(User, User.id == ChatMsnMessage.user_id)
-        .filter(ChatMsnMessage.room_id == room_id)
-        .filter(ChatMsnMessage.deleted == False)
-        .order_by(ChatMsnMessage.created_at.asc())
+    since_id = request.args.get('since_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    rows, has_more = janela_por_id(
+        _mensagens_da_sala(room_id), ChatMsnMessage.id,
+        depois_de=since_id, antes_de=before_id,
+        limite=request.args.get('limit', MENSAGENS_POR_PAGINA, type=int),
+        maximo=MENSAGENS_MAXIMO,
     )
+    anexos = _anexos_por_mensagem([m.id for m, _ in rows])
+    data = [_mensagem_dict(m, u, anexos.get(m.id, [])) for m, u in rows]
 
-    rows = q.all()
-    data = []
-    
-    for (m, u) in rows:
-        # Buscar anexos
-        attachments = ChatMsnAttachment.query.filter_by(message_id=m.id).all()
-        
-        data.append({
-            "id": m.id,
-            "room_id": room_id,
-            "user_id": m.user_id,
-            "username": u.nome or u.username or u.email,
-            "content": m.content or '',
-            "message_type": m.message_type or 'text',
-            "created_at": (m.created_at or datetime.utcnow()).isoformat(),
-            "attachments": [att.to_dict() for att in attachments]
-        })
-
-    return jsonify(messages=data)
+    # Cursores: since_id para continuar buscando novidades, before_id para páginas antigas
+    ultimo = data[-1]["id"] if data else since_id
+    mais_antigas = since_id is None and has_more
+    return jsonify(
+        messages=data,
+        has_more=has_more,
+        next_since_id=ultimo,
+        next_before_id=data[0]["id"] if data and mais_antigas else None,
+    )
 
 @chat_msn.route('/rooms/<int:room_id>/messages', methods=['POST'])
 @login_required
@@ -202,28 +208,86 @@ def post_message_room(room_id):
     if not content:
         return jsonify(error="empty"), 400
 
-    # Criar mensagem
+    # Criar mensagem (pela fila de gravação: agrupada com as demais gravações simultâneas)
     msg = ChatMsnMessage(
         room_id=room_id,
         user_id=current_user.id,
         content=content,
         message_type='text',
-        created_at=datetime.utcnow()
+        created_at=datetime.utcnow(),
+        deleted=False
     )
-    
-    db.session.add(msg)
-    db.session.commit()
+    msg.id = gravador.executar(_inserir_mensagem, _valores(msg))
 
-    return jsonify(
-        id=msg.id,
-        room_id=room_id,
-        user_id=current_user.id,
-        username=current_user.nome or current_user.username or current_user.email,
-        content=content,
-        message_type='text',
-        created_at=msg.created_at.isoformat(),
-        attachments=[]
+    payload = _mensagem_dict(msg, current_user, [])
+    _publicar_mensagem(payload)
+    return jsonify(payload)
+
+@chat_msn.route('/rooms/<int:room_id>/stream')
+@login_required
+def stream_room(room_id):
+    """GET /rooms/<room_id>/stream - Mensagens novas da sala via Server-Sent Events"""
+    if not is_member(room_id, current_user.id):
+        return jsonify(error="not_a_member"), 403
+    # Stream aberto conta como sinal de vida na sala (a cada keepalive)
+    canal = canal_sala(room_id)
+    user_id, nome = current_user.id, _nome(current_user)
+    return _stream([canal], ChatMsnMessage.room_id == room_id,
+                   ao_ping=lambda: presenca.sinal(user_id, [canal], nome))
+
+@chat_msn.route('/rooms/<int:room_id>/online')
+@login_required
+def online_room(room_id):
+    """GET /rooms/<room_id>/online - Usuários online na sala"""
+    if not is_member(room_id, current_user.id):
+        return jsonify(error="not_a_member"), 403
+    return jsonify(users=presenca.online(canal_sala(room_id)))
+
+@chat_msn.route('/presence/heartbeat', methods=['POST'])
+@login_required
+def heartbeat():
+    """POST /presence/heartbeat - Sinal de vida (clientes sem stream aberto); {"room_ids": [...]}"""
+    data = request.get_json(silent=True) or {}
+    room_ids = [r for r in (data.get("room_ids") or []) if isinstance(r, int)]
+    salas = []
+    if room_ids:
+        salas = [rid for (rid,) in db.session.query(ChatMsnMember.room_id).filter(
+            ChatMsnMember.user_id == current_user.id, ChatMsnMember.room_id.in_(room_ids))]
+    presenca.sinal(current_user.id, [canal_sala(rid) for rid in salas], _nome(current_user))
+    return jsonify(ok=True, ttl=presenca.ttl, rooms=salas)
+
+@chat_msn.route('/unread')
+@login_required
+def unread_counts():
+    """GET /unread - Mensagens não lidas em cada sala do usuário"""
+    salas = _nao_lidas(current_user.id)
+    return jsonify(rooms={str(rid): qtd for rid, qtd in salas.items()}, total=sum(salas.values()))
+
+@chat_msn.route('/rooms/<int:room_id>/read', methods=['POST'])
+@login_required
+def mark_room_read(room_id):
+    """POST /rooms/<room_id>/read - Marca como lidas as mensagens até {"message_id": N} (padrão: todas)"""
+    data = request.get_json(silent=True) or {}
+    message_id = data.get("message_id")
+    if message_id is not None and not isinstance(message_id, int):
+        return jsonify(error="invalid_message_id"), 400
+    marca = marcar_lida(ChatMsnMember, ChatMsnMessage, current_user.id, room_id, message_id)
+    if marca is None:
+        return jsonify(error="not_a_member"), 403
+    unread = contar_nao_lidas_sala(ChatMsnMember, ChatMsnMessage, current_user.id, room_id)
+    contador_nao_lidas.definir(ESCOPO_NAO_LIDAS, current_user.id, room_id, unread)
+    return jsonify(room_id=room_id, last_read_message_id=marca, unread=unread)
+
+@chat_msn.route('/stream')
+@login_required
+def stream_user():
+    """GET /stream - Mensagens novas das DMs do usuário via Server-Sent Events"""
+    salas_dm = (
+        db.session.query(ChatMsnMember.room_id)
+        .join(ChatMsnRoom, ChatMsnRoom.id == ChatMsnMember.room_id)
+        .filter(ChatMsnMember.user_id == current_user.id, ChatMsnRoom.kind == 'dm')
     )
+    return _stream([canal_usuario(current_user.id)], ChatMsnMessage.room_id.in_(salas_dm))
 
 @chat_msn.route('/rooms/<int:room_id>/upload', methods=['POST'])
 @login_required
@@ -298,16 +362,9 @@ def upload_file_to_room(room_id):
         db.session.add(attachment)
         db.session.commit()
         
-        return jsonify(
-            id=msg.id,
-            room_id=room_id,
-            user_id=current_user.id,
-            username=current_user.nome or current_user.username or current_user.email,
-            content=msg.content,
-            message_type='file',
-            created_at=msg.created_at.isoformat(),
-            attachments=[attachment.to_dict()]
-        )
+        payload = _mensagem_dict(msg, current_user, [attachment.to_dict()])
+        _publicar_mensagem(payload)
+        return jsonify(payload)
         
     except Exception as e:
         db.session.rollback()
@@ -351,7 +408,8 @@ def list_rooms():
         .all()
     )
     
-    rooms = [room.to_dict() for room in user_rooms]
+    nao_lidas = _nao_lidas(current_user.id)
+    rooms = [{**room.to_dict(), 'unread': nao_lidas.get(room.id, 0)} for room in user_rooms]
     return jsonify(rooms=rooms)
 
 @chat_msn.route('/rooms/<int:room_id>')
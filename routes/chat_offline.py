@@ -2,6 +2,11 @@ from flask import Blueprint, render_template, request, jsonify, send_from_direct
 from flask_login import login_required, current_user
 from models import db, User
 from models_chat_rooms import ChatRoom, ChatMember, ChatRoomMessage
+from utils.gravador import gravador
+from utils.eventos import (eventos, canal_sala, canal_usuario, resposta_sse, resposta_sem_stream,
+                           ultimo_id_da_requisicao, LimiteConexoes)
+from utils.nao_lidas import contador_nao_lidas, contar_nao_lidas, contar_nao_lidas_sala, marcar_lida
+from utils.presenca import presenca
 from datetime import datetime
 import uuid
 import os
@@ -9,25 +14,15 @@ import os
 # Blueprint para chat offline
 chat_offline = Blueprint('chat_offline', __name__, url_prefix='/chat-offline')
 
-# Autocheck para garantir que o schema está correto
-def _ensure_chat_schema():
-    """Garante que as colunas necessárias existem"""
-    from sqlalchemy import text
-    try:
-        cols = db.session.execute(text("PRAGMA table_info(chat_rooms)")).mappings().all()
-        names = [c["name"] for c in cols]
-        changed = False
-        if "kind" not in names:
-            db.session.execute(text("ALTER TABLE chat_rooms ADD COLUMN kind TEXT NOT NULL DEFAULT 'group'"))
-            changed = True
-        if "dm_key" not in names:
-            db.session.execute(text("ALTER TABLE chat_rooms ADD COLUMN dm_key TEXT"))
-            changed = True
-        if changed:
-            db.session.commit()
-            print("✅ Schema do chat atualizado automaticamente")
-    except Exception as e:
-        print(f"⚠️ Aviso: Não foi possível verificar schema do chat: {e}")
+CATCHUP_MAXIMO = 200  # mensagens reenviadas quando um stream reconecta
+ESCOPO_NAO_LIDAS = 'offline'  # chave do chat offline no contador de não lidas
+
+# Canais de eventos próprios do chat offline (ids de sala não coincidem com os do MSN)
+def _canal_sala(room_id):
+    return 'offline:' + canal_sala(room_id)
+
+def _canal_usuario(user_id):
+    return 'offline:' + canal_usuario(user_id)
 
 # Helpers para compatibilidade de campos de mensagem
 def _get_msg_text_field():
@@ -40,6 +35,58 @@ def _get_msg_text_value(m):
     """Extrai o texto da mensagem independente do campo usado"""
     return getattr(m, "content", None) or getattr(m, "text", None) or ""
 
+def _mensagem_dict(m, u):
+    return {
+        "id": m.id,
+        "room_id": m.room_id,
+        "user_id": m.user_id,
+        "username": u.nome or u.username or u.email,
+        "content": _get_msg_text_value(m),
+        "created_at": (m.created_at or datetime.utcnow()).isoformat()
+    }
+
+def _publicar_mensagem(payload):
+    """Entrega a mensagem nova aos streams da sala e, em DMs, aos streams dos dois usuários"""
+    room_id = payload["room_id"]
+    contador_nao_lidas.nova_mensagem(ESCOPO_NAO_LIDAS, room_id, payload["user_id"])
+    eventos.publicar(_canal_sala(room_id), 'message_created', payload, id=payload["id"])
+    room = ChatRoom.query.get(room_id)
+    if room is not None and room.kind == 'dm':
+        for member in room.members:
+            eventos.publicar(_canal_usuario(member.user_id), 'message_created', payload, id=payload["id"])
+
+def _sinal_presenca(room_id):
+    """Marca o usuário atual como online na sala"""
+    presenca.sinal(current_user.id, [_canal_sala(room_id)],
+                   current_user.nome or current_user.username or current_user.email)
+
+def _stream(canais, filtro, ao_ping=None):
+    """SSE com catch-up das mensagens após Last-Event-ID/since_id (assina antes de ler o banco)"""
+    desde = ultimo_id_da_requisicao(request)
+    try:
+        assinatura = eventos.assinar(canais)
+    except LimiteConexoes:
+        return resposta_sem_stream()  # página volta ao polling
+    try:
+        iniciais = []
+        if desde:
+            q = (
+                db.session.query(ChatRoomMessage, User)
+                .join(User, User.id == ChatRoomMessage.user_id)
+                .filter(filtro, ChatRoomMessage.id > desde, ChatRoomMessage.deleted == False)
+                .order_by(ChatRoomMessage.id.asc())
+                .limit(CATCHUP_MAXIMO)
+            )
+            iniciais = [('message_created', _mensagem_dict(m, u), m.id) for m, u in q.all()]
+    except Exception:
+        assinatura.fechar()
+        raise
+    ultimo = iniciais[-1][2] if iniciais else desde
+    return resposta_sse(assinatura, iniciais, ultimo, ao_ping=ao_ping)
+
+def _inserir_mensagem(conn, valores):
+    return conn.execute(ChatRoomMessage.__table__.insert().values(**valores)).inserted_primary_key[0]
+
 def is_member(room_id, user_id):
     """Verifica se o usuário é membro da sala"""
     return ChatMember.query.filter_by(room_id=room_id, user_id=user_id).first() is not None
@@ -50,6 +97,12 @@ def ensure_member(room_id, user_id):
         member = ChatMember(room_id=room_id, user_id=user_id, role='member')
         db.session.add(member)
         db.session.commit()
+        contador_nao_lidas.invalidar(ESCOPO_NAO_LIDAS, user_id)
+
+def _nao_lidas(user_id):
+    """{room_id: não lidas} do usuário (contador em memória; consulta agregada só ao carregar)"""
+    return contador_nao_lidas.obter(ESCOPO_NAO_LIDAS, user_id,
+                                    lambda: contar_nao_lidas(ChatMember, ChatRoomMessage, user_id))
 
 def get_or_create_dm(user_a_id, user_b_id):
     """Cria ou retorna DM entre dois usuários (versão única)"""
@@ -75,6 +128,8 @@ def get_or_create_dm(user_a_id, user_b_id):
     member2 = ChatMember(room_id=dm.id, user_id=b, role="member")
     db.session.add_all([member1, member2])
     db.session.commit()
+    contador_nao_lidas.invalidar(ESCOPO_NAO_LIDAS, a)
+    contador_nao_lidas.invalidar(ESCOPO_NAO_LIDAS, b)
     
     return dm
 
@@ -82,9 +137,6 @@ def get_or_create_dm(user_a_id, user_b_id):
 @login_required
 def index():
     """Página principal do chat offline"""
-    # Garantir schema atualizado
-    _ensure_chat_schema()
-    
     # Criar ou buscar sala geral
     geral_room = ChatRoom.query.filter_by(name='Chat Geral', kind='group').first()
     if not geral_room:
@@ -118,22 +170,15 @@ def index():
     
     messages.reverse()  # Mais antigas primeiro
     
-    # Buscar usuários online (membros da sala)
-    online_users = []
-    members = db.session.query(ChatMember, User).join(User).filter(
-        ChatMember.room_id == geral_room.id
-    ).all()
-    
-    for member, user in members:
-        online_users.append({
-            'id': user.id,
-            'username': user.nome or user.username or user.email
-        })
+    # Usuários online (serviço de presença, sem consultar membros/usuários)
+    _sinal_presenca(geral_room.id)
+    online_users = presenca.online(_canal_sala(geral_room.id))
     
     return render_template('chat_offline/fixed.html', 
                          messages=messages,
                          online_users=online_users,
-                         current_room='geral')
+                         current_room='geral',
+                         current_room_id=geral_room.id)
 
 # ✅ Rotas REST "canônicas"
 
@@ -187,18 +232,63 @@ def post_message_room(room_id):
     }
     payload[field] = content
 
+    # Gravação pela fila (agrupada com as demais gravações simultâneas)
     msg = ChatRoomMessage(**payload)
-    db.session.add(msg)
-    db.session.commit()
+    msg.id = gravador.executar(_inserir_mensagem, payload)
 
-    return jsonify(
-        id=msg.id,
-        room_id=room_id,
-        user_id=current_user.id,
-        username=current_user.nome or current_user.username or current_user.email,
-        content=content,
-        created_at=msg.created_at.isoformat()
+    dados = _mensagem_dict(msg, current_user)
+    _publicar_mensagem(dados)
+    return jsonify(dados)
+
+
+@chat_offline.route('/rooms/<int:room_id>/stream')
+@login_required
+def stream_room(room_id):
+    """GET /rooms/<room_id>/stream - Mensagens novas da sala via Server-Sent Events"""
+    if not is_member(room_id, current_user.id):
+        return jsonify(error="not_a_member"), 403
+    # Stream aberto conta como sinal de vida na sala (a cada keepalive)
+    canal = _canal_sala(room_id)
+    user_id = current_user.id
+    nome = current_user.nome or current_user.username or current_user.email
+    return _stream([canal], ChatRoomMessage.room_id == room_id,
+                   ao_ping=lambda: presenca.sinal(user_id, [canal], nome))
+
+
+@chat_offline.route('/unread')
+@login_required
+def unread_counts():
+    """GET /unread - Mensagens não lidas em cada sala do usuário"""
+    salas = _nao_lidas(current_user.id)
+    return jsonify(rooms={str(rid): qtd for rid, qtd in salas.items()}, total=sum(salas.values()))
+
+
+@chat_offline.route('/rooms/<int:room_id>/read', methods=['POST'])
+@login_required
+def mark_room_read(room_id):
+    """POST /rooms/<room_id>/read - Marca como lidas as mensagens até {"message_id": N} (padrão: todas)"""
+    data = request.get_json(silent=True) or {}
+    message_id = data.get("message_id")
+    if message_id is not None and not isinstance(message_id, int):
+        return jsonify(error="invalid_message_id"), 400
+    marca = marcar_lida(ChatMember, ChatRoomMessage, current_user.id, room_id, message_id)
+    if marca is None:
+        return jsonify(error="not_a_member"), 403
+    unread = contar_nao_lidas_sala(ChatMember, ChatRoomMessage, current_user.id, room_id)
+    contador_nao_lidas.definir(ESCOPO_NAO_LIDAS, current_user.id, room_id, unread)
+    return jsonify(room_id=room_id, last_read_message_id=marca, unread=unread)
+
+
+@chat_offline.route('/stream')
+@login_required
+def stream_user():
+    """GET /stream - Mensagens novas das DMs do usuário via Server-Sent Events"""
+    salas_dm = (
+        db.session.query(ChatMember.room_id)
+        .join(ChatRoom, ChatRoom.id == ChatMember.room_id)
+        .filter(ChatMember.user_id == current_user.id, ChatRoom.kind == 'dm')
     )
+    return _stream([_canal_usuario(current_user.id)], ChatRoomMessage.room_id.in_(salas_dm))
 
 # ♻️ Compatibilidade com rotas antigas
 
@@ -318,17 +408,10 @@ def get_users():
     if not is_member(room_id, current_user.id):
         return jsonify({'users': []})
 
-    online_users = []
-    members = db.session.query(ChatMember, User).join(User).filter(
-        ChatMember.room_id == room_id
-    ).all()
-    
-    for member, user in members:
-        online_users.append({
-            'id': user.id,
-            'username': user.nome or user.username or user.email,
-            'is_current': user.id == current_user.id
-        })
+    # A própria consulta vale como heartbeat; a lista vem do serviço de presença
+    _sinal_presenca(room_id)
+    online_users = [{**u, 'is_current': u['id'] == current_user.id}
+                    for u in presenca.online(_canal_sala(room_id))]
     
     return jsonify({'users': online_users})
 
@@ -349,6 +432,7 @@ def leave_room():
         if member:
             db.session.delete(member)
             db.session.commit()
+            contador_nao_lidas.invalidar(ESCOPO_NAO_LIDAS, current_user.id)
     
     return jsonify({'success': True})
 
@@ -373,6 +457,7 @@ def clear_room():
         # Marcar mensagens como deletadas ao invés de apagar
         ChatRoomMessage.query.filter_by(room_id=room_id).update({'deleted': True})
         db.session.commit()
+        contador_nao_lidas.invalidar(ESCOPO_NAO_LIDAS)
     
     return jsonify({'success': True})
 
@@ -27,39 +27,6 @@ def get_file_size_str(size_bytes):
     else:
         return f"{size_bytes / (1024 * 1024):.1f} MB"
 
-# Autocheck para garantir que o schema está correto
-def _ensure_chat_schema():
-    """Garante que as colunas necessárias existem"""
-    from sqlalchemy import text
-    try:
-        # Verificar tabela de anexos
-        db.session.execute(text("""
-            CREATE TABLE IF NOT EXISTS chat_attachments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_id INTEGER NOT NULL,
-                filename TEXT NOT NULL,
-                original_filename TEXT NOT NULL,
-                file_size INTEGER NOT NULL,
-                content_type TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (message_id) REFERENCES chat_room_messages (id)
-            )
-        """))
-        
-        # Verificar coluna message_type
-        cols = db.session.execute(text("PRAGMA table_info(chat_room_messages)")).mappings().all()
-        names = [c["name"] for c in cols]
-        
-        if "message_type" not in names:
-            db.session.execute(text("ALTER TABLE chat_room_messages ADD COLUMN message_type TEXT DEFAULT 'text'"))
-        
-        db.session.commit()
-        print("✅ Schema do chat MSN atualizado")
-        
-    except Exception as e:
-        print(f"⚠️ Aviso: Não foi possível verificar schema: {e}")
-
 def _get_msg_text_value(m):
     """Extrai o texto da mensagem independente do campo usado"""
     return getattr(m, "content", None) or getattr(m, "text", None) or ""
@@ -79,8 +46,6 @@ def ensure_member(room_id, user_id):
 @login_required
 def index():
     """Página principal do chat offline MSN Style"""
-    _ensure_chat_schema()
-    
     # Criar ou buscar sala geral
     geral_room = ChatRoom.query.filter_by(name='Chat Geral', kind='group').first()
     if not geral_room:
@@ -3,9 +3,16 @@ from flask_login import login_required, current_user
 from datetime import datetime
 import os
 from models import db, Contrato, AditivoContratual, Empenho, ItemContrato, AnotacaoContrato, AnexoAnotacao
+from utils.export_stream import FORMATOS_STREAM, COLUNAS_CONTRATOS, COLUNAS_ITENS, resposta_stream, objeto_json
+from utils.paginacao import paginar_da_requisicao, CursorInvalido
+from utils.busca import filtro_busca
 
 contratos_bp = Blueprint('contratos', __name__, url_prefix='/contratos')
 
+# Itens devolvidos pela importação de Excel para preencher o formulário; as linhas
+# válidas além disso só são contadas (a resposta e a memória não crescem com o arquivo)
+MAX_ITENS_IMPORTACAO = 1000
+
 def parse_date_field(date_str):
     """
     Converte string de data de forma robusta.
@@ -44,25 +51,51 @@ def index():
     query = Contrato.query
     
     if search:
-        query = query.filter(
-            db.or_(
-                Contrato.numero_contrato.ilike(f'%{search}%'),
-                Contrato.numero_pregao.ilike(f'%{search}%'),
-                Contrato.objeto.ilike(f'%{search}%'),
-                Contrato.fornecedor.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(filtro_busca(Contrato, search))
     
     if status:
         query = query.filter(Contrato.status == status)
     
-    contratos = query.order_by(Contrato.id.desc()).all()
+    # Exportação em streaming (?formato=csv|ndjson) com os mesmos filtros
+    formato = request.args.get('formato', '').lower()
+    if formato in FORMATOS_STREAM:
+        return resposta_stream(query.order_by(Contrato.id.desc()), COLUNAS_CONTRATOS, formato, 'contratos')
+    
+    # Página por cursor sobre o id (mesma ordem de antes, sem carregar todos os contratos)
+    try:
+        contratos = paginar_da_requisicao(query, (Contrato.id,), request.args)
+    except CursorInvalido:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    if formato == 'json':
+        return jsonify(contratos.to_dict(lambda c: objeto_json(c, COLUNAS_CONTRATOS)))
+    
+    # Cards: totais do filtro inteiro, não só da página
+    total_contratos = query.order_by(None).count()
+    total_ativos = query.order_by(None).filter(Contrato.status == 'ATIVO').count()
 
     return render_template('contratos/index.html', 
                          contratos=contratos, 
+                         total_contratos=total_contratos,
+                         total_ativos=total_ativos,
                          search=search, 
                          status=status)
 
+@contratos_bp.route('/itens/exportar')
+@login_required
+def exportar_itens():
+    """Exporta itens de contrato em CSV/NDJSON (streaming); filtro opcional por contrato_id"""
+    formato = request.args.get('formato', 'csv').lower()
+    if formato not in FORMATOS_STREAM:
+        abort(400)
+    
+    query = ItemContrato.query
+    contrato_id = request.args.get('contrato_id', type=int)
+    if contrato_id:
+        query = query.filter(ItemContrato.contrato_id == contrato_id)
+    
+    return resposta_stream(query.order_by(ItemContrato.contrato_id, ItemContrato.id),
+                           COLUNAS_ITENS, formato, 'itens_contrato')
+
 @contratos_bp.route('/novo', methods=['GET', 'POST'])
 @login_required
 def novo():
@@ -1052,25 +1085,17 @@ def importar_excel():
         
         # Importar bibliotecas necessárias
         import pandas as pd
-        from io import BytesIO
-        
-        # Ler o arquivo Excel
-        file_content = file.read()
-        file_io = BytesIO(file_content)
+        from utils.import_data import ImportUtils
         
+        # Ler o arquivo em blocos (openpyxl read-only; .xls cai no pandas/xlrd)
         try:
-            # Tentar ler como xlsx primeiro
-            df = pd.read_excel(file_io, engine='openpyxl')
-        except:
-            try:
-                # Se falhar, tentar como xls
-                file_io.seek(0)
-                df = pd.read_excel(file_io, engine='xlrd')
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'Erro ao ler arquivo Excel: {str(e)}'})
-        
-        # Verificar se o DataFrame não está vazio
-        if df.empty:
+            blocos = ImportUtils.ler_em_blocos(file.stream, 1000)
+            primeiro = next(blocos, None)
+        except Exception as e:
+            return jsonify({'success': False, 'error': f'Erro ao ler arquivo Excel: {str(e)}'})
+        
+        # Verificar se o arquivo não está vazio
+        if primeiro is None or primeiro.empty:
             return jsonify({'success': False, 'error': 'O arquivo Excel está vazio'})
         
         # Mapear colunas esperadas (flexível com diferentes nomes)
@@ -1094,7 +1119,7 @@ def importar_excel():
         # Mapear colunas reais
         mapped_columns = {}
         for field, possible_names in column_mapping.items():
-            found_column = find_column(df.columns, possible_names)
+            found_column = find_column(primeiro.columns, possible_names)
             if found_column:
                 mapped_columns[field] = found_column
         
@@ -1106,55 +1131,69 @@ def importar_excel():
             return jsonify({
                 'success': False, 
                 'error': f'Colunas obrigatórias não encontradas: {", ".join(missing_fields)}. '
-                        f'Colunas disponíveis: {", ".join(df.columns.tolist())}'
+                        f'Colunas disponíveis: {", ".join(str(c) for c in primeiro.columns)}'
             })
         
-        # Processar dados
+        # Processar dados bloco a bloco; só os primeiros MAX_ITENS_IMPORTACAO ficam na resposta
         itens_importados = []
+        total_validos = 0
         
-        for index, row in df.iterrows():
-            try:
-                # Extrair dados da linha
-                item_data = {}
-                
-                for field, column in mapped_columns.items():
-                    value = row[column]
-                    # Tratar valores NaN
-                    if pd.isna(value):
-                        item_data[field] = '' if field in ['lote', 'marca'] else None
-                    else:
-                        item_data[field] = str(value).strip()
-                
-                # Validar dados obrigatórios
-                if not all([item_data.get('item'), item_data.get('descricao'), 
-                           item_data.get('quantidade'), item_data.get('valor_unitario')]):
-                    continue  # Pular linha com dados incompletos
-                
-                # Converter valores numéricos
+        def processar(df):
+            nonlocal total_validos
+            for index, row in df.iterrows():
                 try:
-                    item_data['quantidade'] = float(str(item_data['quantidade']).replace(',', '.'))
-                    item_data['valor_unitario'] = float(str(item_data['valor_unitario']).replace(',', '.'))
-                except (ValueError, TypeError):
-                    continue  # Pular linha com valores inválidos
-                
-                # Normalizar unidade se não especificada
-                if not item_data.get('unidade'):
-                    item_data['unidade'] = 'UN'
-                
-                itens_importados.append(item_data)
-                
-            except Exception as e:
-                current_app.logger.warning(f'Erro ao processar linha {index + 1}: {str(e)}')
-                continue
+                    # Extrair dados da linha
+                    item_data = {}
+                    
+                    for field, column in mapped_columns.items():
+                        value = row[column]
+                        # Tratar valores NaN
+                        if pd.isna(value):
+                            item_data[field] = '' if field in ['lote', 'marca'] else None
+                        else:
+                            item_data[field] = str(value).strip()
+                    
+                    # Validar dados obrigatórios
+                    if not all([item_data.get('item'), item_data.get('descricao'), 
+                               item_data.get('quantidade'), item_data.get('valor_unitario')]):
+                        continue  # Pular linha com dados incompletos
+                    
+                    # Converter valores numéricos
+                    try:
+                        item_data['quantidade'] = float(str(item_data['quantidade']).replace(',', '.'))
+                        item_data['valor_unitario'] = float(str(item_data['valor_unitario']).replace(',', '.'))
+                    except (ValueError, TypeError):
+                        continue  # Pular linha com valores inválidos
+                    
+                    # Normalizar unidade se não especificada
+                    if not item_data.get('unidade'):
+                        item_data['unidade'] = 'UN'
+                    
+                    total_validos += 1
+                    if len(itens_importados) < MAX_ITENS_IMPORTACAO:
+                        itens_importados.append(item_data)
+                    
+                except Exception as e:
+                    current_app.logger.warning(f'Erro ao processar linha {index + 2}: {str(e)}')
+                    continue
+        
+        processar(primeiro)
+        for bloco in blocos:
+            processar(bloco)
         
         if not itens_importados:
             return jsonify({'success': False, 'error': 'Nenhum item válido foi encontrado no arquivo'})
         
-        return jsonify({
+        resposta = {
             'success': True,
             'itens': itens_importados,
-            'total': len(itens_importados)
-        })
+            'total': total_validos,
+            'truncado': total_validos > len(itens_importados)
+        }
+        if resposta['truncado']:
+            resposta['aviso'] = (f'O arquivo tem {total_validos} itens válidos; só os primeiros '
+                                 f'{len(itens_importados)} foram carregados. Divida a planilha para importar o restante.')
+        return jsonify(resposta)
         
     except Exception as e:
         current_app.logger.error(f'Erro ao importar Excel: {str(e)}')
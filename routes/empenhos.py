@@ -3,6 +3,9 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from datetime import datetime
 import json
+from utils.export_stream import FORMATOS_STREAM, COLUNAS_EMPENHOS, resposta_stream, objeto_json
+from utils.paginacao import paginar, paginar_da_requisicao, CursorInvalido
+from utils.busca import filtro_busca
 
 # Blueprint
 empenhos_bp = Blueprint('empenhos', __name__)
@@ -17,7 +20,6 @@ db = None
 @login_required
 def index():
     """Lista todos os empenhos com estatísticas"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     
     # Filtros
@@ -27,24 +29,32 @@ def index():
     query = Empenho.query
     
     if search:
-        query = query.filter(
-            db.or_(
-                Empenho.numero_empenho.contains(search),
-                Empenho.numero_pregao.contains(search),
-                Empenho.numero_contrato.contains(search),
-                Empenho.objeto.contains(search)
-            )
-        )
+        # Prefixo dos números (índice de chave normalizada) ou palavras do objeto/fornecedor (FTS)
+        query = query.filter(filtro_busca(Empenho, search))
     
     if status:
         query = query.filter(Empenho.status == status)
     
-    empenhos = query.order_by(Empenho.data_criacao.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    # Exportação em streaming (?formato=csv|ndjson) com os mesmos filtros
+    formato = request.args.get('formato', '').lower()
+    if formato in FORMATOS_STREAM:
+        return resposta_stream(query.order_by(Empenho.data_criacao.desc(), Empenho.id.desc()),
+                               COLUNAS_EMPENHOS, formato, 'empenhos')
+    
+    # Página por cursor (data_criacao, id): páginas profundas custam o mesmo que a primeira
+    chave = (Empenho.data_criacao, Empenho.id)
+    try:
+        empenhos = paginar_da_requisicao(query, chave, request.args, per_page=per_page)
+    except CursorInvalido:
+        if formato == 'json':
+            return jsonify({'error': 'Cursor inválido'}), 400
+        flash('Link de paginação inválido; mostrando a primeira página.', 'warning')
+        empenhos = paginar(query, chave, per_page=request.args.get('per_page', per_page, type=int))
+    if formato == 'json':
+        return jsonify(empenhos.to_dict(lambda e: objeto_json(e, COLUNAS_EMPENHOS)))
     
     # Estatísticas para os cards
-    total_empenhos = Empenho.query.options(joinedload(Empenho.contrato)).count()
+    total_empenhos = Empenho.query.count()
     valor_total_empenhos = db.session.query(db.func.sum(Empenho.valor_empenhado)).scalar() or 0
     empenhos_recentes = Empenho.query.order_by(Empenho.data_criacao.desc()).limit(10).all()
     
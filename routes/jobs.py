@@ -0,0 +1,140 @@
+from flask import Blueprint, request, jsonify, url_for, send_file, abort, flash, redirect, render_template
+from flask_login import login_required, current_user
+import os
+import json
+import logging
+
+from models import Job
+from utils.jobs import enfileirar, obter_job, CONCLUIDO, ERRO
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+logger = logging.getLogger(__name__)
+
+# tipo de job -> permissão exigida
+_PERMISSOES = {
+    'exportar_excel': lambda u: u.is_admin or getattr(u, 'can_export_reports', False),
+    'exportar_pdf': lambda u: u.is_admin or getattr(u, 'can_export_reports', False),
+    'backup_csv': lambda u: u.is_admin,
+}
+
+FILTROS_EXPORTACAO = ('data_inicio', 'data_fim', 'status', 'contrato', 'pregao', 'fornecedor', 'valor_min', 'valor_max')
+
+
+def filtros_da_requisicao():
+    """Filtros de relatório presentes na query string/form (valores numéricos convertidos)"""
+    filtros = {k: request.values.get(k) for k in FILTROS_EXPORTACAO if request.values.get(k)}
+    for chave in ('valor_min', 'valor_max'):
+        if chave in filtros:
+            filtros[chave] = request.values.get(chave, type=float)
+    return filtros
+
+
+def _job_do_usuario(job_id):
+    job = obter_job(job_id)
+    if job is None or (job.usuario_id != current_user.id and not current_user.is_admin):
+        abort(404)
+    return job
+
+
+def _links(job):
+    return {
+        'status_url': url_for('jobs.status', job_id=job.id),
+        'download_url': url_for('jobs.download', job_id=job.id),
+        'pagina_url': url_for('jobs.acompanhar', job_id=job.id),
+    }
+
+
+def _pede_json():
+    return request.is_json or request.accept_mimetypes.best != 'text/html' \
+        or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def _voltar_seguro(destino):
+    """Só caminhos locais ('/relatorios/...') viram link de retorno"""
+    if destino and destino.startswith('/') and not destino.startswith('//'):
+        return destino
+    return None
+
+
+def responder_job(job, destino):
+    """202 JSON para chamadas AJAX/API; formulários HTML vão para a página de acompanhamento"""
+    if _pede_json():
+        return jsonify({**job.to_dict(), **_links(job)}), 202
+    flash('Processamento iniciado em segundo plano. Esta página mostra o andamento e o download.', 'info')
+    return redirect(url_for('jobs.acompanhar', job_id=job.id, voltar=destino))
+
+
+@jobs_bp.route('/')
+@login_required
+def listar():
+    """Últimos jobs do usuário"""
+    jobs = (Job.query.filter_by(usuario_id=current_user.id)
+            .order_by(Job.criado_em.desc()).limit(50).all())
+    if not _pede_json():
+        return render_template('jobs/lista.html', jobs=jobs)
+    return jsonify([{**j.to_dict(), **_links(j)} for j in jobs])
+
+
+@jobs_bp.route('/<tipo>', methods=['POST'])
+@login_required
+def criar(tipo):
+    """Enfileira exportação/backup; parâmetros de filtro vêm do form ou da query string"""
+    permissao = _PERMISSOES.get(tipo)
+    if permissao is None:
+        return jsonify({'error': f'Tipo de job não suportado: {tipo}'}), 400
+    if not permissao(current_user):
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    parametros = {} if tipo == 'backup_csv' else {'filtros': filtros_da_requisicao()}
+    try:
+        job = enfileirar(tipo, parametros, current_user.id)
+    except Exception as e:
+        logger.error(f"Erro ao enfileirar job {tipo}: {e}")
+        return jsonify({'error': 'Não foi possível iniciar o processamento'}), 503
+    return jsonify({**job.to_dict(), **_links(job)}), 202
+
+
+@jobs_bp.route('/<job_id>/retomar', methods=['POST'])
+@login_required
+def retomar(job_id):
+    """Reenfileira uma importação que falhou; ela continua do último lote confirmado"""
+    job = _job_do_usuario(job_id)
+    parametros = json.loads(job.parametros or '{}')
+    if job.tipo != 'importar_planilha' or job.status != ERRO:
+        return jsonify({'error': 'Apenas importações com erro podem ser retomadas'}), 409
+    if not os.path.exists(parametros.get('arquivo', '')):
+        return jsonify({'error': 'Arquivo da importação não está mais disponível; envie-o novamente'}), 410
+    
+    novo = enfileirar(job.tipo, parametros, current_user.id)
+    return jsonify({**novo.to_dict(), **_links(novo)}), 202
+
+
+@jobs_bp.route('/<job_id>')
+@login_required
+def acompanhar(job_id):
+    """Página HTML do job: consulta /status até terminar e mostra download e erros da importação"""
+    job = _job_do_usuario(job_id)
+    return render_template('jobs/acompanhar.html', job=job, dados={**job.to_dict(), **_links(job)},
+                           retomar_url=url_for('jobs.retomar', job_id=job.id),
+                           voltar=_voltar_seguro(request.args.get('voltar')))
+
+
+@jobs_bp.route('/<job_id>/status')
+@login_required
+def status(job_id):
+    """Status e progresso (para polling)"""
+    job = _job_do_usuario(job_id)
+    return jsonify({**job.to_dict(), **_links(job)})
+
+
+@jobs_bp.route('/<job_id>/download')
+@login_required
+def download(job_id):
+    """Baixa o arquivo gerado quando o job termina"""
+    job = _job_do_usuario(job_id)
+    if job.status != CONCLUIDO or not job.arquivo:
+        return jsonify({**job.to_dict(), 'error': 'Arquivo ainda não disponível'}), 409
+    if not os.path.exists(job.arquivo):
+        return jsonify({'error': 'Arquivo expirado ou removido'}), 410
+    return send_file(job.arquivo, as_attachment=True,
+                     download_name=job.nome_download or os.path.basename(job.arquivo))
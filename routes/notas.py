@@ -4,6 +4,8 @@ from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from sqlalchemy import func, extract, and_, or_
 import os
+from utils.export_stream import FORMATOS_STREAM, COLUNAS_NOTAS, resposta_stream, objeto_json
+from utils.paginacao import paginar, paginar_da_requisicao, CursorInvalido
 
 notas_bp = Blueprint('notas', __name__, url_prefix='/notas')
 
@@ -42,11 +44,27 @@ def index():
     if fornecedor:
         query = query.filter(NotaFiscal.fornecedor_nome.ilike(f'%{fornecedor}%'))
     
-    # Ordenação
-    notas = query.order_by(NotaFiscal.data_emissao.desc()).all()
+    # Exportação em streaming (?formato=csv|ndjson) com os mesmos filtros
+    formato = request.args.get('formato', '').lower()
+    if formato in FORMATOS_STREAM:
+        return resposta_stream(query.order_by(NotaFiscal.data_emissao.desc(), NotaFiscal.id.desc()),
+                               COLUNAS_NOTAS, formato, 'notas_fiscais')
+    
+    # Página por cursor (data_emissao, id): não carrega mais a tabela inteira
+    query = query.options(joinedload(NotaFiscal.empenho))
+    chave = (NotaFiscal.data_emissao, NotaFiscal.id)
+    try:
+        notas = paginar_da_requisicao(query, chave, request.args)
+    except CursorInvalido:
+        if formato == 'json':
+            return jsonify({'error': 'Cursor inválido'}), 400
+        flash('Link de paginação inválido; mostrando a primeira página.', 'warning')
+        notas = paginar(query, chave, per_page=request.args.get('per_page', type=int))
+    if formato == 'json':
+        return jsonify(notas.to_dict(lambda nota: objeto_json(nota, COLUNAS_NOTAS)))
     
     # Estatísticas
-    total_notas = NotaFiscal.query.options(joinedload(NotaFiscal.empenho).joinedload('contrato')).count()
+    total_notas = NotaFiscal.query.count()
     notas_em_aberto = NotaFiscal.query.filter_by(status='EM_ABERTO').count()
     notas_pagas = NotaFiscal.query.filter_by(status='PAGO').count()
     notas_vencidas = NotaFiscal.query.filter(
@@ -58,8 +76,8 @@ def index():
     valor_total_em_aberto = db.session.query(func.sum(NotaFiscal.valor_liquido)).filter_by(status='EM_ABERTO').scalar() or 0
     valor_total_pago = db.session.query(func.sum(NotaFiscal.valor_liquido)).filter_by(status='PAGO').scalar() or 0
     
-    # Lista de empenhos para filtro
-    empenhos = Empenho.query.order_by(Empenho.numero_empenho).all()
+    # Lista de empenhos para filtro (só id e número)
+    empenhos = db.session.query(Empenho.id, Empenho.numero_empenho).order_by(Empenho.numero_empenho).all()
     
     return render_template('notas/index.html',
                          notas=notas,
@@ -1,16 +1,25 @@
 # relatorios.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app, Response
 from flask_login import login_required, current_user
-from models import Empenho, Contrato, NotaFiscal, db
+from models import Empenho, Contrato, NotaFiscal, StatusEmpenho, db
 # IMPORTS CORRIGIDOS - utils carregados dinamicamente quando necessário
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, and_, or_, case, desc, asc, text
+from sqlalchemy import func, and_, or_, case, desc, asc, text, select
 from sqlalchemy.orm import joinedload
 import os
+import uuid
 import logging
 import json
 import random
+from werkzeug.utils import secure_filename
 from collections import defaultdict
+from utils.versao_dados import etag_condicional
+from utils.cache import cache, cached, TAG_DADOS
+from utils.jobs import enfileirar
+from routes.jobs import responder_job, filtros_da_requisicao
+from utils.export_stream import COLUNAS_EMPENHOS, FORMATOS_STREAM, gerar_xlsx_stream, resposta_stream, select_empenhos_filtrados
+from utils.paginacao import paginar, CursorInvalido
+from utils import datas_sql
 
 # Função para simular relativedelta sem import problemático
 def add_months(source_date, months):
@@ -220,7 +229,6 @@ def filtrado():
         valor_max = request.args.get('valor_max', type=float)
         
         # Paginação
-        page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
         
         # Query base otimizada
@@ -269,23 +277,24 @@ def filtrado():
             query = query.filter(Empenho.valor_empenhado <= valor_max)
             filtros_aplicados['valor_max'] = valor_max
         
-        # Aplicar ordenação
+        # Ordenação = chave do cursor (o id desempata valores/datas iguais)
         ordem = request.args.get('ordem', 'data_desc')
-        if ordem == 'data_asc':
-            query = query.order_by(asc(Empenho.data_empenho))
-        elif ordem == 'valor_desc':
-            query = query.order_by(desc(Empenho.valor_empenhado))
-        elif ordem == 'valor_asc':
-            query = query.order_by(asc(Empenho.valor_empenhado))
-        else:  # data_desc (padrão)
-            query = query.order_by(desc(Empenho.data_empenho))
-        
-        # Executar query com paginação
-        empenhos_paginados = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        chaves = {
+            'data_asc': ((Empenho.data_empenho, Empenho.id), False),
+            'valor_desc': ((Empenho.valor_empenhado, Empenho.id), True),
+            'valor_asc': ((Empenho.valor_empenhado, Empenho.id), False),
+        }
+        colunas_ordem, descendente = chaves.get(ordem, ((Empenho.data_empenho, Empenho.id), True))
+        
+        # Paginação por cursor: sem OFFSET; os totais abaixo já fazem a contagem do filtro
+        try:
+            empenhos_paginados = paginar(query, colunas_ordem,
+                                         cursor=request.args.get('cursor') or None,
+                                         antes=request.args.get('antes') or None,
+                                         per_page=per_page, descendente=descendente)
+        except CursorInvalido:
+            flash('Link de paginação inválido; mostrando a primeira página.', 'warning')
+            empenhos_paginados = paginar(query, colunas_ordem, per_page=per_page, descendente=descendente)
         
         empenhos = empenhos_paginados.items
         
@@ -350,52 +359,56 @@ def exportar_excel():
             'valor_max': request.args.get('valor_max', type=float)
         }
         
-        # Aplicar filtros (código similar ao filtrado, mas sem paginação)
-        query = Empenho.query.options(joinedload(Empenho.notas_fiscais))
-        
-        if filtros['data_inicio']:
-            query = query.filter(Empenho.data_empenho >= datetime.strptime(filtros['data_inicio'], '%Y-%m-%d').date())
-        
-        if filtros['data_fim']:
-            query = query.filter(Empenho.data_empenho <= datetime.strptime(filtros['data_fim'], '%Y-%m-%d').date())
-        
-        if filtros['status']:
-            query = query.filter(Empenho.status == filtros['status'])
+        # ?segundo_plano=1: gera na fila de jobs e libera a thread da requisição
+        if request.args.get('segundo_plano', type=int):
+            job = enfileirar('exportar_excel', {'filtros': filtros_da_requisicao()}, current_user.id)
+            return responder_job(job, url_for('relatorios.index'))
         
-        if filtros['contrato']:
-            query = query.filter(func.lower(Empenho.numero_contrato).like(f"%{filtros['contrato'].lower()}%"))
+        stmt = select_empenhos_filtrados(filtros, COLUNAS_EMPENHOS)
+        nome = f'relatorio_empenhos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
         
-        if filtros['pregao']:
-            query = query.filter(func.lower(Empenho.numero_pregao).like(f"%{filtros['pregao'].lower()}%"))
-            
-        if filtros['fornecedor']:
-            query = query.filter(func.lower(Empenho.fornecedores).like(f"%{filtros['fornecedor'].lower()}%"))
-        
-        if filtros['valor_min'] is not None:
-            query = query.filter(Empenho.valor_empenhado >= filtros['valor_min'])
-            
-        if filtros['valor_max'] is not None:
-            query = query.filter(Empenho.valor_empenhado <= filtros['valor_max'])
-        
-        empenhos = query.order_by(desc(Empenho.data_empenho)).all()
-        
-        # Limitar exportação para evitar sobrecarga
-        if len(empenhos) > 10000:
-            flash('Muitos registros para exportação. Aplique filtros para reduzir o resultado.', 'warning')
-            return redirect(url_for('relatorios.filtrado', **{k: v for k, v in filtros.items() if v}))
-        
-        # Gerar arquivo Excel
-        filename = ExportXLSXHelper.export_to_excel(empenhos, filtros)
-        
-        return send_file(filename, 
-                        as_attachment=True, 
-                        download_name=f'relatorio_empenhos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
+        # Planilha gerada em streaming (yield_per + linhas escritas direto no zip)
+        return Response(
+            gerar_xlsx_stream(current_app._get_current_object(), stmt, COLUNAS_EMPENHOS, titulo='Empenhos'),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            headers={'Content-Disposition': f'attachment; filename={nome}'}
+        )
         
     except Exception as e:
         logger.error(f"Erro ao exportar para Excel: {str(e)}")
         flash(f'Erro ao exportar para Excel: {str(e)}', 'error')
         return redirect(url_for('relatorios.index'))
 
+@relatorios_bp.route('/exportar/<formato>')
+@login_required
+def exportar_stream(formato):
+    """Exportar relatório filtrado em CSV ou NDJSON (streaming)"""
+    if formato not in FORMATOS_STREAM:
+        flash('Formato de exportação não suportado.', 'error')
+        return redirect(url_for('relatorios.index'))
+    
+    if not (current_user.is_admin or getattr(current_user, 'can_export_reports', False)):
+        flash('Você não tem permissão para exportar relatórios.', 'error')
+        return redirect(url_for('relatorios.index'))
+    
+    try:
+        filtros = {
+            'data_inicio': request.args.get('data_inicio'),
+            'data_fim': request.args.get('data_fim'),
+            'status': request.args.get('status'),
+            'contrato': request.args.get('contrato'),
+            'pregao': request.args.get('pregao'),
+            'fornecedor': request.args.get('fornecedor'),
+            'valor_min': request.args.get('valor_min', type=float),
+            'valor_max': request.args.get('valor_max', type=float)
+        }
+        stmt = select_empenhos_filtrados(filtros, COLUNAS_EMPENHOS)
+        return resposta_stream(stmt, COLUNAS_EMPENHOS, formato, 'relatorio_empenhos')
+    except Exception as e:
+        logger.error(f"Erro ao exportar ({formato}): {str(e)}")
+        flash(f'Erro ao exportar: {str(e)}', 'error')
+        return redirect(url_for('relatorios.index'))
+
 @relatorios_bp.route('/dashboard-avancado')
 @login_required
 def dashboard_avancado():
@@ -438,6 +451,7 @@ def dashboard_avancado():
         flash('Erro ao carregar dashboard avançado.', 'error')
         return redirect(url_for('relatorios.index'))
 
+@cached()
 def _get_metricas_avancadas(data_inicio, data_fim):
     """Obter métricas avançadas para dashboard"""
     try:
@@ -511,12 +525,12 @@ def _get_metricas_avancadas(data_inicio, data_fim):
         logger.error(f"Erro ao obter métricas avançadas: {str(e)}")
         return {}
 
+@cached()
 def _get_graficos_avancados(data_inicio, data_fim):
     """Obter dados para gráficos interativos"""
     try:
-        # Série temporal de empenhos - Usando DATE portável
-        from sqlalchemy import func, Date
-        data_expr = func.cast(Empenho.data_empenho, Date)
+        # Série temporal de empenhos (data sem hora, compilada para o dialeto do banco)
+        data_expr = datas_sql.dia(Empenho.data_empenho)
 
         series_temporal = db.session.query(
             data_expr.label('data'),
@@ -568,7 +582,7 @@ def _get_graficos_avancados(data_inicio, data_fim):
         return {
             'series_temporal': [
                 {
-                    'data': item.data,  # Already a string from strftime in query
+                    'data': item.data.isoformat() if item.data else None,
                     'quantidade': item.quantidade,
                     'valor': float(item.valor) if item.valor else 0
                 }
@@ -590,6 +604,7 @@ def _get_graficos_avancados(data_inicio, data_fim):
         logger.error(f"Erro ao obter dados para gráficos: {str(e)}")
         return {}
 
+@cached()
 def _get_analise_tendencias(data_inicio, data_fim):
     """Análise de tendências"""
     try:
@@ -640,6 +655,7 @@ def _get_analise_tendencias(data_inicio, data_fim):
         logger.error(f"Erro ao obter análise de tendências: {str(e)}")
         return {}
 
+@cached()
 def _get_ranking_performance(data_inicio, data_fim):
     """Ranking de performance por contrato/pregão"""
     try:
@@ -699,6 +715,7 @@ def _get_ranking_performance(data_inicio, data_fim):
         logger.error(f"Erro ao obter ranking de performance: {str(e)}")
         return {}
 
+@cached()
 def _get_dados_periodo_comparativo(data_inicio, data_fim):
     """Obter dados para comparação entre períodos"""
     try:
@@ -776,73 +793,6 @@ def _calcular_variacoes(dados_periodo1, dados_periodo2):
         return {}
 
 # Classe para utilitários de exportação
-class ExportXLSXHelper:
-    @staticmethod
-    def export_to_excel(empenhos, filtros=None):
-        """Exportar dados para Excel com formatação avançada"""
-        try:
-            import pandas as pd
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, Alignment, PatternFill
-            from openpyxl.utils.dataframe import dataframe_to_rows
-            import tempfile
-            import os
-            
-            # Converter dados para DataFrame
-            data = []
-            for empenho in empenhos:
-                data.append({
-                    'Número': empenho.numero_empenho,
-                    'Data': empenho.data_empenho.strftime('%d/%m/%Y'),
-                    'Valor': empenho.valor_empenhado,
-                    'Status': empenho.status,
-                    'Contrato': empenho.numero_contrato,
-                    'Pregão': empenho.numero_pregao,
-                    'Fornecedor': empenho.fornecedores,
-                    'Objeto': empenho.objeto_contrato[:100] + '...' if empenho.objeto_contrato and len(empenho.objeto_contrato) > 100 else empenho.objeto_contrato,
-                    'Vencimento': empenho.data_vencimento.strftime('%d/%m/%Y') if empenho.data_vencimento else ''
-                })
-            
-            df = pd.DataFrame(data)
-            
-            # Criar arquivo temporário
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-            
-            # Salvar com formatação
-            with pd.ExcelWriter(temp_file.name, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Empenhos', index=False)
-                
-                # Acessar a planilha para formatação
-                worksheet = writer.sheets['Empenhos']
-                
-                # Estilo do cabeçalho
-                header_font = Font(bold=True, color='FFFFFF')
-                header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-                
-                for cell in worksheet[1]:
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = Alignment(horizontal='center')
-                
-                # Ajustar largura das colunas
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            return temp_file.name
-            
-        except Exception as e:
-            logger.error(f"Erro ao exportar para Excel: {str(e)}")
-            raise e
-
 @relatorios_bp.route('/api/dados-dashboard')
 @login_required
 def api_dados_dashboard():
@@ -911,41 +861,29 @@ def performance():
         flash('Erro ao carregar relatório de performance.', 'error')
         return redirect(url_for('relatorios.index'))
 
-# Sistema de cache simples
+# Sistema de cache (backend configurável em utils/cache.py)
 class CacheManager:
-    _cache = {}
+    """Compatibilidade: delega ao cache global com TTL/LRU/tags."""
     
     @classmethod
     def get(cls, key):
         """Obter item do cache"""
-        if key in cls._cache:
-            item = cls._cache[key]
-            if datetime.now() < item['expires']:
-                return item['data']
-            else:
-                del cls._cache[key]
-        return None
+        return cache.get(key)
     
     @classmethod
-    def set(cls, key, data, expires_in=300):
+    def set(cls, key, data, expires_in=300, tags=(TAG_DADOS,)):
         """Definir item no cache"""
-        cls._cache[key] = {
-            'data': data,
-            'expires': datetime.now() + timedelta(seconds=expires_in)
-        }
+        cache.set(key, data, ttl=expires_in, tags=tags)
     
     @classmethod
     def clear(cls):
         """Limpar cache"""
-        cls._cache.clear()
+        cache.clear()
     
     @classmethod
     def cleanup(cls):
         """Remover itens expirados"""
-        now = datetime.now()
-        expired_keys = [key for key, item in cls._cache.items() if now >= item['expires']]
-        for key in expired_keys:
-            del cls._cache[key]
+        cache.cleanup()
 
 def _get_performance_database():
     """Obter métricas de performance do banco"""
@@ -994,7 +932,8 @@ def _get_performance_database():
                 'query_time_ms': round(query_time, 2),
                 'total_empenhos': count_empenhos,
                 'total_notas': count_notas,
-                'cache_hits': len(CacheManager._cache) if 'CacheManager' in globals() else 0
+                'cache_hits': cache.stats()['hits'],
+                'cache': cache.stats()
             }
         }
         
@@ -1002,11 +941,12 @@ def _get_performance_database():
         logger.error(f"Erro ao obter performance do banco: {str(e)}")
         return {}
 
+@cached()
 def _get_estatisticas_uso():
     """Obter estatísticas de uso do sistema"""
     try:
         # Atividade por dia da semana
-        dow = func.strftime('%w', Empenho.data_empenho)  # 0=Domingo ... 6=Sábado
+        dow = datas_sql.dia_semana(Empenho.data_empenho)  # 0=Domingo ... 6=Sábado
         atividade_semanal = db.session.query(
             dow.label('dia_semana'),
             func.count(Empenho.id).label('total')
@@ -1024,8 +964,8 @@ def _get_estatisticas_uso():
         
         # Atividade por mês (últimos 12 meses)
         doze_meses_atras = date.today() - timedelta(days=365)
-        ano = func.strftime('%Y', Empenho.data_empenho)
-        mes = func.strftime('%m', Empenho.data_empenho)
+        ano = datas_sql.ano(Empenho.data_empenho)
+        mes = datas_sql.mes(Empenho.data_empenho)
         atividade_mensal = db.session.query(
             ano.label('ano'),
             mes.label('mes'),
@@ -1085,52 +1025,23 @@ def _get_queries_lentas():
 @relatorios_bp.route('/exportar/pdf')
 @login_required
 def exportar_pdf():
-    """Exportar relatório para PDF"""
-    try:
-        # Obter filtros da query string
-        filtros = {
-            'data_inicio': request.args.get('data_inicio'),
-            'data_fim': request.args.get('data_fim'),
-            'status': request.args.get('status'),
-            'contrato': request.args.get('contrato'),
-            'pregao': request.args.get('pregao')
-        }
-        
-        # Aplicar filtros
-        query = Empenho.query
-        
-        if filtros['data_inicio']:
-            query = query.filter(Empenho.data_empenho >= datetime.strptime(filtros['data_inicio'], '%Y-%m-%d').date())
-        
-        if filtros['data_fim']:
-            query = query.filter(Empenho.data_empenho <= datetime.strptime(filtros['data_fim'], '%Y-%m-%d').date())
-        
-        if filtros['status']:
-            query = query.filter(Empenho.status == filtros['status'])
-        
-        if filtros['contrato']:
-            query = query.filter(Empenho.numero_contrato.contains(filtros['contrato']))
-        
-        if filtros['pregao']:
-            query = query.filter(Empenho.numero_pregao.contains(filtros['pregao']))
-        
-        empenhos = query.order_by(Empenho.data_empenho.desc()).all()
-        
-        # TEMPORARIAMENTE DESABILITADO - utils com problemas
-        # filename = ExportUtils.export_to_pdf(empenhos, filtros)
-        # return send_file(filename, as_attachment=True, download_name=f'relatorio_empenhos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf')
-        
-        flash('Exportação para PDF temporariamente desabilitada', 'warning')
+    """Exportar relatório para PDF (gerado em segundo plano)"""
+    if not (current_user.is_admin or getattr(current_user, 'can_export_reports', False)):
+        flash('Você não tem permissão para exportar relatórios.', 'error')
         return redirect(url_for('relatorios.index'))
-        
+    
+    try:
+        job = enfileirar('exportar_pdf', {'filtros': filtros_da_requisicao()}, current_user.id)
+        return responder_job(job, url_for('relatorios.index'))
     except Exception as e:
+        logger.error(f"Erro ao enfileirar PDF: {str(e)}")
         flash(f'Erro ao exportar para PDF: {str(e)}', 'error')
         return redirect(url_for('relatorios.index'))
 
 @relatorios_bp.route('/importar', methods=['GET', 'POST'])
 @login_required
 def importar():
-    """Importar dados de planilha"""
+    """Importar dados de planilha (processada em segundo plano)"""
     if request.method == 'POST':
         if 'arquivo' not in request.files:
             flash('Nenhum arquivo selecionado', 'error')
@@ -1141,28 +1052,15 @@ def importar():
             flash('Nenhum arquivo selecionado', 'error')
             return redirect(request.url)
         
-        # TEMPORARIAMENTE DESABILITADO - ImportUtils com problemas
-        # if file and ImportUtils.allowed_file(file.filename):
-        if file and file.filename.endswith(('.xlsx', '.xls', '.csv')):
+        if file and file.filename.lower().endswith(('.xlsx', '.xls', '.csv')):
             try:
-                flash('Importação temporariamente desabilitada', 'warning')
-                return redirect(url_for('relatorios.index'))
+                # Arquivo fica no diretório de jobs até o worker terminar (ele remove)
+                nome = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+                caminho = os.path.join(current_app.config['JOBS_DIR'], nome)
+                file.save(caminho)
                 
-                # # Salvar arquivo temporariamente  
-                # filename = ImportUtils.save_uploaded_file(file)
-                # 
-                # # Importar dados
-                # resultado = ImportUtils.import_from_file(filename, current_user.id)
-                
-                # Remover arquivo temporário
-                os.remove(filename)
-                
-                if resultado['sucesso']:
-                    flash(f'Importação concluída! {resultado["importados"]} empenhos importados, {resultado["erros"]} erros.', 'success')
-                    if resultado['mensagens_erro']:
-                        flash('Erros encontrados: ' + '; '.join(resultado['mensagens_erro'][:5]), 'warning')
-                else:
-                    flash(f'Erro na importação: {resultado["erro"]}', 'error')
+                job = enfileirar('importar_planilha', {'arquivo': caminho, 'usuario_id': current_user.id}, current_user.id)
+                return responder_job(job, url_for('relatorios.importar'))
                 
             except Exception as e:
                 flash(f'Erro ao processar arquivo: {str(e)}', 'error')
@@ -1191,8 +1089,8 @@ def dados_grafico():
         } for item in dados])
     
     elif tipo == 'mensal':
-        ano = func.strftime('%Y', Empenho.data_empenho)
-        mes = func.strftime('%m', Empenho.data_empenho)
+        ano = datas_sql.ano(Empenho.data_empenho)
+        mes = datas_sql.mes(Empenho.data_empenho)
         dados = db.session.query(
             ano.label('ano'),
             mes.label('mes'),
@@ -1230,11 +1128,8 @@ def backup():
         return redirect(url_for('relatorios.index'))
     
     try:
-        # TEMPORARIAMENTE DESABILITADO
-        # filename = ExportUtils.create_backup()
-        # return send_file(filename, as_attachment=True, download_name=f'backup_empenhos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
-        flash('Backup temporariamente desabilitado', 'warning')
-        return redirect(url_for('relatorios.index'))
+        job = enfileirar('backup_csv', {}, current_user.id)
+        return responder_job(job, url_for('relatorios.index'))
     except Exception as e:
         flash(f'Erro ao gerar backup: {str(e)}', 'error')
         return redirect(url_for('relatorios.index'))
@@ -1649,6 +1544,7 @@ def api_dados(tipo):
         return jsonify({'error': str(e)}), 500
 
 # Funções auxiliares para cálculos de relatórios
+@cached()
 def _get_performance_mensal():
     """Calcula performance mensal dos últimos 12 meses"""
     meses = []
@@ -1682,6 +1578,7 @@ def _get_performance_mensal():
     
     return list(reversed(meses))
 
+@cached()
 def _get_distribuicao_fornecedores():
     """Distribução de valores por fornecedor"""
     fornecedores = db.session.query(
@@ -1695,6 +1592,7 @@ def _get_distribuicao_fornecedores():
     return [{'nome': f.fornecedores, 'valor': float(f.valor_total or 0), 'qtd': f.quantidade} 
             for f in fornecedores]
 
+@cached()
 def _get_tendencias():
     """Análise de tendências"""
     hoje = date.today()
@@ -1732,6 +1630,7 @@ def _get_tendencias():
         'periodo_anterior': f"{periodo2_inicio.strftime('%d/%m')} - {periodo2_fim.strftime('%d/%m')}"
     }
 
+@cached()
 def _get_indicadores_kpi():
     """Indicadores KPI principais"""
     # Tempo médio de processamento
@@ -1772,6 +1671,7 @@ def _get_indicadores_kpi():
         'total_processados': empenhos_executados
     }
 
+@cached()
 def _get_resumo_empenhos(data_inicio, data_fim):
     """Resumo financeiro de empenhos"""
     empenhos = Empenho.query.filter(and_(
@@ -1786,6 +1686,7 @@ def _get_resumo_empenhos(data_inicio, data_fim):
         'valor_retencao': sum(e.valor_retencao or 0 for e in empenhos)
     }
 
+@cached()
 def _get_resumo_notas(data_inicio, data_fim):
     """Resumo financeiro de notas fiscais"""
     notas = NotaFiscal.query.filter(and_(
@@ -1805,6 +1706,7 @@ def _get_resumo_notas(data_inicio, data_fim):
         'valor_aberto': sum(n.valor_liquido or 0 for n in abertas)
     }
 
+@cached()
 def _get_fluxo_caixa(data_inicio, data_fim):
     """Análise de fluxo de caixa"""
     periodo_dias = (data_fim - data_inicio).days
@@ -1831,23 +1733,27 @@ def _get_fluxo_caixa(data_inicio, data_fim):
     
     return fluxo
 
+@cached()
 def _get_comparativo_anual():
     """Comparativo entre anos"""
     ano_atual = date.today().year
-    dados_anos = []
-    
-    for ano in range(ano_atual-2, ano_atual+1):
-        empenhos_ano = Empenho.query.filter(
-            func.strftime('%Y', Empenho.data_empenho) == str(ano)
-        ).all()
-        
-        dados_anos.append({
-            'ano': ano,
-            'quantidade': len(empenhos_ano),
-            'valor': sum(e.valor_empenhado or 0 for e in empenhos_ano)
-        })
-    
-    return dados_anos
+    ano = datas_sql.ano(Empenho.data_empenho)
+    # Uma consulta agregada com filtro por intervalo (usa o índice de data_empenho)
+    totais = {
+        int(item.ano): item for item in db.session.query(
+            ano.label('ano'),
+            func.count(Empenho.id).label('quantidade'),
+            func.sum(Empenho.valor_empenhado).label('valor')
+        ).filter(
+            datas_sql.periodo_anos(Empenho.data_empenho, ano_atual - 2, ano_atual)
+        ).group_by(ano)
+    }
+
+    return [{
+        'ano': a,
+        'quantidade': totais[a].quantidade if a in totais else 0,
+        'valor': float(totais[a].valor or 0) if a in totais else 0
+    } for a in range(ano_atual - 2, ano_atual + 1)]
 
 def _get_produtividade():
     """Análise de produtividade"""
@@ -1966,6 +1872,7 @@ def _get_alertas_api():
 
 # ===== FUNÇÕES AUXILIARES OTIMIZADAS =====
 
+@cached()
 def _get_estatisticas_gerais_otimizado(data_inicio, data_fim):
     """Estatísticas gerais do PERÍODO (empenhos/notas) + visão geral de contratos."""
     try:
@@ -1997,6 +1904,7 @@ def _get_estatisticas_gerais_otimizado(data_inicio, data_fim):
         logger.error(f'Erro estatísticas período: {e}')
         return {}
 
+@cached()
 def _get_metricas_periodo_otimizado(data_inicio, data_fim):
     """Métricas do período com queries otimizadas"""
     try:
@@ -2150,6 +2058,7 @@ def _get_alertas_criticos_otimizado():
         logger.error(f"Erro ao buscar alertas críticos: {str(e)}")
         return []
 
+@cached()
 def _get_dados_graficos_otimizado(data_inicio, data_fim):
     """Dados para gráficos com queries otimizadas"""
     try:
@@ -2245,8 +2154,25 @@ def _month_key(dt):
 def _fmt_money(v):
     return float(v or 0.0)
 
+# Limite de widgets por chamada em lote
+MAX_WIDGETS_LOTE = 20
+
+def _widget_provider(widget_id):
+    """Função que calcula os dados do widget (None se não implementado)."""
+    return {
+        "kpi-empenhos": _data_kpi_empenhos,
+        "kpi-financeiro": _data_kpi_financeiro,
+        "kpi-contratos": _data_contratos,
+        "grafico-evolucao": _data_grafico_evolucao,
+        "grafico-pizza": _data_grafico_pizza,
+        "tabela-top-fornecedores": _data_top_fornecedores,
+        "alertas-sistema": _data_alertas_sistema,
+        "calendario-vencimentos": _data_calendario_vencimentos,
+    }.get(widget_id)
+
 @relatorios_bp.route('/api/widget-data/<widget_id>')
 @login_required
+@etag_condicional('widget-data')
 def get_widget_data(widget_id):
     """
     API endpoint unificado para dados de widgets específicos
@@ -2260,33 +2186,12 @@ def get_widget_data(widget_id):
       - alertas-sistema     -> { alertas: [{tipo, icone, titulo, mensagem}] }
       - calendario-vencimentos -> { vencimentos: [{data, titulo, tipo}] }
     """
-    try:
-        if widget_id == "kpi-empenhos":
-            return jsonify(_data_kpi_empenhos())
-
-        elif widget_id == "kpi-financeiro":
-            return jsonify(_data_kpi_financeiro())
-
-        elif widget_id == "kpi-contratos":
-            return jsonify(_data_contratos())
-
-        elif widget_id == "grafico-evolucao":
-            return jsonify(_data_grafico_evolucao())
-
-        elif widget_id == "grafico-pizza":
-            return jsonify(_data_grafico_pizza())
-
-        elif widget_id == "tabela-top-fornecedores":
-            return jsonify(_data_top_fornecedores())
+    provider = _widget_provider(widget_id)
+    if provider is None:
+        return jsonify({"error": "widget não implementado"}), 404
 
-        elif widget_id == "alertas-sistema":
-            return jsonify(_data_alertas_sistema())
-
-        elif widget_id == "calendario-vencimentos":
-            return jsonify(_data_calendario_vencimentos())
-
-        else:
-            return jsonify({"error": "widget não implementado"}), 404
+    try:
+        return jsonify(provider())
 
     except Exception as e:
         logger.error(f"Erro ao buscar dados do widget {widget_id}: {str(e)}")
@@ -2297,40 +2202,88 @@ def get_widget_data(widget_id):
         }), 200
 
 
+def _calcular_widget(app, widget_id):
+    """Calcula um widget em seu próprio app context (sessão de banco isolada)."""
+    provider = _widget_provider(widget_id)
+    if provider is None:
+        return {"error": "widget não implementado"}
+    with app.app_context():
+        try:
+            return provider()
+        except Exception as e:
+            logger.error(f"Erro ao buscar dados do widget {widget_id}: {str(e)}")
+            return {"error": str(e), "fallback": True}
+        finally:
+            db.session.remove()
+
+
+def _lote_paralelo():
+    """Widgets em paralelo só quando o banco aceita várias conexões de leitura."""
+    if current_app.config.get('WIDGET_BATCH_WORKERS', 4) <= 1:
+        return False
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and (url.database in (None, '', ':memory:')):
+        return False
+    return True
+
+
+@relatorios_bp.route('/api/widget-data/batch')
+@login_required
+@etag_condicional('widget-data-batch')
+def get_widget_data_batch():
+    """
+    Dados de vários widgets em uma única requisição.
+    Uso: /relatorios/api/widget-data/batch?ids=kpi-empenhos,kpi-financeiro,...
+    Devolve { widget_id: payload } com o mesmo formato do endpoint individual.
+    """
+    ids = []
+    for valor in request.args.getlist('ids'):
+        ids.extend(i.strip() for i in valor.split(',') if i.strip())
+    ids = list(dict.fromkeys(ids))[:MAX_WIDGETS_LOTE]
+    if not ids:
+        return jsonify({"error": "informe ids=widget1,widget2"}), 400
+
+    app = current_app._get_current_object()
+    if _lote_paralelo() and len(ids) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        workers = min(len(ids), current_app.config.get('WIDGET_BATCH_WORKERS', 4))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            resultados = list(executor.map(lambda w: _calcular_widget(app, w), ids))
+    else:
+        resultados = [_calcular_widget(app, w) for w in ids]
+
+    return jsonify(dict(zip(ids, resultados)))
+
+
 # ===== Implementações de dados =====
 
 def _data_kpi_empenhos():
-    total = db.session.query(func.count(Empenho.id)).scalar() or 0
+    from utils.agregados import ler_dimensao
+    por_status = ler_dimensao("empenho_status")
+    total = sum(d["quantidade"] for d in por_status.values())
     # status 'ATIVO' não é típico em empenho; ajuste: considera aprovados/pagos como "ativos"
-    ativos = db.session.query(func.count(Empenho.id)).filter(
-        func.upper(Empenho.status).in_(["APROVADO", "PAGO"])
-    ).scalar() or 0
+    ativos = sum(por_status.get(s, {}).get("quantidade", 0) for s in ("APROVADO", "PAGO"))
 
     return {"total": int(total), "ativos": int(ativos)}
 
 def _data_kpi_financeiro():
     # Total empenhado no mês atual vs mês anterior para % de variação
-    col_data = _safe_date_col(Empenho, 'data_criacao', 'data_empenho')
+    # (lido dos agregados mensais, chave = mês de data_criacao/data_empenho)
+    from utils.agregados import ler_dimensao
     hoje = date.today()
     inicio_mes = hoje.replace(day=1)
-    # mês anterior
-    if inicio_mes.month == 1:
-        inicio_mes_ant = inicio_mes.replace(year=inicio_mes.year - 1, month=12)
-    else:
-        inicio_mes_ant = inicio_mes.replace(month=inicio_mes.month - 1)
+    inicio_mes_ant = add_months(inicio_mes, -1)
 
-    total_mes = db.session.query(func.coalesce(func.sum(Empenho.valor_empenhado), 0.0))\
-        .filter(col_data >= inicio_mes).scalar() or 0.0
-
-    total_mes_ant = db.session.query(func.coalesce(func.sum(Empenho.valor_empenhado), 0.0))\
-        .filter(col_data >= inicio_mes_ant, col_data < inicio_mes).scalar() or 0.0
+    por_mes = ler_dimensao("empenho_mes")
+    total_mes = por_mes.get(inicio_mes.strftime('%Y-%m'), {}).get("valor", 0.0)
+    total_mes_ant = por_mes.get(inicio_mes_ant.strftime('%Y-%m'), {}).get("valor", 0.0)
 
     variacao = 0.0
     if total_mes_ant:
         variacao = ((total_mes - total_mes_ant) / total_mes_ant) * 100.0
 
     # Também devolve o total geral, que é útil pro KPI
-    valor_total = db.session.query(func.coalesce(func.sum(Empenho.valor_empenhado), 0.0)).scalar() or 0.0
+    valor_total = sum(d["valor"] for d in por_mes.values())
 
     return {
         "valor_total": _fmt_money(valor_total),
@@ -2338,61 +2291,27 @@ def _data_kpi_financeiro():
     }
 
 def _data_contratos():
-    """Widget de contratos - estatísticas e status"""
+    """Widget de contratos - estatísticas e status (a partir dos agregados status|data_fim)"""
     try:
-        # Verificar se a tabela contratos existe
-        try:
-            total_contratos = db.session.query(func.count(Contrato.id)).scalar() or 0
-        except Exception:
-            # Se não existir tabela contratos, usar dados de fallback
-            return {
-                "total_contratos": 0,
-                "ativos": 0,
-                "vencendo": 0,
-                "vencidos": 0,
-                "valor_total": "R$ 0,00",
-                "dados_grafico": []
-            }
-
-        # Contar contratos por status se existir campo status
-        try:
-            contratos_ativos = db.session.query(func.count(Contrato.id))\
-                .filter(or_(Contrato.status == 'ATIVO', Contrato.status == 'ativo')).scalar() or 0
-        except Exception:
-            # Se não tiver campo status, usar data_fim para determinar
-            hoje = date.today()
-            contratos_ativos = db.session.query(func.count(Contrato.id))\
-                .filter(Contrato.data_fim >= hoje).scalar() or 0
-
-        # Verificar contratos vencendo (próximos 30 dias)
+        from utils.agregados import ler_dimensao
         hoje = date.today()
         data_limite = hoje + timedelta(days=30)
-        try:
-            contratos_vencendo = db.session.query(func.count(Contrato.id))\
-                .filter(or_(
-                    Contrato.status == 'VENCENDO',
-                    and_(Contrato.data_fim >= hoje, Contrato.data_fim <= data_limite)
-                )).scalar() or 0
-        except Exception:
-            contratos_vencendo = db.session.query(func.count(Contrato.id))\
-                .filter(Contrato.data_fim >= hoje, Contrato.data_fim <= data_limite).scalar() or 0
-
-        # Verificar contratos vencidos
-        try:
-            contratos_vencidos = db.session.query(func.count(Contrato.id))\
-                .filter(or_(
-                    Contrato.status == 'VENCIDO',
-                    Contrato.data_fim < hoje
-                )).scalar() or 0
-        except Exception:
-            contratos_vencidos = db.session.query(func.count(Contrato.id))\
-                .filter(Contrato.data_fim < hoje).scalar() or 0
-
-        # Valor total dos contratos
-        try:
-            valor_total = db.session.query(func.coalesce(func.sum(Contrato.valor_total), 0.0)).scalar() or 0.0
-        except Exception:
-            valor_total = 0.0
+
+        total_contratos = contratos_ativos = contratos_vencendo = contratos_vencidos = 0
+        valor_total = 0.0
+        for chave, dados in ler_dimensao("contrato_status_fim").items():
+            status, _, fim = chave.partition("|")
+            data_fim = date.fromisoformat(fim) if fim else None
+            qtd = dados["quantidade"]
+
+            total_contratos += qtd
+            valor_total += dados["valor"]
+            if status == 'ATIVO':
+                contratos_ativos += qtd
+            if status == 'VENCENDO' or (data_fim and hoje <= data_fim <= data_limite):
+                contratos_vencendo += qtd
+            if status == 'VENCIDO' or (data_fim and data_fim < hoje):
+                contratos_vencidos += qtd
 
         # Dados para gráfico de pizza (status dos contratos)
         dados_grafico = [
@@ -2410,6 +2329,7 @@ def _data_contratos():
             "dados_grafico": dados_grafico
         }
     except Exception as e:
+        logger.error(f"Erro ao calcular widget de contratos: {e}")
         # Fallback completo em caso de erro
         return {
             "total_contratos": 0,
@@ -2422,25 +2342,15 @@ def _data_contratos():
 
 def _data_grafico_evolucao():
     """
-    Evolução mensal (últimos 12 meses) do valor_empenhado.
+    Evolução mensal (últimos 12 meses) do valor_empenhado, lida dos agregados mensais.
     """
-    col_data = _safe_date_col(Empenho, 'data_criacao', 'data_empenho')
+    from utils.agregados import ler_dimensao
     labels = _last_months_labels(12)
-    # traz últimos 14 meses para garantir cobertura e depois agrega em Python (mais portável)
-    dt_limite = date.today() - timedelta(days=430)
-
-    rows = db.session.query(col_data, Empenho.valor_empenhado)\
-        .filter(col_data.isnot(None), col_data >= dt_limite)\
-        .all()
+    # label 'MM/AAAA' -> chave 'AAAA-MM' dos agregados
+    chaves = {lbl: f"{lbl[3:]}-{lbl[:2]}" for lbl in labels}
+    agg = ler_dimensao("empenho_mes", chaves.values())
 
-    agg = defaultdict(float)
-    for dt, valor in rows:
-        if not dt:
-            continue
-        key = _month_key(dt)
-        agg[key] += float(valor or 0.0)
-
-    values = [round(agg.get(lbl, 0.0), 2) for lbl in labels]
+    values = [round(agg.get(chaves[lbl], {}).get("valor", 0.0), 2) for lbl in labels]
 
     return {"evolucao": {"labels": labels, "values": values}}
 
@@ -2449,8 +2359,8 @@ def _data_grafico_pizza():
     Pizza por status de EMPENHO (ajuste conforme sua necessidade).
     """
     # Mapeia status que existirem em banco
-    rows = db.session.query(func.upper(Empenho.status), func.count(Empenho.id))\
-        .group_by(func.upper(Empenho.status)).all()
+    rows = db.session.query(Empenho.status, func.count(Empenho.id))\
+        .group_by(Empenho.status).all()
 
     labels, values = [], []
     for status, qtd in rows:
@@ -2466,27 +2376,11 @@ def _data_grafico_pizza():
 
 def _data_top_fornecedores():
     """
-    Top fornecedores por soma de valor_empenhado (Empenho) ou valor_total (Contrato).
-    Tenta primeiro Empenho.fornecedor; se não existir, usa Contrato.fornecedor.
+    Top fornecedores por soma de Contrato.valor_total (agregados por fornecedor).
     """
-    fornecedores = []
-
-    # Tenta via Empenho
-    if hasattr(Empenho, "fornecedor"):
-        rows = db.session.query(
-            Empenho.fornecedor,
-            func.coalesce(func.sum(Empenho.valor_empenhado), 0.0)
-        ).group_by(Empenho.fornecedor).order_by(func.sum(Empenho.valor_empenhado).desc()).limit(10).all()
-
-        fornecedores = [{"nome": r[0] or "N/D", "valor": _fmt_money(r[1])} for r in rows if r[0]]
-    # Senão tenta via Contrato
-    elif hasattr(Contrato, "fornecedor"):
-        rows = db.session.query(
-            Contrato.fornecedor,
-            func.coalesce(func.sum(Contrato.valor_total), 0.0)
-        ).group_by(Contrato.fornecedor).order_by(func.sum(Contrato.valor_total).desc()).limit(10).all()
-
-        fornecedores = [{"nome": r[0] or "N/D", "valor": _fmt_money(r[1])} for r in rows if r[0]]
+    from utils.agregados import top_dimensao
+    fornecedores = [{"nome": nome, "valor": _fmt_money(valor)}
+                    for nome, valor in top_dimensao("contrato_fornecedor", 10)]
 
     # Fallback
     if not fornecedores:
@@ -2522,7 +2416,7 @@ def _data_alertas_sistema():
             })
 
     # Empenhos pendentes
-    pendentes = Empenho.query.filter(func.upper(Empenho.status) == "PENDENTE").count() or 0
+    pendentes = Empenho.query.filter(Empenho.status == StatusEmpenho.PENDENTE.value).count() or 0
     if pendentes:
         alertas.append({
             "tipo": "danger",
@@ -2,7 +2,8 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from sqlalchemy import or_
 from datetime import datetime
-from models import db, Contrato, Comunicacao
+from models import db, Contrato, Comunicacao, normalizar_status
+from utils.busca import filtro_busca
 
 workflow_bp = Blueprint('workflow', __name__, url_prefix='/workflow')
 
@@ -65,14 +66,9 @@ def dashboard():
 
     query = Contrato.query
     if q:
-        like = f"%{q}%"
-        query = query.filter(or_(
-            Contrato.numero_contrato.ilike(like), 
-            Contrato.objeto.ilike(like),
-            Contrato.fornecedor.ilike(like)
-        ))
+        query = query.filter(filtro_busca(Contrato, q))
     if status:
-        query = query.filter(Contrato.status.ilike(status))
+        query = query.filter(Contrato.status == normalizar_status(status))
 
     contratos = query.order_by(Contrato.data_criacao.desc()).paginate(
         page=page, per_page=per_page, error_out=False
@@ -231,7 +227,7 @@ def api_contratos():
             Contrato.objeto.ilike(like)
         ))
     if status:
-        query = query.filter(Contrato.status.ilike(status))
+        query = query.filter(Contrato.status == normalizar_status(status))
     
     data = [{
         'id': c.id,
@@ -4,9 +4,12 @@ Script para ALTA DEMANDA - 15 a 30 usuários simultâneos
 Configurações otimizadas para prefeituras com muitos funcionários
 """
 
+import os
+# Pool/pragmas do banco dimensionados para este modo (lido ao importar o app)
+os.environ.setdefault('DB_MODO', 'alta_demanda')
+
 from waitress import serve
 from app import app
-import os
 import multiprocessing
 
 def run_high_capacity():
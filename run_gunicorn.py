@@ -8,6 +8,9 @@ import subprocess
 import sys
 import os
 
+THREADS_REQUISICOES = 5   # requisições comuns por worker
+STREAMS_POR_WORKER = 3    # streams SSE do chat por worker (acima disso, polling)
+
 def run_gunicorn():
     """Roda o sistema com Gunicorn"""
     
@@ -24,7 +27,8 @@ def run_gunicorn():
         "--bind", "0.0.0.0:8000",
         "--workers", "4",         # 4 processos para mais usuários
         "--timeout", "120",
-        "--worker-class", "sync",
+        "--worker-class", "gthread",
+        "--threads", str(THREADS_REQUISICOES + STREAMS_POR_WORKER),
         "--worker-connections", "1000",
         "--max-requests", "2000", # Mais requisições por worker
         "--max-requests-jitter", "100",
@@ -37,8 +41,10 @@ def run_gunicorn():
     print("💡 Para parar: Ctrl+C")
     print("=" * 50)
     
+    # Cada stream SSE prende uma thread do worker; o limite fica abaixo das threads
+    env = dict(os.environ, EVENTOS_MAX_CONEXOES=str(STREAMS_POR_WORKER))
     try:
-        subprocess.run(cmd, check=True)
+        subprocess.run(cmd, check=True, env=env)
     except KeyboardInterrupt:
         print("\n✅ Servidor parado pelo usuário")
     except subprocess.CalledProcessError as e:
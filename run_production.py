@@ -4,9 +4,15 @@ Script para rodar o sistema em modo PRODUÇÃO LOCAL
 usando Waitress (servidor WSGI profissional)
 """
 
+import os
+# Pool/pragmas do banco dimensionados para este modo (lido ao importar o app)
+os.environ.setdefault('DB_MODO', 'producao')
+
 from waitress import serve
 from app import app
-import os
+from utils.eventos import eventos
+
+THREADS_REQUISICOES = 20  # requisições comuns atendidas ao mesmo tempo
 
 def run_production():
     """Roda o sistema em modo produção local"""
@@ -26,6 +32,9 @@ def run_production():
     # Configurações do servidor
     host = '0.0.0.0'  # Permite acesso de outros computadores na rede
     port = 8000       # Porta diferente do desenvolvimento
+    # Cada stream SSE do chat prende uma thread; as streams ficam limitadas a
+    # EVENTOS_MAX_CONEXOES (acima disso o chat usa polling) e ganham threads próprias
+    threads = THREADS_REQUISICOES + eventos.max_conexoes
     
     print(f"📍 Rodando em:")
     print(f"   • Local: http://127.0.0.1:{port}")
@@ -43,7 +52,7 @@ def run_production():
             app,
             host=host,
             port=port,
-            threads=20,       # Suporta 20 usuários simultâneos
+            threads=threads,  # 20 usuários simultâneos + streams do chat
             cleanup_interval=30,
             channel_timeout=120,
             connection_limit=100,  # Máximo 100 conexões
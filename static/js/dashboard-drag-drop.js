@@ -304,7 +304,7 @@ class DashboardManager {
         return col;
     }
 
-    addWidget(widgetId) {
+    addWidget(widgetId, { loadData = true } = {}) {
         const widgetConfig = this.widgetLibrary.find(w => w.id === widgetId);
         if (!widgetConfig) return;
 
@@ -316,7 +316,7 @@ class DashboardManager {
             autoPosition: true
         });
 
-        this.loadWidgetData(widgetId);
+        if (loadData) this.loadWidgetData(widgetId);
         this.showSuccessMessage(`Widget "${widgetConfig.name}" adicionado com sucesso!`);
     }
 
@@ -367,12 +367,12 @@ class DashboardManager {
         return widgetEl;
     }
 
-    async loadWidgetData(widgetId) {
+    async loadWidgetData(widgetId, prefetched = null) {
         const contentEl = document.getElementById(`widget-content-${widgetId}`);
         if (!contentEl) return;
 
         try {
-            const data = await this.fetchWidgetData(widgetId);
+            const data = prefetched || await this.fetchWidgetData(widgetId);
             const html = this.renderWidgetContent(widgetId, data);
             contentEl.innerHTML = html;
 
@@ -389,6 +389,31 @@ class DashboardManager {
         }
     }
 
+    // Carrega vários widgets com uma única requisição ao endpoint em lote
+    async loadWidgetsData(widgetIds) {
+        const ids = [...new Set(widgetIds)];
+        if (!ids.length) return;
+
+        let payloads = null;
+        try {
+            const response = await fetch(`/relatorios/api/widget-data/batch?ids=${encodeURIComponent(ids.join(','))}`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            payloads = await response.json();
+        } catch (error) {
+            console.warn('Lote de widgets indisponível, carregando individualmente:', error);
+        }
+
+        ids.forEach(widgetId => {
+            const data = payloads ? payloads[widgetId] : null;
+            // Widgets estáticos (ex.: acoes-rapidas) não têm dados no servidor
+            if (data && data.error === 'widget não implementado' && widgetId === 'acoes-rapidas') {
+                this.loadWidgetData(widgetId, { success: true, message: 'Widget estático' });
+            } else {
+                this.loadWidgetData(widgetId, data);
+            }
+        });
+    }
+
     async fetchWidgetData(widgetId) {
         try {
             const response = await fetch(`/relatorios/api/widget-data/${widgetId}`);
@@ -671,8 +696,9 @@ class DashboardManager {
         const defaultWidgets = ['kpi-empenhos', 'kpi-financeiro', 'kpi-contratos', 'grafico-evolucao', 'alertas-sistema'];
         
         defaultWidgets.forEach(widgetId => {
-            this.addWidget(widgetId);
+            this.addWidget(widgetId, { loadData: false });
         });
+        this.loadWidgetsData(defaultWidgets);
     }
 
     formatCurrency(value) {
@@ -854,9 +880,8 @@ window.updateWidgetData = function(widgetId) {
 // Função global para atualizar todos os widgets
 window.refreshAllWidgets = function() {
     if (window.dashboardManager) {
-        document.querySelectorAll('[data-widget-id]').forEach(widget => {
-            const widgetId = widget.getAttribute('data-widget-id');
-            window.dashboardManager.loadWidgetData(widgetId);
-        });
+        const ids = Array.from(document.querySelectorAll('.grid-stack-item[data-widget-id]'))
+            .map(widget => widget.getAttribute('data-widget-id'));
+        window.dashboardManager.loadWidgetsData(ids);
     }
 };
@@ -0,0 +1,330 @@
+"""
+Agregados materializados do painel.
+
+A tabela ``dashboard_agregados`` guarda, por dimensão (mês, status,
+fornecedor, contrato), a quantidade e o valor somado de empenhos, contratos e
+notas fiscais. Ela é mantida incrementalmente por hooks ``after_insert``,
+``after_update`` e ``after_delete`` do SQLAlchemy, de modo que os widgets do
+painel leem O(meses) linhas em vez de varrer as tabelas de origem.
+
+Alterações feitas fora do ORM (SQL cru, ``query.update()``, scripts de
+migração) não passam pelos hooks; nesses casos rode
+``python reconstruir_agregados.py`` para recalcular tudo.
+
+A primeira construção roda na inicialização do app (``garantir_agregados``),
+nunca numa requisição: as leituras só leem e, enquanto a tabela não foi
+construída, calculam a dimensão direto das tabelas de origem.
+"""
+
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import event, inspect, select, text
+
+from models import db, Empenho, Contrato, NotaFiscal, DashboardAgregado, normalizar_status
+
+logger = logging.getLogger(__name__)
+
+# Linha de controle: indica que a tabela já foi construída ao menos uma vez
+DIMENSAO_META = '_meta'
+CHAVE_CONSTRUIDO = 'construido'
+
+_tabela = DashboardAgregado.__table__
+_construido = False  # cache do processo: a linha de controle já foi vista
+
+# prefixo da dimensão -> modelo de origem (cálculo direto antes da construção)
+MODELO_POR_PREFIXO = {'empenho_': Empenho, 'contrato_': Contrato, 'nota_': NotaFiscal}
+
+
+# ----------------- Chaves das dimensões -----------------
+
+def _mes(valor):
+    return valor.strftime('%Y-%m') if valor else ''
+
+
+def _status(valor):
+    return normalizar_status(valor) or ''
+
+
+def _texto(valor):
+    return (valor or '').strip()[:255]
+
+
+def _dimensoes_empenho(v):
+    data = v['data_criacao'] or v['data_empenho']
+    return [
+        ('empenho_status', _status(v['status'])),
+        ('empenho_mes', _mes(data)),
+        ('empenho_fornecedor', _texto(v['fornecedores'])),
+        ('empenho_contrato', str(v['contrato_id'] or '')),
+    ]
+
+
+def _dimensoes_contrato(v):
+    status = _status(v['status'])
+    fim = v['data_fim'].isoformat() if v['data_fim'] else ''
+    return [
+        ('contrato_status', status),
+        ('contrato_fornecedor', _texto(v['fornecedor'])),
+        ('contrato_status_fim', f'{status}|{fim}'),
+    ]
+
+
+def _dimensoes_nota(v):
+    return [
+        ('nota_status', _status(v['status'])),
+        ('nota_mes', _mes(v['data_emissao'])),
+        ('nota_empenho', str(v['empenho_id'] or '')),
+    ]
+
+
+# modelo -> (colunas usadas, coluna de valor, função de dimensões)
+REGISTROS = {
+    Empenho: (('status', 'data_criacao', 'data_empenho', 'fornecedores', 'contrato_id'),
+              'valor_empenhado', _dimensoes_empenho),
+    Contrato: (('status', 'fornecedor', 'data_fim'),
+               'valor_total', _dimensoes_contrato),
+    NotaFiscal: (('status', 'data_emissao', 'empenho_id'),
+                 'valor_liquido', _dimensoes_nota),
+}
+
+
+def _contribuicoes(model, valores, sinal=1):
+    """Lista de (dimensao, chave, quantidade, valor) que um registro soma aos agregados."""
+    _, col_valor, dimensoes = REGISTROS[model]
+    valor = Decimal(str(valores[col_valor] or 0)) * sinal
+    return [(dim, chave, sinal, valor) for dim, chave in dimensoes(valores)]
+
+
+def _valores_atuais(model, target):
+    colunas, col_valor, _ = REGISTROS[model]
+    return {c: getattr(target, c) for c in colunas + (col_valor,)}
+
+
+def _valores_anteriores(model, target):
+    """Valores antes do flush corrente (a partir do histórico dos atributos)."""
+    colunas, col_valor, _ = REGISTROS[model]
+    state = inspect(target)
+    valores = {}
+    for c in colunas + (col_valor,):
+        hist = state.attrs[c].history
+        if hist.deleted:
+            valores[c] = hist.deleted[0]
+        elif hist.unchanged:
+            valores[c] = hist.unchanged[0]
+        else:
+            valores[c] = getattr(target, c)
+    return valores
+
+
+def _houve_mudanca(model, target):
+    colunas, col_valor, _ = REGISTROS[model]
+    state = inspect(target)
+    return any(state.attrs[c].history.has_changes() for c in colunas + (col_valor,))
+
+
+# ----------------- Escrita incremental -----------------
+
+def _upsert(dialeto):
+    """INSERT que soma na linha existente da mesma (dimensao, chave); None se o dialeto não tem upsert."""
+    if dialeto in ('sqlite', 'postgresql'):
+        if dialeto == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(_tabela)
+        return stmt.on_conflict_do_update(
+            index_elements=[_tabela.c.dimensao, _tabela.c.chave],
+            set_={'quantidade': _tabela.c.quantidade + stmt.excluded.quantidade,
+                  'valor': _tabela.c.valor + stmt.excluded.valor})
+    if dialeto in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(_tabela)
+        return stmt.on_duplicate_key_update(
+            quantidade=_tabela.c.quantidade + stmt.inserted.quantidade,
+            valor=_tabela.c.valor + stmt.inserted.valor)
+    return None
+
+
+def _aplicar(connection, deltas):
+    """Soma os deltas na tabela de agregados.
+
+    Upsert do dialeto: duas transações criando a mesma chave nova (mês, status,
+    fornecedor) ao mesmo tempo somam na mesma linha em vez de a segunda falhar
+    na restrição única e derrubar a gravação do usuário.
+    """
+    acumulado = defaultdict(lambda: [0, Decimal('0')])
+    for dim, chave, qtd, valor in deltas:
+        acumulado[(dim, chave)][0] += qtd
+        acumulado[(dim, chave)][1] += valor
+
+    linhas = [{'dimensao': dim, 'chave': chave, 'quantidade': qtd, 'valor': valor}
+              for (dim, chave), (qtd, valor) in acumulado.items() if qtd or valor]
+    if not linhas:
+        return
+    upsert = _upsert(connection.dialect.name)
+    if upsert is not None:
+        connection.execute(upsert, linhas)
+        return
+
+    for linha in linhas:
+        resultado = connection.execute(
+            _tabela.update()
+            .where(_tabela.c.dimensao == linha['dimensao'], _tabela.c.chave == linha['chave'])
+            .values(quantidade=_tabela.c.quantidade + linha['quantidade'],
+                    valor=_tabela.c.valor + linha['valor'])
+        )
+        if resultado.rowcount == 0:
+            connection.execute(_tabela.insert().values(**linha))
+
+
+def _after_insert(mapper, connection, target):
+    model = mapper.class_
+    _aplicar(connection, _contribuicoes(model, _valores_atuais(model, target)))
+
+
+def _after_update(mapper, connection, target):
+    model = mapper.class_
+    if not _houve_mudanca(model, target):
+        return
+    deltas = _contribuicoes(model, _valores_anteriores(model, target), sinal=-1)
+    deltas += _contribuicoes(model, _valores_atuais(model, target))
+    _aplicar(connection, deltas)
+
+
+def _after_delete(mapper, connection, target):
+    model = mapper.class_
+    _aplicar(connection, _contribuicoes(model, _valores_anteriores(model, target), sinal=-1))
+
+
+def aplicar_insercoes_em_massa(model, registros, connection=None):
+    """
+    Soma aos agregados linhas inseridas por bulk insert (``session.execute(insert(...))``),
+    que não disparam os hooks ``after_insert``. ``registros`` são dicts com as colunas do modelo.
+    """
+    colunas, col_valor, _ = REGISTROS[model]
+    deltas = []
+    for registro in registros:
+        deltas += _contribuicoes(model, {c: registro.get(c) for c in colunas + (col_valor,)})
+    _aplicar(connection or db.session.connection(), deltas)
+
+
+def _noop_set(target, value, oldvalue, initiator):
+    return value
+
+
+_hooks_registrados = False
+
+
+def registrar_hooks_agregados():
+    """Registra os hooks de manutenção incremental (idempotente)."""
+    global _hooks_registrados
+    if _hooks_registrados:
+        return
+    for model, (colunas, col_valor, _) in REGISTROS.items():
+        # active_history garante o valor antigo no histórico mesmo se o atributo estava expirado
+        for c in colunas + (col_valor,):
+            event.listen(getattr(model, c), 'set', _noop_set, active_history=True, retval=True)
+        event.listen(model, 'after_insert', _after_insert)
+        event.listen(model, 'after_update', _after_update)
+        event.listen(model, 'after_delete', _after_delete)
+    _hooks_registrados = True
+
+
+# ----------------- Reconstrução completa -----------------
+
+def _acumular(conn, modelos, lote, dimensao=None):
+    """{(dimensao, chave): [quantidade, valor]} somando as linhas dos ``modelos`` (conexão ou sessão)."""
+    acumulado = defaultdict(lambda: [0, Decimal('0')])
+    for model in modelos:
+        colunas, col_valor, _ = REGISTROS[model]
+        nomes = colunas + (col_valor,)
+        resultado = conn.execute(select(*[getattr(model, c) for c in nomes]).execution_options(yield_per=lote))
+        for row in resultado:
+            for dim, chave, qtd, valor in _contribuicoes(model, dict(zip(nomes, row))):
+                if dimensao is None or dim == dimensao:
+                    acumulado[(dim, chave)][0] += qtd
+                    acumulado[(dim, chave)][1] += valor
+    return acumulado
+
+
+def reconstruir_agregados(lote=5000):
+    """Recalcula toda a tabela de agregados a partir das tabelas de origem.
+
+    Tudo numa transação do engine de escrita que trava a tabela de agregados
+    antes de ler as origens (o DELETE vem primeiro: no SQLite pega o lock de
+    escrita, no MySQL trava a faixa do índice; no PostgreSQL há LOCK TABLE).
+    Um hook que grave durante a reconstrução espera o commit e soma o seu delta
+    depois, em vez de ter o delta apagado por uma leitura que não viu a linha.
+    """
+    global _construido
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(f'LOCK TABLE {_tabela.name} IN EXCLUSIVE MODE'))
+        conn.execute(_tabela.delete())
+        acumulado = _acumular(conn, REGISTROS, lote)
+        linhas = [{'dimensao': dim, 'chave': chave, 'quantidade': qtd, 'valor': valor}
+                  for (dim, chave), (qtd, valor) in acumulado.items()]
+        linhas.append({'dimensao': DIMENSAO_META, 'chave': CHAVE_CONSTRUIDO, 'quantidade': 1, 'valor': 0})
+        for i in range(0, len(linhas), lote):
+            conn.execute(_tabela.insert(), linhas[i:i + lote])
+    _construido = True
+    logger.info(f"Agregados do painel reconstruídos: {len(linhas) - 1} linhas")
+    return len(linhas) - 1
+
+
+def agregados_construidos():
+    """A tabela já foi construída (linha de controle presente)?"""
+    global _construido
+    if not _construido:
+        _construido = db.session.query(DashboardAgregado.id).filter_by(
+            dimensao=DIMENSAO_META, chave=CHAVE_CONSTRUIDO).first() is not None
+    return _construido
+
+
+def garantir_agregados():
+    """Constrói a tabela se ainda não foi construída (inicialização do app; nunca numa leitura)."""
+    if agregados_construidos():
+        return False
+    reconstruir_agregados()
+    return True
+
+
+def _calcular_dimensao(dimensao):
+    """Dimensão calculada direto da tabela de origem (antes da primeira construção)."""
+    modelo = next((m for prefixo, m in MODELO_POR_PREFIXO.items() if dimensao.startswith(prefixo)), None)
+    if modelo is None:
+        return {}
+    acumulado = _acumular(db.session, [modelo], 5000, dimensao)
+    return {chave: (qtd, valor) for (_, chave), (qtd, valor) in acumulado.items()}
+
+
+# ----------------- Leitura -----------------
+
+def ler_dimensao(dimensao, chaves=None):
+    """Retorna {chave: {'quantidade', 'valor'}} de uma dimensão (opcionalmente filtrada)."""
+    if not agregados_construidos():
+        calculada = _calcular_dimensao(dimensao)
+        return {chave: {'quantidade': int(qtd), 'valor': float(valor)} for chave, (qtd, valor) in calculada.items()
+                if qtd and (chaves is None or chave in chaves)}
+    query = db.session.query(DashboardAgregado.chave, DashboardAgregado.quantidade,
+                             DashboardAgregado.valor).filter(DashboardAgregado.dimensao == dimensao)
+    if chaves is not None:
+        query = query.filter(DashboardAgregado.chave.in_(list(chaves)))
+    return {row.chave: {'quantidade': int(row.quantidade or 0), 'valor': float(row.valor or 0)}
+            for row in query.all() if row.quantidade}
+
+
+def top_dimensao(dimensao, limite=10):
+    """Maiores chaves de uma dimensão por valor (ignora chave vazia)."""
+    if not agregados_construidos():
+        calculada = sorted(((chave, float(valor)) for chave, (qtd, valor) in _calcular_dimensao(dimensao).items()
+                            if chave != '' and qtd > 0), key=lambda item: -item[1])
+        return calculada[:limite]
+    rows = db.session.query(DashboardAgregado.chave, DashboardAgregado.valor).filter(
+        DashboardAgregado.dimensao == dimensao,
+        DashboardAgregado.chave != '',
+        DashboardAgregado.quantidade > 0,
+    ).order_by(DashboardAgregado.valor.desc()).limit(limite).all()
+    return [(row.chave, float(row.valor or 0)) for row in rows]
@@ -0,0 +1,30 @@
+"""
+Carrega o ``app`` Flask de app.py para os scripts de linha de comando.
+
+``from app import app`` não funciona: o nome ``app`` resolve para o pacote
+app/ (blueprints antigos), não para app.py, e o import falha com
+ImportError. Aqui app.py é carregado pelo caminho do arquivo, uma vez por
+processo, com outro nome de módulo para não esconder o pacote.
+"""
+
+import importlib.util
+import os
+import sys
+
+CAMINHO_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+NOME_MODULO = 'app_principal'
+
+
+def carregar_app():
+    """O objeto ``app`` de app.py (inicializa o app na primeira chamada)."""
+    modulo = sys.modules.get(NOME_MODULO)
+    if modulo is None:
+        spec = importlib.util.spec_from_file_location(NOME_MODULO, CAMINHO_APP)
+        modulo = importlib.util.module_from_spec(spec)
+        sys.modules[NOME_MODULO] = modulo
+        try:
+            spec.loader.exec_module(modulo)
+        except BaseException:
+            del sys.modules[NOME_MODULO]
+            raise
+    return modulo.app
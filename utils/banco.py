@@ -0,0 +1,250 @@
+"""
+Configuração do engine do banco por modo de implantação.
+
+SQLite servido por várias threads (waitress) precisa de mais que
+``check_same_thread=False``: sem WAL, cada leitura bloqueia as gravações e
+vice-versa ("database is locked"). ``opcoes_engine`` monta
+``SQLALCHEMY_ENGINE_OPTIONS`` com o pool dimensionado para o número de
+threads do modo e ``registrar_pragmas`` aplica em toda conexão nova:
+
+- ``journal_mode=WAL``: leitores não bloqueiam o gravador (e vice-versa);
+- ``synchronous=NORMAL``: fsync só no checkpoint do WAL (seguro com WAL);
+- ``busy_timeout``: espera o lock em vez de falhar na hora;
+- ``mmap_size`` / ``cache_size`` / ``temp_store=MEMORY``: menos leituras de disco
+  e ordenações/tabelas temporárias em memória.
+
+Modo (``DB_MODO`` em app.config ou variável de ambiente): desenvolvimento |
+producao | alta_demanda. Os pragmas podem ser sobrescritos em
+``app.config['SQLITE_PRAGMAS']``. ``python benchmark_sqlite.py`` compara a
+concorrência de leitura/gravação com e sem esta configuração.
+
+Separação leitura/gravação (SQLite em arquivo; ``DB_LEITURA_SEPARADA=0``
+desliga): os SELECTs da sessão vão para um pool próprio de conexões só de
+leitura (``query_only``) e todo o resto (flush, UPDATE/DELETE em massa, SQL
+textual) para o engine principal. Depois que a sessão grava, as leituras
+seguem no engine principal até o commit, para enxergar as próprias
+alterações. Gravações curtas e frequentes passam pela fila de
+utils/gravador.py, que as agrupa em transações em lote.
+
+Backend (perfil de produção): ``DATABASE_URL`` (URL SQLAlchemy completa) tem
+precedência; senão ``DB_PERFIL`` = sqlite (padrão) | mysql | postgresql monta
+a URL a partir de ``DB_HOST``, ``DB_PORTA``, ``DB_USUARIO``, ``DB_SENHA`` e
+``DB_NOME``. Em MySQL/PostgreSQL o pool usa ``pool_pre_ping``/``pool_recycle``
+e cada comando tem tempo máximo de ``DB_TIMEOUT_CONSULTA`` segundos (padrão
+30; 0 desliga). Consultas com funções de data devem usar utils/datas_sql.py,
+que compila para cada dialeto.
+"""
+
+import logging
+import os
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, make_url
+
+logger = logging.getLogger(__name__)
+
+# modo -> (threads do servidor que usam o banco, conexões extras além do pool)
+MODOS = {
+    'desenvolvimento': (5, 5),   # servidor de debug do Flask
+    'producao': (20, 5),         # run_production.py (waitress, 20 threads)
+    'alta_demanda': (30, 10),    # run_alta_demanda.py (waitress, até 30 threads)
+}
+MODO_PADRAO = 'desenvolvimento'
+
+BUSY_TIMEOUT_MS = 5000
+TIMEOUT_CONSULTA = 30   # segundos por comando em MySQL/PostgreSQL
+
+# perfil -> (driver SQLAlchemy, porta padrão)
+PERFIS = {
+    'sqlite': None,
+    'mysql': ('mysql+pymysql', 3306),
+    'postgresql': ('postgresql+psycopg2', 5432),
+}
+
+# Ordem importa: journal_mode antes dos demais
+PRAGMAS_SQLITE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': BUSY_TIMEOUT_MS,
+    'mmap_size': 256 * 1024 * 1024,   # 256 MB mapeados (o arquivo inteiro na maioria das prefeituras)
+    'cache_size': -16000,              # ~16 MB de páginas por conexão (negativo = KiB)
+    'temp_store': 'MEMORY',
+}
+
+
+def _conf(app, nome, padrao=None):
+    return (app.config.get(nome) if app is not None else None) or os.environ.get(nome) or padrao
+
+
+def modo_banco(app):
+    modo = str(_conf(app, 'DB_MODO', MODO_PADRAO)).lower()
+    if modo not in MODOS:
+        logger.warning(f"DB_MODO '{modo}' desconhecido, usando {MODO_PADRAO}")
+        modo = MODO_PADRAO
+    return modo
+
+
+def eh_sqlite(uri):
+    return str(uri).startswith('sqlite')
+
+
+def uri_banco(app, padrao):
+    """URL do banco pelo ambiente (``DATABASE_URL`` ou ``DB_PERFIL``); ``padrao`` é o SQLite local."""
+    url = _conf(app, 'DATABASE_URL')
+    if url:
+        # Provedores que ainda entregam o esquema antigo "postgres://"
+        return 'postgresql://' + url[len('postgres://'):] if url.startswith('postgres://') else url
+    perfil = str(_conf(app, 'DB_PERFIL', 'sqlite')).lower()
+    if perfil not in PERFIS:
+        logger.warning(f"DB_PERFIL '{perfil}' desconhecido, usando sqlite")
+        perfil = 'sqlite'
+    if perfil == 'sqlite':
+        arquivo = _conf(app, 'DB_NOME')
+        return f"sqlite:///{os.path.abspath(arquivo)}" if arquivo else padrao
+    driver, porta = PERFIS[perfil]
+    return URL.create(
+        driver,
+        username=_conf(app, 'DB_USUARIO', 'empenhos'),
+        password=_conf(app, 'DB_SENHA'),
+        host=_conf(app, 'DB_HOST', 'localhost'),
+        port=int(_conf(app, 'DB_PORTA', porta)),
+        database=_conf(app, 'DB_NOME', 'empenhos'),
+        query={'charset': 'utf8mb4'} if perfil == 'mysql' else {},
+    ).render_as_string(hide_password=False)
+
+
+def timeout_consulta(app):
+    return int(_conf(app, 'DB_TIMEOUT_CONSULTA', TIMEOUT_CONSULTA))
+
+
+def opcoes_engine(uri, modo=MODO_PADRAO, timeout=TIMEOUT_CONSULTA):
+    """SQLALCHEMY_ENGINE_OPTIONS para ``uri`` no ``modo`` (pool = threads do servidor)."""
+    pool_size, max_overflow = MODOS[modo]
+    opcoes = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 30,
+    }
+    if eh_sqlite(uri):
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            # Banco em memória: uma conexão só (o pool padrão do SQLAlchemy), sem pragmas de arquivo
+            return {'connect_args': {'check_same_thread': False}}
+        # timeout do driver = busy_timeout (o pragma abaixo também o define por conexão)
+        opcoes['connect_args'] = {'check_same_thread': False, 'timeout': BUSY_TIMEOUT_MS / 1000}
+    else:
+        opcoes['pool_pre_ping'] = True
+        # Abaixo do wait_timeout comum de MySQL/proxies: não reaproveita conexão que o servidor já fechou
+        opcoes['pool_recycle'] = 1800
+        if timeout and make_url(uri).get_backend_name() == 'postgresql':
+            opcoes['connect_args'] = {'options': f'-c statement_timeout={int(timeout) * 1000}'}
+    return opcoes
+
+
+def registrar_pragmas(engine, pragmas=None):
+    """Aplica os pragmas em cada conexão SQLite nova do ``engine``."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(PRAGMAS_SQLITE, **(pragmas or {}))
+
+    @event.listens_for(engine, 'connect')
+    def _aplicar(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        try:
+            for nome, valor in pragmas.items():
+                cursor.execute(f'PRAGMA {nome}={valor}')
+        finally:
+            cursor.close()
+
+
+def registrar_timeout(engine, segundos=TIMEOUT_CONSULTA):
+    """Tempo máximo por consulta em cada conexão MySQL nova (no PostgreSQL vai em ``connect_args``)."""
+    if engine.dialect.name != 'mysql' or not segundos:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _aplicar(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        try:
+            # MySQL 5.7+ (milissegundos, só SELECT); MariaDB usa max_statement_time (segundos)
+            for comando in (f'SET SESSION max_execution_time={int(segundos) * 1000}',
+                            f'SET SESSION max_statement_time={int(segundos)}'):
+                try:
+                    cursor.execute(comando)
+                    break
+                except Exception:
+                    continue
+            else:
+                logger.warning("Servidor MySQL sem limite de tempo por consulta; DB_TIMEOUT_CONSULTA ignorado")
+        finally:
+            cursor.close()
+
+
+def pragmas_atuais(engine):
+    """Valores efetivos dos pragmas numa conexão do pool (diagnóstico)."""
+    if engine.dialect.name != 'sqlite':
+        return {}
+    with engine.connect() as conn:
+        return {nome: conn.exec_driver_sql(f'PRAGMA {nome}').scalar() for nome in PRAGMAS_SQLITE}
+
+
+def criar_engine_leitura(uri, modo=MODO_PADRAO, pragmas=None):
+    """Pool de conexões só de leitura para o mesmo arquivo SQLite (WAL: não bloqueiam o gravador)."""
+    engine = create_engine(uri, **opcoes_engine(uri, modo))
+    registrar_pragmas(engine, dict(pragmas or {}, query_only='ON'))
+    return engine
+
+
+class SessaoRoteada(Session):
+    """Sessão que manda os SELECTs para o engine de leitura enquanto não gravou nada.
+
+    Só consultas SELECT do ORM são desviadas; flush, operações em massa e
+    ``text()`` ficam no engine principal (pode haver escrita que não dá para
+    detectar). Sem engine de leitura configurado, comporta-se como a sessão padrão.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and clause is not None and not self._flushing and not self.info.get('gravou'):
+            if getattr(clause, 'is_select', False):
+                leitura = current_app.extensions.get('banco_leitura')
+                if leitura is not None:
+                    return leitura
+            elif getattr(clause, 'is_dml', False):
+                self.info['gravou'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(SessaoRoteada, 'after_flush')
+def _marcar_gravacao(session, flush_context):
+    session.info['gravou'] = True
+
+
+@event.listens_for(SessaoRoteada, 'after_transaction_end')
+def _fim_transacao(session, transaction):
+    # Commit/rollback da transação externa: as próximas leituras voltam ao pool de leitura
+    if transaction.parent is None:
+        session.info.pop('gravou', None)
+
+
+def configurar_banco(app):
+    """Define a URL do banco e SQLALCHEMY_ENGINE_OPTIONS pelo modo; chamar antes de ``db.init_app``."""
+    modo = modo_banco(app)
+    uri = uri_banco(app, app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    opcoes = opcoes_engine(uri, modo, timeout_consulta(app))
+    opcoes.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes
+    return modo
+
+
+def init_banco(app, db):
+    """Registra pragmas/timeout no engine e cria o pool de leitura; chamar logo após ``db.init_app``."""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        registrar_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS'))
+        registrar_timeout(db.engine, timeout_consulta(app))
+        separada = str(_conf(app, 'DB_LEITURA_SEPARADA', '1')).lower() not in ('0', 'false', 'nao', 'não')
+        if separada and eh_sqlite(uri) and 'pool_size' in opcoes_engine(uri):
+            app.extensions['banco_leitura'] = criar_engine_leitura(uri, modo_banco(app), app.config.get('SQLITE_PRAGMAS'))
+        return db.engine
@@ -0,0 +1,395 @@
+"""
+Busca textual em contratos, empenhos e notas fiscais.
+
+Cada entidade tem uma tabela FTS5 de conteúdo externo (``contratos_fts``,
+``empenhos_fts``, ``notas_fts``) mantida por triggers, no mesmo modelo de
+``ai_kb_entries_fts`` (ai_kb_setup.py). O tokenizador ``unicode61`` com
+``remove_diacritics 2`` torna a busca insensível a acentos ("licitacao"
+encontra "Licitação") e os índices de prefixo de 2 a 8 caracteres atendem o
+autocomplete sem varrer a tabela: sem índice do tamanho exato, o FTS5 junta em
+memória as doclists de todos os termos com o prefixo (20-80 ms com 1M de
+linhas). Prefixos mais longos são consultados pelos 8 primeiros caracteres e
+conferidos em Python. A relevância é calculada em Python sobre os
+candidatos mais recentes (ver ``_pontuar``), com pesos por coluna.
+
+Números de empenho/contrato/pregão/nota e CNPJs têm um caminho próprio: índices
+B-tree sobre a chave normalizada (minúsculas, sem ``. / -`` e espaços),
+consultados por faixa ``chave >= 'p' AND chave < 'q'``. Cada coluna devolve no
+máximo ``limite`` linhas já na ordem do índice, então o custo é O(log N)
+independente do tamanho da tabela e do prefixo digitado.
+
+Fora do SQLite (ou sem FTS5 compilado) a busca textual cai no
+``ILIKE '%termo%'`` anterior, com os mesmos resultados em formato.
+"""
+
+import logging
+import re
+import unicodedata
+
+from sqlalchemy import text, select, literal_column, table, or_, and_, func
+
+from models import db, Contrato, Empenho, NotaFiscal
+from utils.indices import criar_indices
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_MINIMO = 2
+LIMITE_PADRAO = 10
+# O ranking é feito sobre os N registros mais recentes que casam com a busca
+# (prefixos curtos como "a*" casariam com boa parte da tabela)
+MAX_CANDIDATOS = 200
+# Tamanhos de prefixo com índice no FTS5 (o índice só vale para o tamanho exato)
+PREFIXOS_INDEXADOS = (2, 3, 4, 5, 6, 7, 8)
+PREFIXO_MAXIMO = max(PREFIXOS_INDEXADOS)
+
+# entidade -> (modelo, tabela FTS, colunas indexadas, pesos de relevância)
+ENTIDADES = {
+    'contratos': (Contrato, 'contratos_fts',
+                  ('numero_contrato', 'numero_pregao', 'objeto', 'fornecedor'),
+                  (10.0, 5.0, 1.0, 3.0)),
+    'empenhos': (Empenho, 'empenhos_fts',
+                 ('numero_empenho', 'numero_pregao', 'resumo_objeto', 'fornecedores'),
+                 (10.0, 5.0, 1.0, 3.0)),
+    'notas': (NotaFiscal, 'notas_fts',
+              ('numero_nota', 'fornecedor_nome', 'fornecedor_cnpj', 'chave_acesso'),
+              (10.0, 3.0, 5.0, 5.0)),
+}
+
+# entidade -> colunas de identificadores buscados por prefixo
+CHAVES_PREFIXO = {
+    'contratos': ('numero_contrato', 'numero_pregao', 'cnpj_fornecedor'),
+    'empenhos': ('numero_empenho', 'numero_pregao', 'numero_contrato'),
+    'notas': ('numero_nota', 'fornecedor_cnpj'),
+}
+# Retirados da chave: "123/2024", "1232024" e "123-2024" são o mesmo número
+SEPARADORES = ('.', '/', '-', ' ')
+# Resultado por prefixo fica sempre acima dos resultados do FTS
+SCORE_PREFIXO = 1000.0
+
+_disponivel = False
+
+_RE_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+# ----------------- Esquema -----------------
+
+def _fts5_suportado(conn):
+    if conn.dialect.name != 'sqlite':
+        return False
+    opcoes = {linha[0] for linha in conn.execute(text("PRAGMA compile_options"))}
+    return 'ENABLE_FTS5' in opcoes
+
+
+def _criar_indice(conn, entidade):
+    modelo, fts, colunas, _ = ENTIDADES[entidade]
+    origem = modelo.__tablename__
+    lista = ', '.join(colunas)
+    novos = ', '.join(f'new.{c}' for c in colunas)
+    antigos = ', '.join(f'old.{c}' for c in colunas)
+    prefixos = ' '.join(str(n) for n in PREFIXOS_INDEXADOS)
+
+    # Tabela criada com outros índices de prefixo: recria (o rebuild abaixo repopula)
+    existente = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :nome"),
+                             {'nome': fts}).scalar()
+    if existente and f"prefix='{prefixos}'" not in existente:
+        conn.execute(text(f"DROP TABLE {fts}"))
+        logger.info(f"Índice {fts} recriado com prefixos {prefixos}")
+
+    conn.execute(text(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts}
+    USING fts5({lista}, content='{origem}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='{prefixos}');
+    """))
+
+    conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_ai;"))
+    conn.execute(text(f"""
+    CREATE TRIGGER {fts}_ai AFTER INSERT ON {origem} BEGIN
+        INSERT INTO {fts}(rowid, {lista}) VALUES (new.id, {novos});
+    END;
+    """))
+
+    conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_ad;"))
+    conn.execute(text(f"""
+    CREATE TRIGGER {fts}_ad AFTER DELETE ON {origem} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', old.id, {antigos});
+    END;
+    """))
+
+    # Só reindexa quando alguma coluna buscável mudou (status/valores não mexem no índice)
+    conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_au;"))
+    conn.execute(text(f"""
+    CREATE TRIGGER {fts}_au AFTER UPDATE OF {lista} ON {origem} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', old.id, {antigos});
+        INSERT INTO {fts}(rowid, {lista}) VALUES (new.id, {novos});
+    END;
+    """))
+
+    # Índice recém-criado ou fora de sincronia (linhas gravadas antes dos triggers): reconstrói.
+    # A contagem vem de _docsize porque SELECT na tabela FTS de conteúdo externo lê a tabela de origem.
+    indexados = conn.execute(text(f"SELECT count(*) FROM {fts}_docsize")).scalar()
+    total = conn.execute(text(f"SELECT count(*) FROM {origem}")).scalar()
+    if indexados != total:
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        logger.info(f"Índice {fts} reconstruído ({total} registros)")
+
+
+def garantir_fts():
+    """Cria/sincroniza as tabelas FTS5 e os triggers. Retorna False se o banco não suporta FTS5."""
+    global _disponivel
+    with db.engine.begin() as conn:
+        if not _fts5_suportado(conn):
+            _disponivel = False
+            return False
+        for entidade in ENTIDADES:
+            _criar_indice(conn, entidade)
+    _disponivel = True
+    return True
+
+
+def fts_disponivel():
+    return _disponivel
+
+
+# ----------------- Chaves normalizadas (prefixo) -----------------
+
+def chave_normalizada(coluna):
+    """Expressão SQL da chave: lower() sem separadores.
+
+    Os literais vão inline (não como parâmetros) para que a expressão da
+    consulta seja idêntica à do índice e o planner consiga usá-lo.
+    """
+    expressao = coluna
+    for separador in SEPARADORES:
+        expressao = func.replace(expressao, literal_column(f"'{separador}'"), literal_column("''"))
+    return func.lower(expressao)
+
+
+def normalizar_chave(valor):
+    """Mesma normalização de ``chave_normalizada`` feita em Python sobre o texto digitado."""
+    valor = valor or ''
+    for separador in SEPARADORES:
+        valor = valor.replace(separador, '')
+    return valor.lower()
+
+
+def _indice_nome(modelo, coluna):
+    return f'ix_{modelo.__tablename__}_{coluna}_chave'
+
+
+def _criar_indices_prefixo():
+    indices = []
+    for entidade, colunas in CHAVES_PREFIXO.items():
+        modelo = ENTIDADES[entidade][0]
+        for coluna in colunas:
+            indice = db.Index(_indice_nome(modelo, coluna), chave_normalizada(getattr(modelo, coluna)))
+            # Índice só de expressão não descobre a tabela sozinho
+            modelo.__table__.append_constraint(indice)
+            indices.append(indice)
+    return indices
+
+
+INDICES_PREFIXO = _criar_indices_prefixo()
+
+
+def garantir_indices_prefixo():
+    """Cria os índices de expressão que faltarem (bancos já existentes; create_all cobre os novos)."""
+    criar_indices(INDICES_PREFIXO)
+
+
+def _faixa(coluna, prefixo):
+    """chave >= prefixo AND chave < prefixo com o último caractere incrementado."""
+    expressao = chave_normalizada(coluna)
+    limite_superior = prefixo[:-1] + chr(ord(prefixo[-1]) + 1)
+    return expressao, and_(expressao >= prefixo, expressao < limite_superior)
+
+
+def filtro_prefixo(modelo, termo):
+    """Condição OR das faixas de prefixo nas colunas de identificadores do modelo (None se não houver)."""
+    entidade = next(e for e, cfg in ENTIDADES.items() if cfg[0] is modelo)
+    prefixo = normalizar_chave(termo)
+    if not prefixo:
+        return None
+    return or_(*[_faixa(getattr(modelo, c), prefixo)[1] for c in CHAVES_PREFIXO[entidade]])
+
+
+def buscar_prefixo(entidade, termo, limite=LIMITE_PADRAO):
+    """[(id, chave)] cujo identificador começa com o termo; chave exata e mais curtas primeiro."""
+    modelo = ENTIDADES[entidade][0]
+    prefixo = normalizar_chave(termo)
+    if len(prefixo) < TAMANHO_MINIMO:
+        return []
+
+    melhores = {}
+    for coluna in CHAVES_PREFIXO[entidade]:
+        expressao, condicao = _faixa(getattr(modelo, coluna), prefixo)
+        # Uma faixa por coluna, cada uma com LIMIT na ordem do índice: nunca lê mais que ``limite`` linhas
+        for registro_id, chave in db.session.execute(
+                select(modelo.id, expressao).where(condicao).order_by(expressao).limit(limite)):
+            if registro_id not in melhores or len(chave) < len(melhores[registro_id]):
+                melhores[registro_id] = chave
+    ordenados = sorted(melhores.items(), key=lambda item: (len(item[1]), item[1], -item[0]))
+    return ordenados[:limite]
+
+
+# ----------------- Consulta -----------------
+
+def normalizar(valor):
+    """Minúsculas e sem acentos, como o tokenizador unicode61 com remove_diacritics."""
+    decomposto = unicodedata.normalize('NFKD', (valor or '').lower())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def _tokens(valor):
+    return _RE_TOKEN.findall(normalizar(valor))
+
+
+def consulta_fts(termo, prefixo_maximo=None):
+    """Converte o texto digitado numa expressão MATCH: 'nota 2024/01' -> '"nota" "2024" "01"*'.
+
+    Só a última palavra vira prefixo (é a que o usuário ainda está digitando);
+    se o texto termina em espaço, todas são palavras completas. Cada palavra vai
+    entre aspas, então operadores e aspas do usuário não quebram a sintaxe do
+    FTS5. Com ``prefixo_maximo`` o prefixo é cortado nesse tamanho (para usar o
+    índice; quem chama confere o resto). Retorna '' se não sobrar nenhuma palavra.
+    """
+    tokens = _tokens(termo)
+    if not tokens:
+        return ''
+    if (termo or '').endswith(' '):
+        return ' '.join(f'"{t}"' for t in tokens)
+    if prefixo_maximo:
+        tokens[-1] = tokens[-1][:prefixo_maximo]
+    return ' '.join(f'"{t}"' for t in tokens) + '*'
+
+
+def _filtro_ilike(modelo, colunas, termo):
+    return or_(*[getattr(modelo, c).ilike(f'%{termo}%') for c in colunas])
+
+
+def filtro_busca(modelo, termo):
+    """Condição para ``query.filter()`` equivalente ao antigo OR de ILIKEs.
+
+    Usa o índice FTS e as faixas de prefixo dos identificadores quando houver.
+    """
+    entidade = next(e for e, cfg in ENTIDADES.items() if cfg[0] is modelo)
+    _, fts, colunas, _ = ENTIDADES[entidade]
+    expressao = consulta_fts(termo)
+    if not _disponivel or not expressao:
+        return _filtro_ilike(modelo, colunas, termo)
+    ids = (select(literal_column('rowid'))
+           .select_from(table(fts))
+           .where(text(f"{fts} MATCH :expr_{fts}").bindparams(**{f'expr_{fts}': expressao})))
+    prefixo = filtro_prefixo(modelo, termo)
+    if prefixo is None:
+        return modelo.id.in_(ids)
+    return or_(prefixo, modelo.id.in_(ids))
+
+
+def _pontuar(consulta, valores, pesos):
+    """Relevância de um registro: soma, por palavra buscada, do peso das colunas onde ela aparece.
+
+    Palavra inteira vale o dobro de prefixo. Usado no lugar de bm25(), que
+    precisa percorrer a doclist inteira de cada termo para calcular o IDF
+    (40-80 ms em termos comuns com 1M de linhas).
+    """
+    score = 0.0
+    colunas = [_tokens(v) for v in valores]
+    for termo in consulta:
+        for tokens, peso in zip(colunas, pesos):
+            if termo in tokens:
+                score += 2 * peso
+            elif any(t.startswith(termo) for t in tokens):
+                score += peso
+    return score
+
+
+def _candidatos_fts(fts, expressao):
+    """Ids mais recentes que casam: o FTS percorre a doclist de trás para frente e para no LIMIT."""
+    return db.session.execute(text(f"""
+        SELECT rowid FROM {fts} WHERE {fts} MATCH :expr ORDER BY rowid DESC LIMIT :candidatos
+    """), {'expr': expressao, 'candidatos': MAX_CANDIDATOS}).scalars().all()
+
+
+def buscar_ids(entidade, termo, limite=LIMITE_PADRAO):
+    """[(id, score)] ordenados por relevância (maior é melhor; empate -> mais recente)."""
+    modelo, fts, colunas, pesos = ENTIDADES[entidade]
+    expressao = consulta_fts(termo)
+    if not expressao:
+        return []
+
+    # Identificadores digitados desde o início (caminho de latência limitada) vêm primeiro
+    por_prefixo = [(i, SCORE_PREFIXO - len(chave)) for i, chave in buscar_prefixo(entidade, termo, limite)]
+    if len(por_prefixo) >= limite:
+        return por_prefixo
+
+    consulta = _tokens(termo)
+    campos = [getattr(modelo, c) for c in colunas]
+
+    def carregar(condicao):
+        return db.session.execute(
+            select(modelo.id, *campos).where(condicao).order_by(modelo.id.desc()).limit(2 * MAX_CANDIDATOS)
+        ).all()
+
+    if _disponivel:
+        # Palavra completa primeiro: garante que "2025NE00012" ache o próprio empenho mesmo com
+        # milhares de "2025NE00012xx" mais recentes; o prefixo (pelo índice) completa se faltar.
+        candidatos = _candidatos_fts(fts, expressao.rstrip('*'))
+        cortado = expressao.endswith('*') and len(consulta[-1]) > PREFIXO_MAXIMO
+        if expressao.endswith('*') and len(candidatos) < limite:
+            vistos = set(candidatos)
+            candidatos += [i for i in _candidatos_fts(fts, consulta_fts(termo, PREFIXO_MAXIMO)) if i not in vistos]
+        linhas = carregar(modelo.id.in_(candidatos))
+        if cortado:
+            # Prefixo maior que o índice: confere a palavra inteira digitada; se sobrar pouco,
+            # a consulta exata (sem índice, mais lenta) garante o resultado
+            linhas = [l for l in linhas if any(t.startswith(consulta[-1]) for v in l[1:] for t in _tokens(v))]
+            if len(linhas) < limite:
+                linhas = carregar(modelo.id.in_(_candidatos_fts(fts, expressao)))
+    else:
+        linhas = carregar(_filtro_ilike(modelo, colunas, termo))
+
+    ranking = [(linha[0], _pontuar(consulta, linha[1:], pesos)) for linha in linhas]
+    ranking.sort(key=lambda r: (-r[1], -r[0]))
+    vistos = {i for i, _ in por_prefixo}
+    return (por_prefixo + [r for r in ranking if r[0] not in vistos])[:limite]
+
+
+def _carregar(modelo, ranking):
+    if not ranking:
+        return []
+    por_id = {o.id: o for o in modelo.query.filter(modelo.id.in_([i for i, _ in ranking]))}
+    return [(por_id[i], score) for i, score in ranking if i in por_id]
+
+
+def buscar(entidade, termo, limite=LIMITE_PADRAO):
+    """Objetos do modelo na ordem de relevância."""
+    modelo = ENTIDADES[entidade][0]
+    return [obj for obj, _ in _carregar(modelo, buscar_ids(entidade, termo, limite))]
+
+
+def _resumo(entidade, obj):
+    def curto(valor, n=100):
+        valor = valor or ''
+        return valor[:n] + '...' if len(valor) > n else valor
+
+    if entidade == 'contratos':
+        return {'titulo': obj.numero_contrato, 'descricao': curto(obj.objeto),
+                'fornecedor': obj.fornecedor, 'valor': float(obj.valor_total or 0)}
+    if entidade == 'empenhos':
+        return {'titulo': obj.numero_empenho, 'descricao': curto(obj.resumo_objeto),
+                'fornecedor': obj.fornecedores, 'valor': float(obj.valor_empenhado or 0)}
+    return {'titulo': obj.numero_nota, 'descricao': obj.chave_acesso or '',
+            'fornecedor': obj.fornecedor_nome, 'valor': float(obj.valor_liquido or 0)}
+
+
+def buscar_geral(termo, entidades=None, limite=LIMITE_PADRAO):
+    """Busca unificada: resultados de todas as entidades intercalados pela relevância."""
+    resultados = []
+    for entidade in entidades or ENTIDADES:
+        if entidade not in ENTIDADES:
+            continue
+        modelo = ENTIDADES[entidade][0]
+        for obj, score in _carregar(modelo, buscar_ids(entidade, termo, limite)):
+            resultados.append({'tipo': entidade, 'id': obj.id, 'score': score, **_resumo(entidade, obj)})
+    resultados.sort(key=lambda r: -r['score'])
+    return resultados[:limite]
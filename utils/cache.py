@@ -0,0 +1,393 @@
+"""
+Cache com backend plugável para os relatórios.
+
+Recursos: TTL, despejo LRU por tamanho máximo, contadores de hit/miss e
+invalidação por tags. Backends:
+
+- ``memory``: dicionário LRU no próprio processo (padrão);
+- ``sqlite``: arquivo SQLite compartilhado entre workers da mesma máquina
+  (também usado como substituto local do Redis em testes);
+- ``redis``: compartilhado entre máquinas (requer o pacote ``redis``).
+
+Configuração (app.config ou variável de ambiente):
+``CACHE_BACKEND`` = memory | sqlite | redis, ``CACHE_URL`` (caminho do
+arquivo SQLite ou URL do Redis), ``CACHE_MAX_ITEMS`` e ``CACHE_DEFAULT_TTL``.
+"""
+
+import functools
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300  # 5 min
+DEFAULT_MAX_ITEMS = 1000
+
+# Tag usada pelos dados de empenhos/contratos/notas (invalidada a cada commit)
+TAG_DADOS = 'dados'
+
+
+class MemoryBackend:
+    """LRU em memória, thread-safe, local ao processo."""
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS):
+        self.max_items = max_items
+        self._itens = OrderedDict()  # key -> (expira_em, valor, tags)
+        self._tags = {}              # tag -> set(keys)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._itens.get(key)
+            if item is None:
+                return False, None
+            expira_em, valor, _ = item
+            if expira_em < time.time():
+                self._remover(key)
+                return False, None
+            self._itens.move_to_end(key)
+            return True, valor
+
+    def set(self, key, valor, ttl, tags=()):
+        with self._lock:
+            if key in self._itens:
+                self._remover(key)
+            self._itens[key] = (time.time() + ttl, valor, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._itens) > self.max_items:
+                self._remover(next(iter(self._itens)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remover(key)
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            for key in list(self._tags.pop(tag, ())):
+                self._remover(key)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            self._tags.clear()
+
+    def cleanup(self):
+        agora = time.time()
+        with self._lock:
+            for key in [k for k, (exp, _, _) in self._itens.items() if exp < agora]:
+                self._remover(key)
+
+    def size(self):
+        return len(self._itens)
+
+    def _remover(self, key):
+        item = self._itens.pop(key, None)
+        if item is None:
+            return
+        for tag in item[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteBackend:
+    """Cache em arquivo SQLite, compartilhado entre processos da mesma máquina."""
+
+    def __init__(self, path, max_items=DEFAULT_MAX_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache_itens (
+                                chave TEXT PRIMARY KEY,
+                                valor BLOB NOT NULL,
+                                expira_em REAL NOT NULL,
+                                acesso REAL NOT NULL)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache_tags (
+                                tag TEXT NOT NULL,
+                                chave TEXT NOT NULL,
+                                PRIMARY KEY (tag, chave))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_tags_chave ON cache_tags (chave)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_itens_acesso ON cache_itens (acesso)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return _Transacao(conn)
+
+    def get(self, key):
+        agora = time.time()
+        with self._conn() as conn:
+            row = conn.execute("SELECT valor, expira_em FROM cache_itens WHERE chave = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] < agora:
+                self._remover(conn, key)
+                return False, None
+            conn.execute("UPDATE cache_itens SET acesso = ? WHERE chave = ?", (agora, key))
+        return True, pickle.loads(row[0])
+
+    def set(self, key, valor, ttl, tags=()):
+        agora = time.time()
+        dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._conn() as conn:
+            self._remover(conn, key)
+            conn.execute("INSERT INTO cache_itens (chave, valor, expira_em, acesso) VALUES (?, ?, ?, ?)",
+                         (key, dados, agora + ttl, agora))
+            conn.executemany("INSERT OR IGNORE INTO cache_tags (tag, chave) VALUES (?, ?)",
+                             [(tag, key) for tag in tags])
+            excesso = conn.execute("SELECT COUNT(*) FROM cache_itens").fetchone()[0] - self.max_items
+            if excesso > 0:
+                antigos = conn.execute("SELECT chave FROM cache_itens ORDER BY acesso LIMIT ?",
+                                       (excesso,)).fetchall()
+                for (chave,) in antigos:
+                    self._remover(conn, chave)
+
+    def delete(self, key):
+        with self._conn() as conn:
+            self._remover(conn, key)
+
+    def invalidate_tag(self, tag):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache_itens WHERE chave IN (SELECT chave FROM cache_tags WHERE tag = ?)", (tag,))
+            conn.execute("DELETE FROM cache_tags WHERE chave NOT IN (SELECT chave FROM cache_itens)")
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache_itens")
+            conn.execute("DELETE FROM cache_tags")
+
+    def cleanup(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache_itens WHERE expira_em < ?", (time.time(),))
+            conn.execute("DELETE FROM cache_tags WHERE chave NOT IN (SELECT chave FROM cache_itens)")
+
+    def size(self):
+        with self._conn() as conn:
+            return conn.execute("SELECT COUNT(*) FROM cache_itens").fetchone()[0]
+
+    @staticmethod
+    def _remover(conn, key):
+        conn.execute("DELETE FROM cache_itens WHERE chave = ?", (key,))
+        conn.execute("DELETE FROM cache_tags WHERE chave = ?", (key,))
+
+
+class _Transacao:
+    """BEGIN IMMEDIATE / COMMIT em volta de uma conexão sqlite3 em autocommit."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class RedisBackend:
+    """Cache compartilhado via Redis (TTL nativo, LRU pela política maxmemory do servidor)."""
+
+    def __init__(self, url, prefixo='empenhos:cache:'):
+        if not REDIS_AVAILABLE:
+            raise ImportError("Redis não está instalado. Execute: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefixo = prefixo
+
+    def _k(self, key):
+        return f"{self.prefixo}{key}"
+
+    def _t(self, tag):
+        return f"{self.prefixo}tag:{tag}"
+
+    def get(self, key):
+        dados = self.client.get(self._k(key))
+        if dados is None:
+            return False, None
+        return True, pickle.loads(dados)
+
+    def set(self, key, valor, ttl, tags=()):
+        pipe = self.client.pipeline()
+        pipe.set(self._k(key), pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL), ex=int(ttl))
+        for tag in tags:
+            pipe.sadd(self._t(tag), key)
+        pipe.execute()
+
+    def delete(self, key):
+        self.client.delete(self._k(key))
+
+    def invalidate_tag(self, tag):
+        keys = self.client.smembers(self._t(tag))
+        if keys:
+            self.client.delete(*[self._k(k.decode('utf-8')) for k in keys])
+        self.client.delete(self._t(tag))
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefixo}*"):
+            self.client.delete(key)
+
+    def cleanup(self):
+        pass  # expiração feita pelo próprio Redis
+
+    def size(self):
+        return sum(1 for k in self.client.scan_iter(f"{self.prefixo}*") if b':tag:' not in k)
+
+
+class Cache:
+    """Fachada com estatísticas; o backend é escolhido em ``init_cache``."""
+
+    def __init__(self, backend=None, default_ttl=DEFAULT_TTL):
+        self.backend = backend or MemoryBackend()
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            encontrado, valor = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Erro ao ler cache ({key}): {e}")
+            encontrado, valor = False, None
+        if encontrado:
+            self.hits += 1
+            return valor
+        self.misses += 1
+        return default
+
+    def set(self, key, valor, ttl=None, tags=()):
+        try:
+            self.backend.set(key, valor, ttl or self.default_ttl, tuple(tags))
+        except Exception as e:
+            logger.error(f"Erro ao gravar cache ({key}): {e}")
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def invalidate_tag(self, *tags):
+        for tag in tags:
+            try:
+                self.backend.invalidate_tag(tag)
+            except Exception as e:
+                logger.error(f"Erro ao invalidar tag de cache {tag}: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def cleanup(self):
+        self.backend.cleanup()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'itens': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0.0,
+        }
+
+
+cache = Cache()
+
+
+def criar_backend(tipo, url=None, max_items=DEFAULT_MAX_ITEMS):
+    """Instancia o backend pelo nome configurado."""
+    tipo = (tipo or 'memory').lower()
+    if tipo == 'sqlite':
+        return SQLiteBackend(url or os.path.join('instance', 'cache.db'), max_items=max_items)
+    if tipo == 'redis':
+        return RedisBackend(url or 'redis://localhost:6379/0')
+    return MemoryBackend(max_items=max_items)
+
+
+def init_cache(app):
+    """Configura o cache global a partir de app.config / variáveis de ambiente."""
+    def conf(nome, padrao=None):
+        return app.config.get(nome) or os.environ.get(nome) or padrao
+
+    tipo = conf('CACHE_BACKEND', 'memory')
+    url = conf('CACHE_URL')
+    max_items = int(conf('CACHE_MAX_ITEMS', DEFAULT_MAX_ITEMS))
+    if tipo == 'sqlite' and not url:
+        os.makedirs(app.instance_path, exist_ok=True)
+        url = os.path.join(app.instance_path, 'cache.db')
+    try:
+        cache.backend = criar_backend(tipo, url, max_items)
+    except Exception as e:
+        logger.error(f"Backend de cache '{tipo}' indisponível, usando memória: {e}")
+        cache.backend = MemoryBackend(max_items=max_items)
+    cache.default_ttl = int(conf('CACHE_DEFAULT_TTL', DEFAULT_TTL))
+    return cache
+
+
+def cached(ttl=None, tags=(TAG_DADOS,), key_prefix=None):
+    """
+    Decorator para helpers de relatório: guarda o retorno por (função, argumentos).
+    Resultados vazios/None não são guardados (em geral são fallbacks de erro).
+    """
+    def decorator(func):
+        prefixo = key_prefix or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = f"{prefixo}:{args!r}:{sorted(kwargs.items())!r}"
+            valor = cache.get(key, _AUSENTE)
+            if valor is not _AUSENTE:
+                return valor
+            valor = func(*args, **kwargs)
+            if valor:
+                cache.set(key, valor, ttl, tags)
+            return valor
+        wrapper.cache_key_prefix = prefixo
+        return wrapper
+    return decorator
+
+
+class _Ausente:
+    pass
+
+
+_AUSENTE = _Ausente()
+
+
+def registrar_invalidacao(models, tag=TAG_DADOS):
+    """Invalida ``tag`` após cada commit que inseriu/alterou/removeu algum dos modelos."""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    def _marcar(session, flush_context, instances=None):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, tuple(models)):
+                session.info['cache_invalidar'] = True
+                return
+
+    def _apos_commit(session):
+        if session.info.pop('cache_invalidar', False):
+            cache.invalidate_tag(tag)
+
+    def _apos_rollback(session):
+        session.info.pop('cache_invalidar', None)
+
+    event.listen(Session, 'before_flush', _marcar)
+    event.listen(Session, 'after_commit', _apos_commit)
+    event.listen(Session, 'after_soft_rollback', lambda session, previous: _apos_rollback(session))
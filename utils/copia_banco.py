@@ -0,0 +1,338 @@
+"""
+Cópia em massa de dados entre bancos (SQLite -> MySQL/PostgreSQL, ou
+SQLite -> SQLite para testar a migração localmente).
+
+Cada tabela é lida em blocos pela chave (``WHERE chave > :ultima ORDER BY
+chave``, cursor com ``stream_results``) e gravada com ``executemany`` (o
+driver agrupa em INSERTs de várias linhas). Junto com cada bloco, na mesma
+transação, o progresso vai para a tabela ``migracao_dados_estado`` no
+destino: se a cópia for interrompida, a próxima execução continua da última
+chave gravada, sem duplicar nem perder linhas. Tabelas sem chave inteira (e
+fora do SQLite, que tem ``rowid``) são copiadas numa transação só.
+
+Tabelas sem dependência entre si (chaves estrangeiras) são copiadas em
+paralelo por processos separados, nível a nível. A verificação compara,
+por tabela, a contagem de linhas e um checksum independente da ordem (soma
+dos hashes das linhas normalizadas), lido dos dois bancos.
+
+As funções recebem URLs (não engines) para poderem rodar em outro processo.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import warnings
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import (BigInteger, Boolean, Column, DateTime, MetaData, String, Table, Text,
+                        create_engine, delete, event, func, inspect, literal_column, select, text)
+from sqlalchemy.types import NullType
+
+from utils.banco import eh_sqlite, registrar_pragmas
+
+logger = logging.getLogger(__name__)
+
+LOTE_PADRAO = 5000
+TABELA_ESTADO = 'migracao_dados_estado'
+MODULO_CHECKSUM = 2 ** 64
+
+_metadata_estado = MetaData()
+estado = Table(
+    TABELA_ESTADO, _metadata_estado,
+    Column('tabela', String(128), primary_key=True),
+    Column('ultima_chave', BigInteger),
+    Column('linhas', BigInteger, nullable=False, default=0),
+    Column('concluida', Boolean, nullable=False, default=False),
+    Column('atualizado_em', DateTime),
+)
+
+
+class DestinoNaoVazio(Exception):
+    """A tabela de destino já tem linhas que não vieram desta migração."""
+
+
+def criar_engine(url):
+    """Engine para a cópia: sem pool compartilhado entre processos, FKs do MySQL desligadas na sessão."""
+    if eh_sqlite(url):
+        engine = create_engine(url, connect_args={'timeout': 60})
+        registrar_pragmas(engine, {'busy_timeout': 60000})
+        return engine
+    engine = create_engine(url, pool_pre_ping=True)
+    if engine.dialect.name == 'mysql':
+        @event.listens_for(engine, 'connect')
+        def _sem_fk(dbapi_conn, connection_record):
+            # Tabelas com dependência circular não têm ordem de carga válida
+            cursor = dbapi_conn.cursor()
+            cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+            cursor.close()
+    return engine
+
+
+def backup_sqlite(caminho, pasta):
+    """Cópia consistente do arquivo SQLite (API de backup, funciona com o banco em uso)."""
+    os.makedirs(pasta, exist_ok=True)
+    destino = os.path.join(pasta, os.path.basename(caminho))
+    origem = sqlite3.connect(caminho)
+    copia = sqlite3.connect(destino)
+    try:
+        origem.backup(copia)
+    finally:
+        copia.close()
+        origem.close()
+    return destino
+
+
+def tabelas_copiaveis(engine):
+    """Tabelas de dados da origem (sem as internas do SQLite, FTS e o controle da migração)."""
+    nomes = set(inspect(engine).get_table_names()) - {TABELA_ESTADO}
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            virtuais = [n for (n,) in conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'"))]
+        # Tabelas virtuais (FTS5) e as tabelas-sombra delas são reconstruídas pelo app
+        nomes = {n for n in nomes if not n.startswith('sqlite_')
+                 and not any(n == v or n.startswith(v + '_') for v in virtuais)}
+    return sorted(nomes)
+
+
+def criar_esquema(origem, destino, nomes):
+    """Cria no destino as tabelas que faltam, com a definição refletida da origem. Retorna as criadas."""
+    existentes = set(inspect(destino).get_table_names())
+    faltando = [n for n in nomes if n not in existentes]
+    _metadata_estado.create_all(destino)
+    if not faltando:
+        return []
+    refletido = MetaData()
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', 'Skipped unsupported reflection')
+        refletido.reflect(origem, only=faltando)
+    for tabela in refletido.tables.values():
+        for coluna in tabela.columns:
+            # SQLite aceita coluna sem tipo e VARCHAR sem tamanho; MySQL/PostgreSQL não
+            if isinstance(coluna.type, NullType) or (
+                    isinstance(coluna.type, String) and not coluna.type.length and destino.dialect.name == 'mysql'):
+                coluna.type = Text()
+    indices = []
+    for tabela in refletido.tables.values():
+        indices.extend(tabela.indexes)
+        tabela.indexes.clear()
+    refletido.create_all(destino, tables=[refletido.tables[n] for n in faltando if n in refletido.tables])
+    for indice in indices:
+        if indice.table.name not in faltando:
+            continue
+        try:
+            indice.create(destino)
+        except Exception as e:
+            logger.warning(f"Índice {indice.name} não criado no destino: {e}")
+    return faltando
+
+
+def niveis_dependencia(engine, nomes):
+    """Tabelas agrupadas em níveis: cada nível só referencia (por FK) tabelas de níveis anteriores."""
+    inspetor = inspect(engine)
+    restantes = set(nomes)
+    depende = {
+        n: {fk['referred_table'] for fk in inspetor.get_foreign_keys(n)} & restantes - {n}
+        for n in nomes
+    }
+    niveis = []
+    while restantes:
+        nivel = sorted(n for n in restantes if not depende[n] & restantes)
+        if not nivel:
+            # Dependência circular: o que sobrou vai junto no último nível
+            nivel = sorted(restantes)
+        niveis.append(nivel)
+        restantes -= set(nivel)
+    return niveis
+
+
+def _numero(valor):
+    return f'{valor:.6f}'
+
+
+def _data_hora(valor):
+    # DATETIME do MySQL sem fração arredonda para o segundo
+    return (valor + timedelta(microseconds=500000)).replace(microsecond=0, tzinfo=None).isoformat(' ')
+
+
+# Representação estável entre bancos (tipos do driver, precisão de data/hora e de decimais)
+_NORMALIZADORES = {
+    str: str,
+    type(None): lambda valor: '\x00',
+    bool: lambda valor: _numero(int(valor)),  # MySQL devolve TINYINT (int), PostgreSQL bool
+    int: _numero,
+    float: _numero,
+    Decimal: _numero,
+    datetime: _data_hora,
+    date: date.isoformat,
+    time: time.isoformat,
+    bytes: bytes.hex,
+    bytearray: bytearray.hex,
+    memoryview: memoryview.hex,
+}
+
+
+def hash_linha(valores):
+    dados = '\x1f'.join([_NORMALIZADORES.get(type(v), str)(v) for v in valores]).encode('utf-8', 'surrogatepass')
+    return int.from_bytes(hashlib.blake2b(dados, digest_size=8).digest(), 'big')
+
+
+def _chave(tabela, dialeto):
+    """Coluna de ordenação/retomada: PK inteira simples, ``rowid`` no SQLite, ou None."""
+    pk = list(tabela.primary_key.columns)
+    if len(pk) == 1:
+        try:
+            if pk[0].type.python_type is int:
+                return pk[0]
+        except NotImplementedError:
+            pass
+    if dialeto == 'sqlite':
+        return literal_column('rowid')
+    return None
+
+
+def _tabelas(origem, destino, nome):
+    with warnings.catch_warnings():
+        # Índices por expressão (ex.: prefixo de documento) não são refletidos; não afetam a cópia
+        warnings.filterwarnings('ignore', 'Skipped unsupported reflection')
+        t_origem = Table(nome, MetaData(), autoload_with=origem)
+        t_destino = Table(nome, MetaData(), autoload_with=destino)
+    colunas = sorted(c.name for c in t_origem.columns if c.name in t_destino.c)
+    return t_origem, t_destino, colunas
+
+
+def _ajustar_sequencia(conn, tabela):
+    """PostgreSQL: a sequência do id continua depois dos ids copiados."""
+    pk = list(tabela.primary_key.columns)
+    if conn.dialect.name != 'postgresql' or len(pk) != 1:
+        return
+    conn.execute(text(
+        f'SELECT setval(pg_get_serial_sequence(:tabela, :coluna), COALESCE(MAX("{pk[0].name}"), 0) + 1, false) '
+        f'FROM "{tabela.name}"'), {'tabela': tabela.name, 'coluna': pk[0].name})
+
+
+def copiar_tabela(origem_url, destino_url, nome, lote=LOTE_PADRAO):
+    """Copia (ou continua copiando) uma tabela. Retorna o resumo; erros vêm em ``resumo['erro']``."""
+    resumo = {'tabela': nome, 'linhas': 0, 'copiadas': 0, 'retomada': False, 'erro': None}
+    origem, destino = criar_engine(origem_url), criar_engine(destino_url)
+    try:
+        t_origem, t_destino, colunas = _tabelas(origem, destino, nome)
+        chave = _chave(t_origem, origem.dialect.name)
+        with destino.begin() as conn:
+            atual = conn.execute(select(estado).where(estado.c.tabela == nome)).first()
+            if atual is None or (chave is None and not atual.concluida):
+                if atual is None and conn.execute(select(func.count()).select_from(t_destino)).scalar():
+                    raise DestinoNaoVazio(f"Tabela {nome} já tem dados no destino (use --reiniciar)")
+                conn.execute(delete(estado).where(estado.c.tabela == nome))
+                conn.execute(estado.insert().values(tabela=nome, linhas=0, concluida=False))
+                atual = conn.execute(select(estado).where(estado.c.tabela == nome)).first()
+        if atual.concluida:
+            resumo.update(linhas=atual.linhas, retomada=True)
+            return resumo
+        resumo['retomada'] = atual.linhas > 0
+        linhas, ultima = atual.linhas, atual.ultima_chave
+
+        consulta = select(*[t_origem.c[n] for n in colunas],
+                          *([chave.label('_chave_copia')] if chave is not None else []))
+        if chave is not None:
+            consulta = consulta.order_by(chave)
+            if ultima is not None:
+                consulta = consulta.where(chave > ultima)
+
+        with origem.connect() as c_origem:
+            blocos = c_origem.execution_options(stream_results=True, yield_per=lote).execute(consulta).partitions(lote)
+            if chave is None:
+                # Sem chave para retomar: a tabela inteira numa transação
+                with destino.begin() as conn:
+                    conn.execute(delete(t_destino))
+                    for bloco in blocos:
+                        conn.execute(t_destino.insert(), [dict(zip(colunas, r)) for r in bloco])
+                        linhas += len(bloco)
+                    _gravar_estado(conn, nome, None, linhas)
+            else:
+                for bloco in blocos:
+                    linhas += len(bloco)
+                    ultima = bloco[-1][-1]
+                    with destino.begin() as conn:
+                        conn.execute(t_destino.insert(), [dict(zip(colunas, r[:-1])) for r in bloco])
+                        _gravar_estado(conn, nome, ultima, linhas)
+        with destino.begin() as conn:
+            _ajustar_sequencia(conn, t_destino)
+            conn.execute(estado.update().where(estado.c.tabela == nome).values(concluida=True))
+        resumo.update(linhas=linhas, copiadas=linhas - atual.linhas)
+    except Exception as e:
+        logger.info(f"Erro copiando {nome}: {e}")
+        resumo['erro'] = str(e)
+    finally:
+        origem.dispose()
+        destino.dispose()
+    return resumo
+
+
+def _gravar_estado(conn, nome, ultima, linhas):
+    conn.execute(estado.update().where(estado.c.tabela == nome).values(
+        ultima_chave=ultima, linhas=linhas, atualizado_em=datetime.now()))
+
+
+def checksum_tabela(engine, tabela, colunas, lote=LOTE_PADRAO):
+    """(linhas, checksum) das ``colunas`` da tabela, lidas em blocos."""
+    linhas, soma = 0, 0
+    with engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=lote).execute(
+            select(*[tabela.c[n] for n in colunas]))
+        for bloco in resultado.partitions(lote):
+            linhas += len(bloco)
+            soma = (soma + sum(hash_linha(r) for r in bloco)) % MODULO_CHECKSUM
+    return linhas, f'{soma:016x}'
+
+
+def verificar_tabela(origem_url, destino_url, nome, lote=LOTE_PADRAO):
+    """Compara contagem e checksum da tabela nos dois bancos."""
+    resumo = {'tabela': nome, 'ok': False, 'erro': None}
+    origem, destino = criar_engine(origem_url), criar_engine(destino_url)
+    try:
+        t_origem, t_destino, colunas = _tabelas(origem, destino, nome)
+        resumo['origem'] = checksum_tabela(origem, t_origem, colunas, lote)
+        resumo['destino'] = checksum_tabela(destino, t_destino, colunas, lote)
+        resumo['ok'] = resumo['origem'] == resumo['destino']
+    except Exception as e:
+        resumo['erro'] = str(e)
+    finally:
+        origem.dispose()
+        destino.dispose()
+    return resumo
+
+
+def reiniciar(destino_url, nomes):
+    """Apaga os dados já copiados das tabelas (em ordem reversa de dependência) e o progresso."""
+    destino = criar_engine(destino_url)
+    try:
+        existentes = set(inspect(destino).get_table_names())
+        nomes = [n for n in nomes if n in existentes]
+        with destino.begin() as conn:
+            for nivel in reversed(niveis_dependencia(destino, nomes)):
+                for nome in nivel:
+                    conn.execute(delete(Table(nome, MetaData(), autoload_with=conn)))
+            if TABELA_ESTADO in existentes:
+                conn.execute(delete(estado).where(estado.c.tabela.in_(nomes)))
+    finally:
+        destino.dispose()
+
+
+def executar_em_paralelo(funcao, tarefas, processos):
+    """Roda ``funcao(*tarefa)`` para cada tarefa, em ``processos`` processos; gera os resultados conforme terminam."""
+    if processos <= 1 or len(tarefas) <= 1:
+        for tarefa in tarefas:
+            yield funcao(*tarefa)
+        return
+    # spawn: mesmo comportamento no Windows e no Linux (sem herdar conexões abertas)
+    with multiprocessing.get_context('spawn').Pool(min(processos, len(tarefas))) as pool:
+        yield from pool.imap_unordered(_chamar, [(funcao, t) for t in tarefas])
+
+
+def _chamar(args):
+    funcao, tarefa = args
+    return funcao(*tarefa)
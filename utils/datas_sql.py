@@ -0,0 +1,155 @@
+"""
+Funções de data portáveis entre SQLite, MySQL e PostgreSQL.
+
+``func.strftime`` só existe no SQLite e ``CAST(x AS DATE)`` no SQLite vira um
+número (o ano). Estas expressões compilam para a função certa de cada
+dialeto e sempre devolvem o mesmo tipo:
+
+- ``ano(col)`` / ``mes(col)``: inteiros;
+- ``dia_semana(col)``: inteiro, 0 = domingo ... 6 = sábado;
+- ``ano_mes(col)``: texto 'AAAA-MM';
+- ``dia(col)``: a data sem hora.
+
+Para filtrar por ano use ``periodo_anos`` (intervalo na coluna, que usa o
+índice) em vez de comparar ``ano(col)``, que obriga a varrer a tabela.
+"""
+
+from datetime import date
+
+from sqlalchemy import Date, Integer, String, and_, literal
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class _FuncaoData(FunctionElement):
+    inherit_cache = True
+
+    def __init__(self, coluna):
+        super().__init__(coluna)
+
+    @property
+    def _coluna(self):
+        return list(self.clauses)[0]
+
+
+class ano(_FuncaoData):
+    type = Integer()
+    name = 'ano'
+    inherit_cache = True
+
+
+class mes(_FuncaoData):
+    type = Integer()
+    name = 'mes'
+    inherit_cache = True
+
+
+class dia_semana(_FuncaoData):
+    type = Integer()
+    name = 'dia_semana'
+    inherit_cache = True
+
+
+class ano_mes(_FuncaoData):
+    type = String()
+    name = 'ano_mes'
+    inherit_cache = True
+
+
+class dia(_FuncaoData):
+    type = Date()
+    name = 'dia'
+    inherit_cache = True
+
+
+def _col(compiler, elemento, kw):
+    return compiler.process(elemento._coluna, **kw)
+
+
+# ---- Padrão (PostgreSQL e demais com EXTRACT/CAST do SQL padrão) ----
+
+@compiles(ano)
+def _ano(elemento, compiler, **kw):
+    return f"CAST(EXTRACT(YEAR FROM {_col(compiler, elemento, kw)}) AS INTEGER)"
+
+
+@compiles(mes)
+def _mes(elemento, compiler, **kw):
+    return f"CAST(EXTRACT(MONTH FROM {_col(compiler, elemento, kw)}) AS INTEGER)"
+
+
+@compiles(dia_semana)
+def _dia_semana(elemento, compiler, **kw):
+    return f"CAST(EXTRACT(DOW FROM {_col(compiler, elemento, kw)}) AS INTEGER)"
+
+
+@compiles(ano_mes)
+def _ano_mes(elemento, compiler, **kw):
+    return f"to_char({_col(compiler, elemento, kw)}, 'YYYY-MM')"
+
+
+@compiles(dia)
+def _dia(elemento, compiler, **kw):
+    return f"CAST({_col(compiler, elemento, kw)} AS DATE)"
+
+
+# ---- SQLite ----
+
+@compiles(ano, 'sqlite')
+def _ano_sqlite(elemento, compiler, **kw):
+    return f"CAST(strftime('%Y', {_col(compiler, elemento, kw)}) AS INTEGER)"
+
+
+@compiles(mes, 'sqlite')
+def _mes_sqlite(elemento, compiler, **kw):
+    return f"CAST(strftime('%m', {_col(compiler, elemento, kw)}) AS INTEGER)"
+
+
+@compiles(dia_semana, 'sqlite')
+def _dia_semana_sqlite(elemento, compiler, **kw):
+    return f"CAST(strftime('%w', {_col(compiler, elemento, kw)}) AS INTEGER)"
+
+
+@compiles(ano_mes, 'sqlite')
+def _ano_mes_sqlite(elemento, compiler, **kw):
+    return f"strftime('%Y-%m', {_col(compiler, elemento, kw)})"
+
+
+@compiles(dia, 'sqlite')
+def _dia_sqlite(elemento, compiler, **kw):
+    return f"date({_col(compiler, elemento, kw)})"
+
+
+# ---- MySQL / MariaDB ----
+
+@compiles(ano, 'mysql')
+def _ano_mysql(elemento, compiler, **kw):
+    return f"YEAR({_col(compiler, elemento, kw)})"
+
+
+@compiles(mes, 'mysql')
+def _mes_mysql(elemento, compiler, **kw):
+    return f"MONTH({_col(compiler, elemento, kw)})"
+
+
+@compiles(dia_semana, 'mysql')
+def _dia_semana_mysql(elemento, compiler, **kw):
+    # DAYOFWEEK: 1 = domingo
+    return f"(DAYOFWEEK({_col(compiler, elemento, kw)}) - 1)"
+
+
+@compiles(ano_mes, 'mysql')
+def _ano_mes_mysql(elemento, compiler, **kw):
+    # Formato como parâmetro: '%' literal no SQL conflita com o paramstyle do driver
+    return f"DATE_FORMAT({_col(compiler, elemento, kw)}, {compiler.process(literal('%Y-%m'), **kw)})"
+
+
+@compiles(dia, 'mysql')
+def _dia_mysql(elemento, compiler, **kw):
+    return f"DATE({_col(compiler, elemento, kw)})"
+
+
+def periodo_anos(coluna, primeiro, ultimo=None):
+    """Filtro dos anos ``primeiro``..``ultimo`` como intervalo na coluna (usa o índice da coluna)."""
+    ultimo = primeiro if ultimo is None else ultimo
+    return and_(coluna >= date(primeiro, 1, 1), coluna < date(ultimo + 1, 1, 1))
@@ -0,0 +1,356 @@
+"""
+Pub/sub de eventos para entrega em tempo real via Server-Sent Events (SSE).
+
+Cada conexão SSE aberta é uma ``Assinatura`` (fila própria) registrada na
+``CentralEventos`` do processo. O broker leva os eventos publicados até todos
+os processos que têm assinantes:
+
+- ``memory``: só o próprio processo (padrão; servidor com um único worker);
+- ``sqlite``: tabela em arquivo compartilhado lida por uma thread em cada
+  processo (vários workers na mesma máquina; também usado como substituto
+  local do Redis em testes);
+- ``redis``: PUBLISH/PSUBSCRIBE, entre máquinas (requer o pacote ``redis``).
+
+Configuração (app.config ou variável de ambiente): ``EVENTOS_BROKER`` =
+memory | sqlite | redis, ``EVENTOS_URL`` (caminho do arquivo SQLite ou URL
+do Redis) e ``EVENTOS_MAX_CONEXOES`` (streams abertos por processo; cada um
+ocupa uma thread do servidor, acima disso o cliente volta ao polling).
+
+Canais usados pelo chat: ``sala:<id>`` (mensagens de uma sala) e
+``usuario:<id>`` (mensagens das DMs do usuário).
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import Response
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+FILA_MAXIMA = 500          # eventos pendentes por conexão antes de derrubá-la
+KEEPALIVE = 15             # segundos entre comentários ": ping" (proxies fecham conexões ociosas)
+DURACAO_MAXIMA = 300       # segundos por conexão; o navegador reconecta com Last-Event-ID
+RETRY_MS = 3000            # intervalo de reconexão sugerido ao EventSource
+MAX_CONEXOES = 10          # streams abertos por processo (EVENTOS_MAX_CONEXOES)
+
+
+def canal_sala(room_id):
+    return f'sala:{room_id}'
+
+
+def canal_usuario(user_id):
+    return f'usuario:{user_id}'
+
+
+class Assinatura:
+    """Fila de eventos de uma conexão SSE para um conjunto de canais."""
+
+    def __init__(self, central, canais, max_fila=FILA_MAXIMA):
+        self.canais = tuple(canais)
+        self.atrasada = False  # cliente lento demais: a conexão é encerrada e refeita com catch-up
+        self._fila = queue.Queue(maxsize=max_fila)
+        self._central = central
+
+    def entregar(self, evento):
+        if self.atrasada:
+            return  # a conexão vai ser refeita com catch-up; nada depois do buraco
+        try:
+            self._fila.put_nowait(evento)
+        except queue.Full:
+            self.atrasada = True
+
+    def proximo(self, timeout):
+        """Próximo evento ou ``None`` se nada chegou em ``timeout`` segundos."""
+        try:
+            return self._fila.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def fechar(self):
+        self._central.cancelar(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class LimiteConexoes(Exception):
+    """O processo já tem ``max_conexoes`` streams abertos."""
+
+
+class BrokerMemoria:
+    """Entrega direto aos assinantes do próprio processo."""
+
+    def __init__(self):
+        self._despachar = lambda evento: None  # ninguém assinou ainda
+
+    def iniciar(self, despachar):
+        self._despachar = despachar
+
+    def publicar(self, evento):
+        self._despachar(evento)
+
+
+class BrokerSQLite:
+    """Eventos gravados numa tabela SQLite e lidos por uma thread de cada processo.
+
+    Os eventos ficam ``retencao`` segundos na tabela; a thread só lê os que
+    chegaram depois que ela começou.
+    """
+
+    def __init__(self, caminho, intervalo=0.5, retencao=120):
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self.retencao = retencao
+        with self._conectar() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS eventos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    criado_em REAL NOT NULL,
+                    evento TEXT NOT NULL
+                )
+            ''')
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+
+    def iniciar(self, despachar):
+        self._despachar = despachar
+        threading.Thread(target=self._ouvir, name='eventos-sqlite', daemon=True).start()
+
+    def publicar(self, evento):
+        conn = self._conectar()
+        try:
+            conn.execute('INSERT INTO eventos (criado_em, evento) VALUES (?, ?)',
+                         (time.time(), json.dumps(evento)))
+        finally:
+            conn.close()
+
+    def _ouvir(self):
+        conn = self._conectar()
+        ultimo = conn.execute('SELECT COALESCE(MAX(id), 0) FROM eventos').fetchone()[0]
+        proxima_limpeza = 0
+        while True:
+            try:
+                linhas = conn.execute('SELECT id, evento FROM eventos WHERE id > ? ORDER BY id',
+                                      (ultimo,)).fetchall()
+                for ultimo, dados in linhas:
+                    self._despachar(json.loads(dados))
+                if time.time() >= proxima_limpeza:
+                    conn.execute('DELETE FROM eventos WHERE criado_em < ?', (time.time() - self.retencao,))
+                    proxima_limpeza = time.time() + self.retencao
+            except Exception as e:
+                logger.warning(f"Broker SQLite de eventos: {e}")
+            time.sleep(self.intervalo)
+
+
+class BrokerRedis:
+    """PUBLISH/PSUBSCRIBE no Redis; cada processo tem uma thread ouvindo ``prefixo*``."""
+
+    def __init__(self, url, prefixo='empenhos:eventos:'):
+        if not REDIS_AVAILABLE:
+            raise ImportError("Redis não está instalado. Execute: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefixo = prefixo
+
+    def iniciar(self, despachar):
+        self._despachar = despachar
+        threading.Thread(target=self._ouvir, name='eventos-redis', daemon=True).start()
+
+    def publicar(self, evento):
+        self.client.publish(f"{self.prefixo}{evento['canal']}", json.dumps(evento))
+
+    def _ouvir(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f'{self.prefixo}*')
+                for mensagem in pubsub.listen():
+                    self._despachar(json.loads(mensagem['data']))
+            except Exception as e:
+                logger.warning(f"Broker Redis de eventos desconectado, tentando de novo: {e}")
+                time.sleep(1)
+
+
+class CentralEventos:
+    """Assinantes do processo por canal + broker que distribui as publicações.
+
+    O broker só é iniciado na primeira assinatura: processos que apenas
+    publicam (scripts, workers de jobs) não abrem thread de escuta.
+    """
+
+    def __init__(self, broker=None, max_conexoes=MAX_CONEXOES):
+        self.broker = broker or BrokerMemoria()
+        self.max_conexoes = max_conexoes
+        self._assinantes = {}  # canal -> set(Assinatura)
+        self._abertas = set()
+        self._lock = threading.Lock()
+        self._iniciado = False
+
+    def assinar(self, canais, max_fila=FILA_MAXIMA):
+        """Nova assinatura; ``LimiteConexoes`` se o processo já está no limite de streams."""
+        assinatura = Assinatura(self, canais, max_fila)
+        with self._lock:
+            if len(self._abertas) >= self.max_conexoes:
+                raise LimiteConexoes(f'{len(self._abertas)} streams abertos')
+            self._abertas.add(assinatura)
+            if not self._iniciado:
+                self.broker.iniciar(self._despachar)
+                self._iniciado = True
+            for canal in assinatura.canais:
+                self._assinantes.setdefault(canal, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._abertas.discard(assinatura)
+            for canal in assinatura.canais:
+                assinantes = self._assinantes.get(canal)
+                if assinantes is not None:
+                    assinantes.discard(assinatura)
+                    if not assinantes:
+                        del self._assinantes[canal]
+
+    def publicar(self, canal, tipo, dados, id=None):
+        """Publica um evento; falhas do broker são registradas e não derrubam a requisição."""
+        evento = {'canal': canal, 'tipo': tipo, 'id': id, 'dados': dados}
+        try:
+            self.broker.publicar(evento)
+        except Exception as e:
+            logger.warning(f"Evento {tipo} em {canal} não publicado: {e}")
+
+    def _despachar(self, evento):
+        with self._lock:
+            assinantes = list(self._assinantes.get(evento.get('canal'), ()))
+        for assinatura in assinantes:
+            assinatura.entregar(evento)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'broker': type(self.broker).__name__,
+                'canais': len(self._assinantes),
+                'conexoes': len(self._abertas),
+                'max_conexoes': self.max_conexoes,
+            }
+
+
+eventos = CentralEventos()
+
+
+def criar_broker(tipo, url=None):
+    """Instancia o broker pelo nome configurado."""
+    tipo = (tipo or 'memory').lower()
+    if tipo == 'sqlite':
+        return BrokerSQLite(url or os.path.join('instance', 'eventos.db'))
+    if tipo == 'redis':
+        return BrokerRedis(url or 'redis://localhost:6379/0')
+    return BrokerMemoria()
+
+
+def init_eventos(app):
+    """Configura o broker da central global a partir de app.config / variáveis de ambiente."""
+    def conf(nome, padrao=None):
+        return app.config.get(nome) or os.environ.get(nome) or padrao
+
+    try:
+        eventos.max_conexoes = max(int(conf('EVENTOS_MAX_CONEXOES', MAX_CONEXOES)), 0)
+    except (TypeError, ValueError):
+        eventos.max_conexoes = MAX_CONEXOES
+    tipo = conf('EVENTOS_BROKER', 'memory')
+    url = conf('EVENTOS_URL')
+    if tipo == 'sqlite' and not url:
+        os.makedirs(app.instance_path, exist_ok=True)
+        url = os.path.join(app.instance_path, 'eventos.db')
+    try:
+        eventos.broker = criar_broker(tipo, url)
+    except Exception as e:
+        logger.error(f"Broker de eventos '{tipo}' indisponível, usando memória: {e}")
+        eventos.broker = BrokerMemoria()
+    return eventos
+
+
+def formatar_sse(tipo, dados, id=None):
+    """Um evento no formato text/event-stream."""
+    linhas = [] if id is None else [f'id: {id}']
+    linhas.append(f'event: {tipo}')
+    linhas.extend(f'data: {linha}' for linha in json.dumps(dados, ensure_ascii=False).splitlines())
+    return '\n'.join(linhas) + '\n\n'
+
+
+def resposta_sse(assinatura, iniciais=(), ultimo_id=0, keepalive=KEEPALIVE, duracao=DURACAO_MAXIMA, ao_ping=None):
+    """Response de streaming para ``assinatura``.
+
+    ``iniciais`` são eventos (tipo, dados, id) de catch-up lidos do banco; eventos
+    ao vivo com id <= ``ultimo_id`` já foram entregues por eles e são pulados.
+    A conexão termina após ``duracao`` segundos ou assim que o cliente fica para
+    trás (fila cheia: nada posterior ao buraco é enviado) e o EventSource
+    reconecta mandando ``Last-Event-ID``. ``ao_ping`` é chamado
+    na abertura e a cada ``keepalive`` segundos enquanto o cliente segue
+    conectado (presença), cheguem eventos ou não.
+    """
+    def gerar():
+        try:
+            if ao_ping:
+                ao_ping()
+            yield f'retry: {RETRY_MS}\n\n'
+            for tipo, dados, id in iniciais:
+                yield formatar_sse(tipo, dados, id)
+            agora = time.monotonic()
+            fim = agora + duracao
+            proximo_ping = agora + keepalive
+            while agora < fim:
+                # Ping por tempo, com ou sem eventos no meio: numa sala movimentada
+                # a presença também precisa do sinal periódico
+                if agora >= proximo_ping:
+                    yield ': ping\n\n'
+                    if ao_ping:
+                        ao_ping()
+                    proximo_ping = agora + keepalive
+                evento = assinatura.proximo(timeout=min(proximo_ping, fim) - agora)
+                agora = time.monotonic()
+                if assinatura.atrasada:
+                    break
+                if evento is None:
+                    continue
+                if evento.get('id') is not None and evento['id'] <= ultimo_id:
+                    continue
+                yield formatar_sse(evento['tipo'], evento['dados'], evento.get('id'))
+        finally:
+            assinatura.fechar()
+
+    return Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx: não bufferizar o stream
+    })
+
+
+def resposta_sem_stream():
+    """Resposta quando o processo está no limite de streams (``LimiteConexoes``).
+
+    Com 204 o EventSource fecha sem reconectar e a página volta ao polling.
+    """
+    return Response(status=204, headers={'Cache-Control': 'no-cache'})
+
+
+def ultimo_id_da_requisicao(request):
+    """Id do último evento recebido: header Last-Event-ID (reconexão) ou ``?since_id=``."""
+    valor = request.headers.get('Last-Event-ID') or request.args.get('since_id')
+    try:
+        return max(int(valor), 0) if valor else 0
+    except (TypeError, ValueError):
+        return 0
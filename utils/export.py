@@ -367,57 +367,22 @@ class ExportUtils:
         return ExportUtils.export_to_excel(empenhos, filename)
     
     @staticmethod
-    def create_backup_csv():
-        """Cria backup em formato CSV (alternativa sem pandas)"""
-        import csv
+    def create_backup_csv(filename=None):
+        """Cria backup em formato CSV (alternativa sem pandas), lendo o banco em lotes"""
+        from sqlalchemy import select
+        from models import User
+        from utils.export_stream import COLUNAS_EMPENHOS_BACKUP, iterar_linhas, gerar_csv
         
-        filename = os.path.join(tempfile.gettempdir(), f'backup_completo_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+        if filename is None:
+            filename = os.path.join(tempfile.gettempdir(), f'backup_completo_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
         
-        # Obter todos os empenhos
-        empenhos = Empenho.query.all()
+        stmt = (select(*[col for _, col, _ in COLUNAS_EMPENHOS_BACKUP])
+                .outerjoin(User, Empenho.usuario_id == User.id)
+                .order_by(Empenho.id))
         
-        # Escrever CSV
+        # Escrever CSV em blocos (sem carregar todos os empenhos)
         with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            if empenhos:
-                fieldnames = [
-                    'ID', 'Número Pregão', 'Número CTR', 'Número Contrato', 'Número Empenho',
-                    'Objeto', 'Fornecedor', 'CNPJ', 'Valor Unitário', 'Data Empenho',
-                    'Valor Empenhado', 'Quantidade', 'Valor Período', 'Percentual Retenção',
-                    'Valor Retenção', 'Valor Líquido', 'Data Envio', 'Data Vencimento',
-                    'Período Referência', 'Status', 'Nota Fiscal', 'Saldo Remanescente',
-                    'Observações', 'Data Criação', 'Usuário'
-                ]
-                
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                
-                for empenho in empenhos:
-                    writer.writerow({
-                        'ID': empenho.id,
-                        'Número Pregão': empenho.numero_pregao,
-                        'Número CTR': empenho.numero_ctr or '',
-                        'Número Contrato': empenho.numero_contrato or '',
-                        'Número Empenho': empenho.numero_empenho,
-                        'Objeto': empenho.objeto,
-                        'Fornecedor': empenho.fornecedor,
-                        'CNPJ': empenho.cnpj or '',
-                        'Valor Unitário': float(empenho.valor_unitario) if empenho.valor_unitario else 0,
-                        'Data Empenho': empenho.data_empenho.strftime('%d/%m/%Y') if empenho.data_empenho else '',
-                        'Valor Empenhado': float(empenho.valor_empenhado) if empenho.valor_empenhado else 0,
-                        'Quantidade': float(empenho.quantidade) if empenho.quantidade else 0,
-                        'Valor Período': float(empenho.valor_periodo) if empenho.valor_periodo else 0,
-                        'Percentual Retenção': float(empenho.percentual_retencao) if empenho.percentual_retencao else 0,
-                        'Valor Retenção': float(empenho.valor_retencao) if empenho.valor_retencao else 0,
-                        'Valor Líquido': float(empenho.valor_liquido) if empenho.valor_liquido else 0,
-                        'Data Envio': empenho.data_envio.strftime('%d/%m/%Y') if empenho.data_envio else '',
-                        'Data Vencimento': empenho.data_vencimento.strftime('%d/%m/%Y') if empenho.data_vencimento else '',
-                        'Período Referência': empenho.periodo_referencia or '',
-                        'Status': empenho.status,
-                        'Nota Fiscal': empenho.nota_fiscal or '',
-                        'Saldo Remanescente': float(empenho.saldo_remanescente) if empenho.saldo_remanescente else 0,
-                        'Observações': empenho.observacoes or '',
-                        'Data Criação': empenho.data_criacao.strftime('%d/%m/%Y %H:%M') if empenho.data_criacao else '',
-                        'Usuário': empenho.usuario.nome if empenho.usuario else ''
-                    })
+            for bloco in gerar_csv(iterar_linhas(stmt, COLUNAS_EMPENHOS_BACKUP), COLUNAS_EMPENHOS_BACKUP):
+                csvfile.write(bloco)
         
         return filename
@@ -0,0 +1,434 @@
+"""
+Exportação em streaming (memória constante).
+
+As linhas são lidas do banco com ``yield_per`` (cursor no servidor, só as
+colunas necessárias) e enviadas ao cliente em blocos:
+
+- CSV/NDJSON: gerados direto no gerador da resposta (``resposta_stream``);
+- XLSX: o openpyxl gera só o esqueleto do arquivo (estilos, larguras,
+  cabeçalho); as linhas da planilha são escritas como XML direto na entrada
+  do zip, que é comprimida e enviada aos poucos por uma thread produtora. Sem
+  DataFrame/workbook em memória nem arquivo temporário (o write-only do
+  openpyxl grava a planilha num temporário e só entrega no ``wb.save``).
+"""
+
+import csv
+import io
+import json
+import logging
+import queue
+import re
+import threading
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain, islice
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+from sqlalchemy import select, func, desc
+
+from models import db, User, Empenho, Contrato, NotaFiscal, ItemContrato
+
+logger = logging.getLogger(__name__)
+
+LOTE_PADRAO = 1000          # linhas por fetch do cursor
+AMOSTRA_LARGURA = 200       # linhas usadas para estimar a largura das colunas
+LARGURA_MAXIMA = 50
+TAMANHO_BLOCO = 64 * 1024   # bytes por bloco enviado ao cliente
+BLOCOS_EM_FILA = 16         # limite de blocos aguardando envio
+LINHAS_POR_ESCRITA = 500    # linhas XLSX acumuladas por write no zip
+
+# Caracteres de controle que o XML não aceita (os mesmos que o openpyxl rejeita)
+_RE_ILEGAIS = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+
+def _data_br(valor):
+    return valor.strftime('%d/%m/%Y') if valor else ''
+
+
+def _resumir(texto, limite=100):
+    if texto and len(texto) > limite:
+        return texto[:limite] + '...'
+    return texto
+
+
+# (cabeçalho, coluna, formatador)
+COLUNAS_EMPENHOS = (
+    ('Número', Empenho.numero_empenho, None),
+    ('Data', Empenho.data_empenho, _data_br),
+    ('Valor', Empenho.valor_empenhado, None),
+    ('Status', Empenho.status, None),
+    ('Contrato', Empenho.numero_contrato, None),
+    ('Pregão', Empenho.numero_pregao, None),
+    ('Fornecedor', Empenho.fornecedores, None),
+    ('Objeto', Empenho.objeto, _resumir),
+    ('Vencimento', Empenho.data_vencimento, _data_br),
+)
+
+# Backup completo (create_backup_csv); Usuário vem de um outer join com users
+COLUNAS_EMPENHOS_BACKUP = (
+    ('ID', Empenho.id, None),
+    ('Número Pregão', Empenho.numero_pregao, None),
+    ('Número CTR', Empenho.numero_ctr, None),
+    ('Número Contrato', Empenho.numero_contrato, None),
+    ('Número Empenho', Empenho.numero_empenho, None),
+    ('Objeto', Empenho.objeto, None),
+    ('Fornecedor', Empenho.fornecedores, None),
+    ('CNPJ', Empenho.cpf_cnpj_credor, None),
+    ('Valor Unitário', Empenho.valor_unitario, None),
+    ('Data Empenho', Empenho.data_empenho, _data_br),
+    ('Valor Empenhado', Empenho.valor_empenhado, None),
+    ('Quantidade', Empenho.quantidade, None),
+    ('Valor Período', Empenho.valor_periodo, None),
+    ('Percentual Retenção', Empenho.percentual_retencao, None),
+    ('Valor Retenção', Empenho.valor_retencao, None),
+    ('Valor Líquido', Empenho.valor_liquido, None),
+    ('Data Envio', Empenho.data_envio, _data_br),
+    ('Data Vencimento', Empenho.data_vencimento, _data_br),
+    ('Período Referência', Empenho.periodo_referencia, None),
+    ('Status', Empenho.status, None),
+    ('Nota Fiscal', Empenho.nota_fiscal, None),
+    ('Saldo Remanescente', Empenho.saldo_remanescente, None),
+    ('Observações', Empenho.observacoes, None),
+    ('Data Criação', Empenho.data_criacao, lambda v: v.strftime('%d/%m/%Y %H:%M') if v else ''),
+    ('Usuário', User.nome, None),
+)
+
+COLUNAS_CONTRATOS = (
+    ('ID', Contrato.id, None),
+    ('Número Contrato', Contrato.numero_contrato, None),
+    ('Pregão', Contrato.numero_pregao, None),
+    ('Objeto', Contrato.objeto, None),
+    ('Fornecedor', Contrato.fornecedor, None),
+    ('CNPJ', Contrato.cnpj_fornecedor, None),
+    ('Valor Total', Contrato.valor_total, None),
+    ('Data Assinatura', Contrato.data_assinatura, _data_br),
+    ('Data Início', Contrato.data_inicio, _data_br),
+    ('Data Fim', Contrato.data_fim, _data_br),
+    ('Status', Contrato.status, None),
+)
+
+COLUNAS_NOTAS = (
+    ('ID', NotaFiscal.id, None),
+    ('Número Nota', NotaFiscal.numero_nota, None),
+    ('Série', NotaFiscal.serie, None),
+    ('Empenho ID', NotaFiscal.empenho_id, None),
+    ('Fornecedor', NotaFiscal.fornecedor_nome, None),
+    ('CNPJ', NotaFiscal.fornecedor_cnpj, None),
+    ('Data Emissão', NotaFiscal.data_emissao, _data_br),
+    ('Data Vencimento', NotaFiscal.data_vencimento, _data_br),
+    ('Data Pagamento', NotaFiscal.data_pagamento, _data_br),
+    ('Valor Bruto', NotaFiscal.valor_bruto, None),
+    ('Valor Líquido', NotaFiscal.valor_liquido, None),
+    ('Status', NotaFiscal.status, None),
+)
+
+COLUNAS_ITENS = (
+    ('ID', ItemContrato.id, None),
+    ('Contrato ID', ItemContrato.contrato_id, None),
+    ('Lote', ItemContrato.lote, None),
+    ('Item', ItemContrato.item, None),
+    ('Descrição', ItemContrato.descricao, None),
+    ('Marca', ItemContrato.marca, None),
+    ('Quantidade', ItemContrato.quantidade, None),
+    ('Unidade', ItemContrato.unidade, None),
+    ('Valor Unitário', ItemContrato.valor_unitario, None),
+    ('Valor Total', ItemContrato.valor_total, None),
+)
+
+# formato -> mimetype
+FORMATOS_STREAM = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _como_select(consulta, colunas):
+    """Aceita um select() ou uma Query legada (reaproveita filtros e ordenação)."""
+    if hasattr(consulta, 'with_entities'):
+        return consulta.with_entities(*[col for _, col, _ in colunas]).statement
+    return consulta
+
+
+def select_empenhos_filtrados(filtros, colunas):
+    """SELECT com os filtros do relatório (sem paginação); só as colunas exportadas ou, sem ``colunas``, a entidade."""
+    stmt = select(*[col for _, col, _ in colunas]) if colunas else select(Empenho)
+
+    if filtros.get('data_inicio'):
+        stmt = stmt.where(Empenho.data_empenho >= datetime.strptime(filtros['data_inicio'], '%Y-%m-%d').date())
+    if filtros.get('data_fim'):
+        stmt = stmt.where(Empenho.data_empenho <= datetime.strptime(filtros['data_fim'], '%Y-%m-%d').date())
+    if filtros.get('status'):
+        stmt = stmt.where(Empenho.status == filtros['status'])
+    if filtros.get('contrato'):
+        stmt = stmt.where(func.lower(Empenho.numero_contrato).like(f"%{filtros['contrato'].lower()}%"))
+    if filtros.get('pregao'):
+        stmt = stmt.where(func.lower(Empenho.numero_pregao).like(f"%{filtros['pregao'].lower()}%"))
+    if filtros.get('fornecedor'):
+        stmt = stmt.where(func.lower(Empenho.fornecedores).like(f"%{filtros['fornecedor'].lower()}%"))
+    if filtros.get('valor_min') is not None:
+        stmt = stmt.where(Empenho.valor_empenhado >= filtros['valor_min'])
+    if filtros.get('valor_max') is not None:
+        stmt = stmt.where(Empenho.valor_empenhado <= filtros['valor_max'])
+
+    return stmt.order_by(desc(Empenho.data_empenho), desc(Empenho.id))
+
+
+def iterar_linhas(stmt, colunas, lote=LOTE_PADRAO, formatar=True):
+    """Executa ``stmt`` com yield_per e devolve cada linha (formatada para exibição)."""
+    formatadores = [fmt if formatar else None for _, _, fmt in colunas]
+    resultado = db.session.execute(stmt.execution_options(yield_per=lote))
+    try:
+        for row in resultado:
+            yield [fmt(v) if fmt else v for fmt, v in zip(formatadores, row)]
+    finally:
+        resultado.close()
+
+
+def _valor_json(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def objeto_json(obj, colunas):
+    """Mesmo dicionário do NDJSON (mais o id), a partir de um objeto do modelo já carregado."""
+    return {'id': obj.id, **{col.key: _valor_json(getattr(obj, col.key)) for _, col, _ in colunas}}
+
+
+def gerar_csv(linhas, colunas):
+    """Blocos de texto CSV (cabeçalho + linhas), liberados a cada ~TAMANHO_BLOCO."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([nome for nome, _, _ in colunas])
+    for linha in linhas:
+        writer.writerow(['' if v is None else v for v in linha])
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gerar_ndjson(linhas, colunas):
+    """Blocos NDJSON: um objeto por linha, chaves = nomes dos atributos do modelo."""
+    chaves = [col.key for _, col, _ in colunas]
+    partes, tamanho = [], 0
+    for linha in linhas:
+        texto = json.dumps({k: _valor_json(v) for k, v in zip(chaves, linha)}, ensure_ascii=False)
+        partes.append(texto + '\n')
+        tamanho += len(texto) + 1
+        if tamanho >= TAMANHO_BLOCO:
+            yield ''.join(partes)
+            partes, tamanho = [], 0
+    if partes:
+        yield ''.join(partes)
+
+
+def resposta_stream(consulta, colunas, formato, nome_base, lote=LOTE_PADRAO):
+    """
+    Response chunked em CSV ou NDJSON a partir de uma Query/select.
+
+    O download começa no primeiro bloco; o cursor é lido em lotes de ``lote``
+    linhas dentro do contexto da requisição (stream_with_context).
+    """
+    stmt = _como_select(consulta, colunas)
+    if formato == 'ndjson':
+        corpo = gerar_ndjson(iterar_linhas(stmt, colunas, lote, formatar=False), colunas)
+    else:
+        formato = 'csv'
+        corpo = gerar_csv(iterar_linhas(stmt, colunas, lote), colunas)
+
+    nome = f'{nome_base}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{formato}'
+    return Response(
+        stream_with_context(corpo),
+        mimetype=FORMATOS_STREAM[formato],
+        headers={
+            'Content-Disposition': f'attachment; filename={nome}',
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+
+def estimar_larguras(cabecalhos, amostra):
+    """Largura de cada coluna a partir do cabeçalho e de uma amostra de linhas."""
+    larguras = [len(str(c)) for c in cabecalhos]
+    for linha in amostra:
+        for i, valor in enumerate(linha):
+            if valor is not None:
+                larguras[i] = max(larguras[i], len(str(valor)))
+    return [min(l + 2, LARGURA_MAXIMA) for l in larguras]
+
+
+class _Cancelado(Exception):
+    pass
+
+
+class _SaidaEmFila:
+    """Arquivo somente-escrita (não posicionável) que entrega blocos numa fila."""
+
+    def __init__(self, fila, cancelado):
+        self._fila = fila
+        self._cancelado = cancelado
+        self._buffer = bytearray()
+
+    def write(self, dados):
+        self._buffer.extend(dados)
+        if len(self._buffer) >= TAMANHO_BLOCO:
+            self._enviar()
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def _enviar(self):
+        bloco, self._buffer = bytes(self._buffer), bytearray()
+        while True:
+            if self._cancelado.is_set():
+                raise _Cancelado()
+            try:
+                self._fila.put(bloco, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        if self._buffer:
+            self._enviar()
+
+
+def _celula_xml(ref, valor):
+    """``<c>`` de uma célula no formato que o openpyxl usa em write-only (texto inline)."""
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return f'<c r="{ref}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)) and valor == valor and abs(valor) != float('inf'):
+        return f'<c r="{ref}" t="n"><v>{valor}</v></c>'
+    texto = escape(_RE_ILEGAIS.sub('', str(valor)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _escrever_xlsx(saida, linhas, colunas, titulo):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo)
+
+    cabecalhos = [nome for nome, _, _ in colunas]
+    amostra = list(islice(linhas, AMOSTRA_LARGURA))
+
+    # As larguras precisam ser definidas antes da primeira linha
+    for i, largura in enumerate(estimar_larguras(cabecalhos, amostra), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = largura
+
+    header_font = Font(bold=True, color='FFFFFF')
+    header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    linha_cabecalho = []
+    for nome in cabecalhos:
+        cell = WriteOnlyCell(ws, value=nome)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal='center')
+        linha_cabecalho.append(cell)
+    ws.append(linha_cabecalho)
+
+    # Esqueleto pequeno (só o cabeçalho) em memória; as linhas entram na cópia
+    esqueleto = io.BytesIO()
+    wb.save(esqueleto)
+    letras = [get_column_letter(i) for i in range(1, len(cabecalhos) + 1)]
+
+    # ZipFile aceita saída não posicionável (descritores de dados após cada entrada)
+    with zipfile.ZipFile(esqueleto) as origem, \
+            zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as destino:
+        for info in origem.infolist():
+            conteudo = origem.read(info)
+            if not info.filename.startswith('xl/worksheets/sheet'):
+                destino.writestr(info, conteudo)
+                continue
+            inicio, _, fim = conteudo.partition(b'</sheetData>')
+            with destino.open(info.filename, 'w', force_zip64=True) as planilha:
+                planilha.write(inicio)
+                bloco = []
+                for n, linha in enumerate(chain(amostra, linhas), start=2):
+                    celulas = ''.join(_celula_xml(f'{letra}{n}', v) for letra, v in zip(letras, linha))
+                    bloco.append(f'<row r="{n}">{celulas}</row>')
+                    if len(bloco) >= LINHAS_POR_ESCRITA:
+                        planilha.write(''.join(bloco).encode('utf-8'))
+                        bloco = []
+                planilha.write(''.join(bloco).encode('utf-8') + b'</sheetData>' + fim)
+
+
+def escrever_xlsx(arquivo, stmt, colunas, titulo='Dados', lote=LOTE_PADRAO, progresso=None):
+    """Grava o .xlsx em ``arquivo`` (caminho ou file-like); ``progresso(n)`` a cada lote."""
+    linhas = iterar_linhas(stmt, colunas, lote)
+    if progresso:
+        linhas = _contar(linhas, lote, progresso)
+    _escrever_xlsx(arquivo, linhas, colunas, titulo)
+
+
+def _contar(linhas, lote, callback):
+    n = 0
+    for linha in linhas:
+        n += 1
+        if n % lote == 0:
+            callback(n)
+        yield linha
+    callback(n)
+
+
+def gerar_xlsx_stream(app, stmt, colunas, titulo='Dados', lote=LOTE_PADRAO):
+    """
+    Gerador de blocos .xlsx para ``Response``.
+
+    A consulta roda numa thread com app context próprio; a fila limitada faz a
+    thread esperar quando o cliente lê devagar, mantendo a memória constante.
+    """
+    fila = queue.Queue(maxsize=BLOCOS_EM_FILA)
+    cancelado = threading.Event()
+    fim = object()
+
+    def produzir():
+        saida = _SaidaEmFila(fila, cancelado)
+        with app.app_context():
+            try:
+                _escrever_xlsx(saida, iterar_linhas(stmt, colunas, lote), colunas, titulo)
+                saida.close()
+            except _Cancelado:
+                logger.info("Exportação XLSX cancelada pelo cliente")
+                return
+            except Exception as e:
+                logger.error(f"Erro ao gerar XLSX em streaming: {e}")
+                _colocar(e)
+                return
+            finally:
+                db.session.remove()
+        _colocar(fim)
+
+    def _colocar(item):
+        while not cancelado.is_set():
+            try:
+                fila.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    thread = threading.Thread(target=produzir, name='export-xlsx', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = fila.get()
+            if item is fim:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelado.set()
@@ -0,0 +1,169 @@
+"""
+Fila de gravação: um único gravador por vez, com gravações agrupadas em lote.
+
+No SQLite só uma transação grava por vez; com muitas threads gravando
+(mensagens de chat, presença) cada uma disputa o lock do arquivo, espera o
+busy_timeout e paga um commit próprio. Aqui cada gravação (uma função
+``f(conn)``) entra numa fila e só uma thread do processo grava por vez: a
+que encontra o gravador livre grava tudo o que estiver na fila, inclusive o
+que as outras enfileiraram, em uma transação só (commit em grupo). As demais
+esperam e acordam com o resultado pronto, sem abrir transação.
+
+Não há thread dedicada: sob carga, uma thread extra disputaria o GIL com as
+do servidor e o gravador ficaria para trás; aqui grava quem já está rodando.
+
+O ganho vem de pagar um commit por lote: com ``synchronous=FULL`` (fsync a
+cada commit) a vazão de gravação sob carga mista sobe bastante; com
+``synchronous=NORMAL`` o commit já é barato e o revezamento em Python pode
+custar mais que o lock do próprio SQLite (ver benchmark_sqlite.py
+--synchronous). Por isso ``DB_FILA_GRAVACAO=auto`` (padrão) só agrupa no
+SQLite com ``synchronous`` FULL/EXTRA; ``1`` sempre agrupa e ``0`` grava
+direto, uma transação por chamada (bancos com gravações concorrentes de
+verdade, como PostgreSQL/MySQL, não ganham com a serialização).
+
+Se uma gravação do lote falhar, o lote é desfeito e cada gravação roda de
+novo na sua própria transação, de modo que só a que falhou recebe o erro.
+As funções devem apenas gravar pela ``conn`` recebida (sem sessão do ORM) e
+podem rodar mais de uma vez nesse caso.
+
+Quem desiste por ``timeout`` sai da fila antes do ``TimeoutError`` (a gravação
+não acontece depois); se ela já estava no lote sendo gravado, a chamada espera
+esse lote terminar e devolve o resultado dele.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from models import db
+from utils.banco import PRAGMAS_SQLITE
+
+logger = logging.getLogger(__name__)
+
+LOTE_MAXIMO = 200     # gravações por transação
+ESPERA_MAXIMA = 10    # segundos que quem grava espera pela vez
+
+
+class _Gravacao:
+    __slots__ = ('funcao', 'args', 'pronta', 'resultado', 'erro')
+
+    def __init__(self, funcao, args):
+        self.funcao = funcao
+        self.args = args
+        self.pronta = False
+        self.resultado = None
+        self.erro = None
+
+
+class FilaGravacao:
+    """Gravações no ``engine`` serializadas por um lock e agrupadas em transações em lote."""
+
+    def __init__(self, engine=None, lote_maximo=LOTE_MAXIMO, agrupar=True):
+        self.engine = engine
+        self.lote_maximo = lote_maximo
+        self.agrupar = agrupar
+        self._fila = collections.deque()
+        self._livre = threading.Condition()
+        self._gravando = False
+        self._estatisticas = {'gravacoes': 0, 'lotes': 0, 'maior_lote': 0, 'erros': 0}
+
+    def iniciar(self, engine=None, agrupar=None):
+        if engine is not None:
+            self.engine = engine
+        if agrupar is not None:
+            self.agrupar = agrupar
+        return self
+
+    def executar(self, funcao, *args, timeout=ESPERA_MAXIMA):
+        """Grava ``funcao(conn, *args)`` e devolve o seu retorno (ou levanta o erro dela)."""
+        if not self.agrupar:
+            with (self.engine or db.engine).begin() as conn:
+                return funcao(conn, *args)
+        gravacao = _Gravacao(funcao, args)
+        limite = time.monotonic() + timeout
+        with self._livre:
+            self._fila.append(gravacao)
+        em_lote = False
+        while True:
+            with self._livre:
+                while self._gravando and not gravacao.pronta:
+                    restante = limite - time.monotonic()
+                    if restante <= 0 and not em_lote:
+                        try:
+                            self._fila.remove(gravacao)
+                        except ValueError:
+                            # Já entrou no lote em gravação: espera o commit para devolver o resultado real
+                            em_lote = True
+                        else:
+                            raise TimeoutError(f"Fila de gravação não liberou em {timeout}s")
+                    self._livre.wait(None if em_lote else restante)
+                if gravacao.pronta:
+                    break
+                # Gravador livre: esta thread grava o lote (o seu e o das que estão esperando)
+                self._gravando = True
+                lote = self._retirar_lote()
+            try:
+                self._gravar_lote(lote)
+            finally:
+                with self._livre:
+                    self._gravando = False
+                    self._livre.notify_all()
+        if gravacao.erro is not None:
+            raise gravacao.erro
+        return gravacao.resultado
+
+    def estatisticas(self):
+        return dict(self._estatisticas, pendentes=len(self._fila))
+
+    def _retirar_lote(self):
+        lote = []
+        while self._fila and len(lote) < self.lote_maximo:
+            lote.append(self._fila.popleft())
+        return lote
+
+    def _gravar_lote(self, lote):
+        engine = self.engine or db.engine
+        try:
+            with engine.begin() as conn:
+                resultados = [g.funcao(conn, *g.args) for g in lote]
+            for gravacao, resultado in zip(lote, resultados):
+                gravacao.resultado = resultado
+        except Exception as e:
+            if len(lote) == 1:
+                lote[0].erro = e
+            else:
+                logger.info(f"Lote de {len(lote)} gravações falhou ({e}); gravando uma a uma")
+                for gravacao in lote:
+                    try:
+                        with engine.begin() as conn:
+                            gravacao.resultado = gravacao.funcao(conn, *gravacao.args)
+                    except Exception as erro:
+                        gravacao.erro = erro
+        self._estatisticas['gravacoes'] += len(lote)
+        self._estatisticas['lotes'] += 1
+        self._estatisticas['maior_lote'] = max(self._estatisticas['maior_lote'], len(lote))
+        self._estatisticas['erros'] += sum(1 for g in lote if g.erro is not None)
+        for gravacao in lote:
+            gravacao.pronta = True
+
+
+gravador = FilaGravacao()
+
+
+def _agrupar(app, engine):
+    valor = str(app.config.get('DB_FILA_GRAVACAO') or os.environ.get('DB_FILA_GRAVACAO') or 'auto').lower()
+    if valor != 'auto':
+        return valor not in ('0', 'false', 'nao', 'não')
+    if engine.dialect.name != 'sqlite':
+        return False
+    pragmas = dict(PRAGMAS_SQLITE, **(app.config.get('SQLITE_PRAGMAS') or {}))
+    return str(pragmas.get('synchronous')).upper() in ('FULL', 'EXTRA', '2', '3')
+
+
+def init_gravador(app):
+    """Associa o gravador ao engine principal do app e decide se agrupa (``DB_FILA_GRAVACAO``)."""
+    with app.app_context():
+        gravador.iniciar(db.engine, agrupar=_agrupar(app, db.engine))
+    return gravador
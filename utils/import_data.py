@@ -5,11 +5,15 @@ except ImportError:
     PANDAS_AVAILABLE = False
 
 import os
+import hashlib
+import logging
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from models import Empenho, db
+from models import Empenho, ImportacaoCheckpoint, db, normalizar_status
 import tempfile
 
+logger = logging.getLogger(__name__)
+
 class ImportUtils:
     
     ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
@@ -155,9 +159,275 @@ class ImportUtils:
         except (ValueError, TypeError):
             return None
     
+    # Colunas por tipo (após o mapeamento)
+    COLUNAS_DATA = ('data_empenho', 'data_envio', 'data_vencimento')
+    COLUNAS_NUMERO = ('valor_unitario', 'valor_empenhado', 'quantidade', 'valor_periodo',
+                      'percentual_retencao', 'saldo_remanescente')
+    COLUNAS_TEXTO = ('numero_pregao', 'numero_contrato', 'objeto')  # obrigatórias no modelo ('' se ausente)
+    COLUNAS_TEXTO_OPCIONAL = ('numero_aditivo', 'unidade_mensal', 'periodo_referencia', 'nota_fiscal', 'observacoes')
+    DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%y')
+    
+    LOTE_COMMIT = 5000    # linhas lidas e confirmadas por lote (padrão de IMPORT_BATCH_SIZE)
+    LOTE_INSERCAO = 1000  # linhas por INSERT em massa
+    LOTE_CONSULTA = 500   # valores por IN (...) na checagem de duplicados
+    MAX_MENSAGENS_ERRO = 1000  # mensagens guardadas no resultado (a contagem segue completa)
+    
+    @staticmethod
+    def coerce_dates(serie):
+        """Versão vetorizada de parse_date: Series -> Series de date/None"""
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            convertida = serie
+        else:
+            texto = serie.astype('string').str.strip()
+            convertida = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+            # Valores já datetime (Excel) entram direto; texto tenta cada formato
+            nativos = serie.map(lambda v: isinstance(v, datetime))
+            if nativos.any():
+                convertida[nativos] = pd.to_datetime(serie[nativos], errors='coerce')
+            for fmt in ImportUtils.DATE_FORMATS:
+                faltando = convertida.isna() & texto.notna() & (texto != '')
+                if not faltando.any():
+                    break
+                convertida[faltando] = pd.to_datetime(texto[faltando], format=fmt, errors='coerce')
+        return convertida.dt.date.astype(object).where(convertida.notna(), None)
+    
+    @staticmethod
+    def coerce_numbers(serie):
+        """Versão vetorizada de parse_number (texto em formato brasileiro: 1.234,56)"""
+        if pd.api.types.is_numeric_dtype(serie):
+            numeros = serie.astype(float)
+        else:
+            texto = serie.astype('string')
+            eh_texto = serie.map(lambda v: isinstance(v, str))
+            limpo = (texto.str.replace('R$', '', regex=False).str.replace(' ', '', regex=False)
+                     .str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+            numeros = pd.to_numeric(limpo.where(eh_texto, texto), errors='coerce')
+        return numeros.astype(object).where(numeros.notna(), None)
+    
+    @staticmethod
+    def _existentes(numeros):
+        """numero_empenho já cadastrados, consultados em lotes de IN (...)"""
+        existentes = set()
+        numeros = list(numeros)
+        for i in range(0, len(numeros), ImportUtils.LOTE_CONSULTA):
+            lote = numeros[i:i + ImportUtils.LOTE_CONSULTA]
+            existentes.update(
+                n for (n,) in db.session.query(Empenho.numero_empenho).filter(Empenho.numero_empenho.in_(lote))
+            )
+        return existentes
+    
+    @staticmethod
+    def _preparar(df, user_id):
+        """
+        Normaliza e converte as colunas de uma vez; devolve (DataFrame pronto, {índice: mensagem de erro}).
+        """
+        erros = {}
+        
+        def marcar(mascara, mensagem):
+            for idx in df.index[mascara]:
+                erros.setdefault(idx, mensagem(idx) if callable(mensagem) else mensagem)
+        
+        numero = df['numero_empenho'].astype('string').str.strip() if 'numero_empenho' in df else pd.Series(pd.NA, index=df.index, dtype='string')
+        numero = numero.str.replace(r'\.0$', '', regex=True)  # números lidos como float no Excel
+        marcar(numero.isna() | (numero == ''), 'Número do empenho é obrigatório')
+        
+        dados = pd.DataFrame(index=df.index)
+        dados['numero_empenho'] = numero
+        
+        for col in ImportUtils.COLUNAS_NUMERO:
+            dados[col] = ImportUtils.coerce_numbers(df[col]) if col in df else None
+        marcar(dados['valor_empenhado'].isna(), 'Valor empenhado é obrigatório')
+        
+        for col in ImportUtils.COLUNAS_DATA:
+            dados[col] = ImportUtils.coerce_dates(df[col]) if col in df else None
+        marcar(dados['data_empenho'].isna(), 'Data do empenho ausente ou inválida')
+        
+        for col in ImportUtils.COLUNAS_TEXTO:
+            dados[col] = df[col].astype('string').str.strip().fillna('') if col in df else ''
+        for col in ImportUtils.COLUNAS_TEXTO_OPCIONAL:
+            if col in df:
+                texto = df[col].astype('string').str.strip()
+                dados[col] = texto.astype(object).where(texto.notna() & (texto != ''), None)
+            else:
+                dados[col] = None
+        
+        status = df['status'].astype('string').map(normalizar_status, na_action='ignore') if 'status' in df else None
+        dados['status'] = status.fillna('PENDENTE').replace('', 'PENDENTE') if status is not None else 'PENDENTE'
+        
+        # Duplicados dentro do próprio arquivo (mantém a primeira ocorrência) e no banco
+        validos = ~dados.index.isin(list(erros))
+        repetidos = validos & dados['numero_empenho'].duplicated(keep='first')
+        marcar(repetidos, lambda idx: f"Empenho {dados.at[idx, 'numero_empenho']} repetido no arquivo")
+        validos = ~dados.index.isin(list(erros))
+        ja_existem = ImportUtils._existentes(dados.loc[validos, 'numero_empenho'].unique())
+        marcar(validos & dados['numero_empenho'].isin(ja_existem),
+               lambda idx: f"Empenho {dados.at[idx, 'numero_empenho']} já existe")
+        
+        dados = dados[~dados.index.isin(list(erros))].copy()
+        
+        # Valores derivados (mesma regra de Empenho.calcular_valores)
+        valor = dados['valor_empenhado'].astype(float)
+        perc = dados['percentual_retencao'].astype(float).fillna(0)
+        retencao = (valor * perc / 100).where(perc != 0, 0.0)
+        liquido = valor - retencao
+        periodo = dados['valor_periodo'].astype(float)
+        saldo_informado = dados['saldo_remanescente'].astype(float).fillna(0)
+        dados['percentual_retencao'] = perc
+        dados['valor_retencao'] = retencao
+        dados['valor_liquido'] = liquido
+        dados['saldo_remanescente'] = (liquido - periodo).where(periodo.notna() & (periodo != 0), saldo_informado)
+        
+        dados['resumo_objeto'] = dados['objeto']
+        dados['usuario_id'] = user_id
+        return dados, erros
+    
+    @staticmethod
+    def _inserir_lote(registros, resultado, linhas):
+        """INSERT em massa; se o lote falhar, refaz linha a linha para apontar a linha com erro."""
+        from sqlalchemy import insert
+        from utils.agregados import aplicar_insercoes_em_massa
+        
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Empenho), registros)
+                aplicar_insercoes_em_massa(Empenho, registros)
+            resultado['importados'] += len(registros)
+            return
+        except Exception as e:
+            logger.warning(f"Lote de importação falhou, refazendo linha a linha: {e}")
+        
+        for registro, linha in zip(registros, linhas):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(Empenho), [registro])
+                    aplicar_insercoes_em_massa(Empenho, [registro])
+                resultado['importados'] += 1
+            except Exception as e:
+                ImportUtils._registrar_erro(resultado, f'Linha {linha}: {str(e).splitlines()[0]}')
+    
     @staticmethod
-    def import_from_file(filepath, user_id):
-        """Importa dados de arquivo Excel ou CSV"""
+    def _eh_csv(origem):
+        nome = origem if isinstance(origem, str) else getattr(origem, 'name', '') or ''
+        return str(nome).lower().endswith('.csv')
+    
+    @staticmethod
+    def contar_linhas(filepath):
+        """Estimativa do total de linhas de dados (para progresso), sem carregar o arquivo"""
+        try:
+            if ImportUtils._eh_csv(filepath):
+                with open(filepath, 'rb') as f:
+                    return max(sum(bloco.count(b'\n') for bloco in iter(lambda: f.read(1 << 20), b'')) - 1, 0)
+            if str(filepath).lower().endswith('.xlsx'):
+                from openpyxl import load_workbook
+                wb = load_workbook(filepath, read_only=True)
+                try:
+                    return max((wb.active.max_row or 1) - 1, 0)
+                finally:
+                    wb.close()
+        except Exception:
+            pass
+        return None
+    
+    @staticmethod
+    def ler_em_blocos(origem, tamanho, pular=0):
+        """
+        Lê a planilha em DataFrames de até ``tamanho`` linhas, sem carregar o arquivo inteiro.
+        
+        CSV usa ``chunksize``; .xlsx usa openpyxl em modo read-only. O índice de
+        cada bloco é a posição absoluta da linha de dados (linha na planilha =
+        índice + 2) e ``bloco.attrs['fim']`` é a posição seguinte ao bloco (linhas
+        em branco são descartadas, mas contam na posição). ``pular`` descarta as
+        primeiras linhas de dados (retomada). ``origem`` é um caminho ou arquivo
+        aberto; .xls (formato antigo) é lido inteiro pelo pandas.
+        """
+        def entregar(df, fim):
+            df = df.dropna(how='all')
+            df.attrs['fim'] = fim
+            return df
+        
+        if ImportUtils._eh_csv(origem):
+            leitor = pd.read_csv(origem, encoding='utf-8', dtype=str, keep_default_na=False, na_values=[''],
+                                 skip_blank_lines=False, chunksize=tamanho,
+                                 skiprows=range(1, pular + 1) if pular else None)
+            inicio = pular
+            for bloco in leitor:
+                bloco.index = pd.RangeIndex(inicio, inicio + len(bloco))
+                inicio += len(bloco)
+                yield entregar(bloco, inicio)
+            return
+        
+        try:
+            from openpyxl import load_workbook
+            wb = load_workbook(origem, read_only=True, data_only=True)
+        except Exception:
+            # .xls ou arquivo que o openpyxl não abre
+            if hasattr(origem, 'seek'):
+                origem.seek(0)
+            df = pd.read_excel(origem)
+            for inicio in range(pular, len(df), tamanho):
+                fim = min(inicio + tamanho, len(df))
+                yield entregar(df.iloc[inicio:fim], fim)
+            return
+        
+        try:
+            linhas = wb.active.iter_rows(values_only=True)
+            cabecalho = next(linhas, None)
+            if cabecalho is None:
+                return
+            colunas = [c if c is not None else f'coluna_{i}' for i, c in enumerate(cabecalho)]
+            n = len(colunas)
+            posicao, buffer, indices = 0, [], []
+            for linha in linhas:
+                posicao += 1
+                if posicao <= pular:
+                    continue
+                buffer.append(tuple(linha[:n]) + (None,) * (n - len(linha)))
+                indices.append(posicao - 1)
+                if len(buffer) >= tamanho:
+                    yield entregar(pd.DataFrame(buffer, columns=colunas, index=indices), posicao)
+                    buffer, indices = [], []
+            if buffer:
+                yield entregar(pd.DataFrame(buffer, columns=colunas, index=indices), posicao)
+        finally:
+            wb.close()
+    
+    @staticmethod
+    def assinatura_arquivo(filepath):
+        """sha1 do conteúdo (identifica o mesmo arquivo reenviado para retomada)"""
+        digest = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for bloco in iter(lambda: f.read(1 << 20), b''):
+                digest.update(bloco)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _checkpoint(filepath, user_id, retomar):
+        """Checkpoint em andamento para o mesmo arquivo/usuário ou um novo"""
+        assinatura = ImportUtils.assinatura_arquivo(filepath)
+        checkpoint = None
+        if retomar:
+            checkpoint = (ImportacaoCheckpoint.query
+                          .filter_by(assinatura=assinatura, usuario_id=user_id, status='EM_ANDAMENTO')
+                          .order_by(ImportacaoCheckpoint.id.desc()).first())
+        if checkpoint is None:
+            checkpoint = ImportacaoCheckpoint(assinatura=assinatura, usuario_id=user_id,
+                                              nome_arquivo=os.path.basename(filepath)[:255])
+            db.session.add(checkpoint)
+            db.session.commit()
+        return checkpoint
+    
+    @staticmethod
+    def import_from_file(filepath, user_id, progresso=None, tamanho_lote=None, retomar=True):
+        """
+        Importa dados de arquivo Excel ou CSV em lotes, com memória limitada.
+        
+        O arquivo é lido em blocos de ``tamanho_lote`` linhas (config IMPORT_BATCH_SIZE);
+        cada bloco é validado/convertido por coluna (pandas), gravado com INSERT em
+        massa e confirmado com commit, avançando o checkpoint. Se a importação
+        falhar, reenviar o mesmo arquivo (``retomar=True``) continua do último lote
+        confirmado. ``progresso(linhas, total)`` é chamado após cada lote
+        (``total`` é estimado e pode ser None).
+        """
         resultado = {
             'sucesso': False,
             'importados': 0,
@@ -166,92 +436,102 @@ class ImportUtils:
             'erro': None
         }
         
+        checkpoint = None
         try:
-            # Ler arquivo
-            if filepath.endswith('.csv'):
-                df = pd.read_csv(filepath, encoding='utf-8')
-            else:
-                df = pd.read_excel(filepath)
+            if tamanho_lote is None:
+                try:
+                    from flask import current_app
+                    tamanho_lote = int(current_app.config.get('IMPORT_BATCH_SIZE', ImportUtils.LOTE_COMMIT))
+                except RuntimeError:
+                    tamanho_lote = ImportUtils.LOTE_COMMIT
             
-            if df.empty:
+            # Cabeçalho e primeiras linhas para validar o layout antes de criar checkpoint
+            primeiro = next(ImportUtils.ler_em_blocos(filepath, 50), None)
+            if primeiro is None or primeiro.empty:
                 resultado['erro'] = 'Arquivo vazio ou sem dados válidos'
                 return resultado
             
-            # Mapear colunas
-            column_map = ImportUtils.map_columns(df)
+            # Mapear colunas (se duas colunas mapearem para o mesmo campo, vale a primeira)
+            column_map = ImportUtils.map_columns(primeiro)
             
             if not column_map:
                 resultado['erro'] = 'Nenhuma coluna reconhecida encontrada no arquivo'
                 return resultado
             
-            # Renomear colunas
-            df_mapped = df.rename(columns=column_map)
+            vistos = set()
+            column_map = {col: campo for col, campo in column_map.items()
+                          if not (campo in vistos or vistos.add(campo))}
             
-            # Processar cada linha
-            for index, row in df_mapped.iterrows():
-                try:
-                    # Verificar campos obrigatórios
-                    if 'numero_empenho' not in row or pd.isna(row.get('numero_empenho')):
-                        resultado['erros'] += 1
-                        resultado['mensagens_erro'].append(f'Linha {index + 2}: Número do empenho é obrigatório')
-                        continue
-                    
-                    if 'valor_empenhado' not in row or pd.isna(row.get('valor_empenhado')):
-                        resultado['erros'] += 1
-                        resultado['mensagens_erro'].append(f'Linha {index + 2}: Valor empenhado é obrigatório')
-                        continue
-                    
-                    # Verificar se empenho já existe
-                    numero_empenho = str(row['numero_empenho']).strip()
-                    if Empenho.query.filter_by(numero_empenho=numero_empenho).first():
-                        resultado['erros'] += 1
-                        resultado['mensagens_erro'].append(f'Linha {index + 2}: Empenho {numero_empenho} já existe')
-                        continue
-                    
-                    # Criar objeto Empenho
-                    empenho_data = {
-                        'numero_empenho': numero_empenho,
-                        'numero_pregao': str(row.get('numero_pregao', '')).strip(),
-                        'numero_contrato': str(row.get('numero_contrato', '')).strip(),
-                        'numero_aditivo': str(row.get('numero_aditivo', '')).strip() if not pd.isna(row.get('numero_aditivo')) else None,
-                        'objeto': str(row.get('objeto', '')).strip(),
-                        'unidade_mensal': str(row.get('unidade_mensal', '')).strip() if not pd.isna(row.get('unidade_mensal')) else None,
-                        'valor_unitario': ImportUtils.parse_number(row.get('valor_unitario')),
-                        'data_empenho': ImportUtils.parse_date(row.get('data_empenho')),
-                        'valor_empenhado': ImportUtils.parse_number(row.get('valor_empenhado')),
-                        'quantidade': ImportUtils.parse_number(row.get('quantidade')),
-                        'valor_periodo': ImportUtils.parse_number(row.get('valor_periodo')),
-                        'percentual_retencao': ImportUtils.parse_number(row.get('percentual_retencao')) or 0,
-                        'data_envio': ImportUtils.parse_date(row.get('data_envio')),
-                        'data_vencimento': ImportUtils.parse_date(row.get('data_vencimento')),
-                        'periodo_referencia': str(row.get('periodo_referencia', '')).strip() if not pd.isna(row.get('periodo_referencia')) else None,
-                        'status': str(row.get('status', 'PENDENTE')).strip().upper(),
-                        'nota_fiscal': str(row.get('nota_fiscal', '')).strip() if not pd.isna(row.get('nota_fiscal')) else None,
-                        'observacoes': str(row.get('observacoes', '')).strip() if not pd.isna(row.get('observacoes')) else None,
-                        'saldo_remanescente': ImportUtils.parse_number(row.get('saldo_remanescente')) or 0
-                    }
-                    
-                    # Criar empenho usando o método from_dict
-                    empenho = Empenho.from_dict(empenho_data, user_id)
-                    
-                    db.session.add(empenho)
-                    resultado['importados'] += 1
-                    
-                except Exception as e:
-                    resultado['erros'] += 1
-                    resultado['mensagens_erro'].append(f'Linha {index + 2}: {str(e)}')
-                    continue
+            checkpoint = ImportUtils._checkpoint(filepath, user_id, retomar)
+            inicio = checkpoint.linhas_processadas
+            resultado['importados'] = checkpoint.importados
+            resultado['erros'] = checkpoint.erros
+            resultado['checkpoint_id'] = checkpoint.id
+            if inicio:
+                resultado['retomado_da_linha'] = inicio + 2
+                logger.info(f"Retomando importação {checkpoint.id} a partir da linha {inicio + 2}")
+            total = ImportUtils.contar_linhas(filepath)
             
-            # Salvar no banco
+            for bloco in ImportUtils.ler_em_blocos(filepath, tamanho_lote, pular=inicio):
+                df_mapped = bloco[list(column_map)].rename(columns=column_map)
+                
+                dados, erros = ImportUtils._preparar(df_mapped, user_id)
+                erros_anteriores = resultado['erros']
+                for idx in sorted(erros):
+                    ImportUtils._registrar_erro(resultado, f'Linha {idx + 2}: {erros[idx]}')
+                
+                # Abre a transação do lote com uma escrita no checkpoint: no SQLite (pysqlite) um
+                # SAVEPOINT sem transação aberta vira transação própria e o RELEASE a confirmaria
+                checkpoint.atualizado_em = datetime.utcnow()
+                db.session.flush()
+                
+                # Gravar em sub-lotes de INSERT
+                linhas = (dados.index + 2).tolist()
+                registros = dados.to_dict('records')
+                agora = datetime.utcnow()
+                for registro in registros:
+                    registro['data_criacao'] = registro['data_atualizacao'] = agora
+                importados_antes = resultado['importados']
+                for i in range(0, len(registros), ImportUtils.LOTE_INSERCAO):
+                    ImportUtils._inserir_lote(registros[i:i + ImportUtils.LOTE_INSERCAO],
+                                              resultado, linhas[i:i + ImportUtils.LOTE_INSERCAO])
+                
+                # Confirmar o lote junto com o checkpoint
+                checkpoint.linhas_processadas = bloco.attrs['fim']
+                checkpoint.importados = resultado['importados']
+                checkpoint.erros = resultado['erros']
+                db.session.commit()
+                
+                if resultado['importados'] > importados_antes:
+                    from utils.cache import cache, TAG_DADOS
+                    cache.invalidate_tag(TAG_DADOS)
+                logger.debug(f"Importação {checkpoint.id}: {checkpoint.linhas_processadas} linhas "
+                             f"(+{resultado['importados'] - importados_antes} / {resultado['erros'] - erros_anteriores} erros)")
+                if progresso:
+                    progresso(checkpoint.linhas_processadas, total)
+            
+            checkpoint.status = 'CONCLUIDA'
             db.session.commit()
             resultado['sucesso'] = True
             
         except Exception as e:
             db.session.rollback()
             resultado['erro'] = str(e)
+            logger.error(f"Importação interrompida: {e}")
+            # Contadores refletem só o que foi confirmado (o lote que falhou será refeito)
+            if checkpoint is not None:
+                resultado['importados'] = checkpoint.importados
+                resultado['erros'] = checkpoint.erros
+                resultado['retomar_da_linha'] = checkpoint.linhas_processadas + 2
         
         return resultado
     
+    @staticmethod
+    def _registrar_erro(resultado, mensagem):
+        resultado['erros'] += 1
+        if len(resultado['mensagens_erro']) < ImportUtils.MAX_MENSAGENS_ERRO:
+            resultado['mensagens_erro'].append(mensagem)
+    
     @staticmethod
     def get_template_excel():
         """Gera arquivo template para importação"""
@@ -0,0 +1,165 @@
+"""
+Índices gerenciados e consultor de índices.
+
+``db.create_all()`` só cria índices junto com tabelas novas; para tabelas que
+já existem, os índices declarados nos modelos (e os de expressão de
+utils/busca.py) são criados aqui na inicialização ou por
+``python migrar_indices.py``.
+
+O ``ConsultorIndices`` registra as consultas emitidas em cada rota, roda
+``EXPLAIN QUERY PLAN`` nelas e aponta as que varrem a tabela inteira
+(``SCAN tabela``). ``python verificar_indices.py`` usa o consultor para
+percorrer as rotas GET e falhar no CI quando um filtro deixa de usar índice.
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_request_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.schema import CreateIndex
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Tabelas cujos índices declarados nos modelos são mantidos por ``migrar_indices``
+TABELAS_GERENCIADAS = ('contratos', 'empenhos', 'notas_fiscais', 'chat_msn_messages', 'chat_msn_attachments',
+                       'chat_msn_members', 'chat_members', 'chat_room_messages')
+
+
+def criar_indices(indices):
+    """Cria os índices que faltarem; retorna quantos comandos foram executados sem erro.
+
+    A reflexão do SQLAlchemy não enxerga índices de expressão, então em vez de
+    ``checkfirst`` usa ``CREATE INDEX IF NOT EXISTS`` onde o banco suporta.
+    """
+    if_not_exists = db.engine.dialect.name in ('sqlite', 'postgresql')
+    inspetor = inspect(db.engine)
+    criados = 0
+    for indice in indices:
+        if not inspetor.has_table(indice.table.name):
+            continue  # banco novo: create_all cria tabela e índice juntos
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(CreateIndex(indice, if_not_exists=if_not_exists))
+            criados += 1
+        except Exception as e:
+            # Sem índice a consulta continua funcionando, só que varrendo a tabela
+            logger.warning(f"Índice {indice.name} não criado: {e}")
+    return criados
+
+
+def indices_gerenciados():
+    """Índices declarados nos modelos para as tabelas de ``TABELAS_GERENCIADAS`` que estão mapeadas."""
+    indices = []
+    for nome in TABELAS_GERENCIADAS:
+        tabela = db.metadata.tables.get(nome)
+        if tabela is not None:
+            indices.extend(sorted(tabela.indexes, key=lambda i: i.name))
+    return indices
+
+
+def migrar_indices(analisar=False):
+    """Cria os índices gerenciados que faltarem; ``analisar`` roda ANALYZE para o planner usar estatísticas."""
+    criados = criar_indices(indices_gerenciados())
+    if analisar and db.engine.dialect.name in ('sqlite', 'postgresql'):
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+    return criados
+
+
+# ----------------- Consultor -----------------
+
+# "SCAN empenhos", "SCAN e", "SCAN empenhos USING COVERING INDEX ..." (varredura completa do índice)
+_RE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+_RE_WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+
+
+class ConsultorIndices:
+    """Captura as consultas por endpoint e aponta varreduras completas no plano de execução.
+
+    Só analisa SQLite (``EXPLAIN QUERY PLAN``); em outros bancos apenas registra
+    as consultas. Guarda no máximo ``max_por_rota`` consultas distintas por endpoint.
+    """
+
+    def __init__(self, app=None, max_por_rota=50):
+        self.max_por_rota = max_por_rota
+        self.consultas = {}  # endpoint -> OrderedDict(sql -> parâmetros)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._capturar)
+        # Com a separação leitura/gravação (utils/banco.py) os SELECTs do ORM vão para o pool de leitura
+        leitura = app.extensions.get('banco_leitura')
+        if leitura is not None:
+            event.listen(leitura, 'before_cursor_execute', self._capturar)
+        app.extensions['consultor_indices'] = self
+
+    def _capturar(self, conn, cursor, statement, parameters, context, executemany):
+        if executemany or not has_request_context():
+            return
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return
+        endpoint = request.endpoint or request.path
+        with self._lock:
+            por_rota = self.consultas.setdefault(endpoint, OrderedDict())
+            if statement not in por_rota and len(por_rota) < self.max_por_rota:
+                por_rota[statement] = parameters
+
+    def limpar(self):
+        with self._lock:
+            self.consultas.clear()
+
+    def plano(self, conn, statement, parameters):
+        """Linhas ``detail`` do EXPLAIN QUERY PLAN da consulta."""
+        linhas = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).all()
+        return [linha[-1] for linha in linhas]
+
+    def varreduras(self, plano):
+        """Tabelas varridas por inteiro no plano (ignora tabelas virtuais/FTS e constantes)."""
+        encontradas = []
+        for detalhe in plano:
+            m = _RE_SCAN.match(detalhe)
+            if not m or 'VIRTUAL TABLE' in m.group(2) or m.group(1) == 'CONSTANT':
+                continue
+            encontradas.append((m.group(1), detalhe))
+        return encontradas
+
+    def relatorio(self):
+        """[{endpoint, tabela, detalhe, filtrada, sql}] para cada varredura completa encontrada.
+
+        ``filtrada`` indica consulta com WHERE: é o caso que um índice resolveria.
+        Agregações sem filtro (SUM/COUNT da tabela toda) aparecem com ``filtrada=False``.
+        """
+        if db.engine.dialect.name != 'sqlite':
+            logger.info("Consultor de índices: EXPLAIN QUERY PLAN só é analisado no SQLite")
+            return []
+
+        with self._lock:
+            capturadas = {rota: list(por_rota.items()) for rota, por_rota in self.consultas.items()}
+
+        achados = []
+        engine = current_app.extensions.get('banco_leitura') or db.engine
+        with engine.connect() as conn:
+            for endpoint, consultas in sorted(capturadas.items()):
+                for statement, parameters in consultas:
+                    try:
+                        plano = self.plano(conn, statement, parameters)
+                    except Exception as e:
+                        logger.debug(f"EXPLAIN falhou em {endpoint}: {e}")
+                        continue
+                    for tabela, detalhe in self.varreduras(plano):
+                        achados.append({
+                            'endpoint': endpoint,
+                            'tabela': tabela,
+                            'detalhe': detalhe,
+                            'filtrada': bool(_RE_WHERE.search(statement)),
+                            'sql': ' '.join(statement.split()),
+                        })
+        return achados
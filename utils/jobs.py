@@ -0,0 +1,294 @@
+"""
+Fila local de tarefas pesadas (exportações, importações e backup).
+
+As tarefas rodam num ProcessPoolExecutor, fora das threads do waitress, e o
+estado (status, progresso, mensagem, arquivo gerado) fica na tabela ``jobs``:
+qualquer thread/worker HTTP consulta o andamento e serve o download quando o
+job termina. As tarefas são registradas com ``@tarefa`` em utils/tarefas.py.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+PENDENTE = 'PENDENTE'
+EXECUTANDO = 'EXECUTANDO'
+CONCLUIDO = 'CONCLUIDO'
+ERRO = 'ERRO'
+
+DEFAULT_WORKERS = 2
+DEFAULT_RETENCAO_DIAS = 7       # arquivos gerados/enviados ficam disponíveis por N dias (JOBS_RETENCAO_DIAS)
+INTERVALO_LIMPEZA = 3600        # segundos entre limpezas disparadas por enfileirar()
+
+# nome -> (função, altera_dados)
+TAREFAS = {}
+
+_app = None
+_config_worker = None
+_executor = None
+_executor_lock = threading.Lock()
+_ultima_limpeza = 0.0
+
+
+def tarefa(nome, altera_dados=False):
+    """Registra uma tarefa; ``altera_dados`` invalida o cache de relatórios ao terminar."""
+    def decorator(func):
+        TAREFAS[nome] = (func, altera_dados)
+        return func
+    return decorator
+
+
+class ContextoJob:
+    """Entregue às tarefas: caminho de saída e registro de progresso."""
+
+    def __init__(self, job_id, diretorio):
+        self.job_id = job_id
+        self.diretorio = diretorio
+        self._ultimo = -1
+
+    def caminho(self, nome):
+        return os.path.join(self.diretorio, f'{self.job_id}_{nome}')
+
+    def progresso(self, percentual, mensagem=None):
+        percentual = max(0, min(int(percentual), 99))
+        if percentual == self._ultimo and mensagem is None:
+            return
+        self._ultimo = percentual
+        valores = {'progresso': percentual}
+        if mensagem is not None:
+            valores['mensagem'] = mensagem[:255]
+        _atualizar(self.job_id, **valores)
+
+
+def _atualizar(job_id, **valores):
+    """Grava o estado do job numa transação curta e própria.
+
+    Nunca pela sessão da tarefa: ela pode estar com um cursor ``yield_per``
+    aberto (transação de leitura), e promover essa transação a gravação no
+    SQLite falha na hora com "database is locked" se outro job já gravou.
+    """
+    tabela = Job.__table__
+    consulta = tabela.update().where(tabela.c.id == job_id)
+    if 'status' in valores:
+        # Estado final não volta atrás (ex.: callback do pai depois do worker)
+        consulta = consulta.where(tabela.c.status.notin_([CONCLUIDO, ERRO]))
+    with db.engine.begin() as conn:
+        return conn.execute(consulta.values(**valores)).rowcount
+
+
+# ----------------- Processo principal -----------------
+
+def init_jobs(app):
+    """Prepara diretório, tabela e configuração dos workers; marca jobs órfãos como erro."""
+    global _app, _config_worker
+    _app = app
+    diretorio = app.config.get('JOBS_DIR') or os.path.join(app.instance_path, 'jobs')
+    os.makedirs(diretorio, exist_ok=True)
+    app.config['JOBS_DIR'] = diretorio
+
+    with app.app_context():
+        Job.__table__.create(db.engine, checkfirst=True)
+        _config_worker = {
+            'SQLALCHEMY_DATABASE_URI': db.engine.url.render_as_string(hide_password=False),
+            'SQLALCHEMY_ENGINE_OPTIONS': app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            'JOBS_DIR': diretorio,
+        }
+        # Com spawn o worker reimporta o módulo principal (e esta função): só o processo pai recupera órfãos
+        if multiprocessing.parent_process() is not None:
+            return
+        # Jobs que estavam na fila/rodando quando o servidor caiu não voltam sozinhos
+        orfaos = Job.query.filter(Job.status.in_([PENDENTE, EXECUTANDO])).update(
+            {'status': ERRO, 'mensagem': 'Interrompido pela reinicialização do servidor'},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if orfaos:
+            logger.warning(f"{orfaos} job(s) interrompidos marcados como erro")
+        limpar_expirados()
+
+
+def limpar_expirados():
+    """Remove do JOBS_DIR os arquivos mais antigos que JOBS_RETENCAO_DIAS.
+
+    Vale para saídas de jobs (o download passa a responder 410) e para planilhas
+    de importações com erro que não foram retomadas. Arquivos de jobs ainda na
+    fila ou executando nunca são removidos.
+    """
+    global _ultima_limpeza
+    _ultima_limpeza = time.monotonic()
+    diretorio = _app.config['JOBS_DIR']
+    dias = float(_app.config.get('JOBS_RETENCAO_DIAS', DEFAULT_RETENCAO_DIAS))
+    limite = time.time() - timedelta(days=dias).total_seconds()
+
+    em_uso = set()
+    ativos = db.session.query(Job.parametros, Job.arquivo).filter(Job.status.in_([PENDENTE, EXECUTANDO]))
+    for parametros, arquivo in ativos:
+        for caminho in (json.loads(parametros or '{}').get('arquivo'), arquivo):
+            if caminho:
+                em_uso.add(os.path.abspath(caminho))
+
+    removidos = 0
+    with os.scandir(diretorio) as entradas:
+        for entrada in entradas:
+            if not entrada.is_file() or os.path.abspath(entrada.path) in em_uso:
+                continue
+            try:
+                if entrada.stat().st_mtime < limite:
+                    os.remove(entrada.path)
+                    removidos += 1
+            except OSError as e:
+                logger.warning(f"Não foi possível remover {entrada.path}: {e}")
+    if removidos:
+        logger.info(f"{removidos} arquivo(s) de jobs expirados removidos de {diretorio}")
+    return removidos
+
+
+def _obter_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            contexto = multiprocessing.get_context(_app.config.get('JOBS_START_METHOD', 'spawn'))
+            _executor = ProcessPoolExecutor(
+                max_workers=int(_app.config.get('JOBS_WORKERS', DEFAULT_WORKERS)),
+                mp_context=contexto,
+                initializer=_inicializar_worker,
+                initargs=(_config_worker,)
+            )
+        return _executor
+
+
+def _descartar_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def enfileirar(tipo, parametros, usuario_id):
+    """Cria o registro do job e o envia ao pool de processos."""
+    if _app is None:
+        raise RuntimeError('Fila de jobs não inicializada (init_jobs)')
+    if tipo not in TAREFAS:
+        import utils.tarefas  # noqa: F401 - registra as tarefas
+    if tipo not in TAREFAS:
+        raise ValueError(f'Tipo de job desconhecido: {tipo}')
+
+    job = Job(
+        id=uuid.uuid4().hex,
+        tipo=tipo,
+        status=PENDENTE,
+        progresso=0,
+        mensagem='Na fila',
+        parametros=json.dumps(parametros or {}, default=str),
+        usuario_id=usuario_id
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    if time.monotonic() - _ultima_limpeza > INTERVALO_LIMPEZA:
+        try:
+            limpar_expirados()
+        except Exception as e:
+            logger.warning(f"Falha na limpeza de arquivos de jobs: {e}")
+
+    try:
+        futuro = _obter_executor().submit(_executar, job.id)
+    except Exception as e:
+        # Pool quebrado (worker morto): recria na próxima chamada
+        _descartar_executor()
+        _finalizar(job.id, erro=f'Falha ao enfileirar: {e}')
+        raise
+    futuro.add_done_callback(lambda f, job_id=job.id, tipo=tipo: _ao_terminar(f, job_id, tipo))
+    logger.info(f"Job {job.id} ({tipo}) enfileirado por usuário {usuario_id}")
+    return job
+
+
+def _ao_terminar(futuro, job_id, tipo):
+    """Callback no processo principal: trata worker morto e invalida o cache local."""
+    erro = futuro.exception() if not futuro.cancelled() else RuntimeError('Cancelado')
+    with _app.app_context():
+        if erro is not None:
+            logger.error(f"Job {job_id} falhou fora da tarefa: {erro}")
+            _finalizar(job_id, erro=str(erro))
+            _descartar_executor()
+        if TAREFAS.get(tipo, (None, False))[1]:
+            from utils.cache import cache, TAG_DADOS
+            cache.invalidate_tag(TAG_DADOS)
+
+
+def obter_job(job_id):
+    return db.session.get(Job, job_id)
+
+
+# ----------------- Processo worker -----------------
+
+_worker_app = None
+
+
+def _inicializar_worker(config):
+    """Cada processo do pool tem um app mínimo (só banco) e os hooks de agregados."""
+    global _worker_app
+    from flask import Flask
+    from utils.agregados import registrar_hooks_agregados
+    import utils.tarefas  # noqa: F401 - registra as tarefas
+
+    from utils.banco import init_banco
+
+    _worker_app = Flask('jobs_worker')
+    _worker_app.config.update(config)
+    db.init_app(_worker_app)
+    init_banco(_worker_app, db)   # mesmos pragmas (WAL, busy_timeout) do app
+    registrar_hooks_agregados()
+
+
+def _executar(job_id):
+    with _worker_app.app_context():
+        try:
+            job = db.session.get(Job, job_id)
+            if job is None or job.status != PENDENTE:
+                return
+            tipo, parametros = job.tipo, json.loads(job.parametros or '{}')
+            db.session.rollback()   # encerra a leitura antes de gravar por outra conexão
+            _atualizar(job_id, status=EXECUTANDO, iniciado_em=datetime.utcnow(), mensagem='Processando')
+
+            func, _ = TAREFAS[tipo]
+            contexto = ContextoJob(job_id, _worker_app.config['JOBS_DIR'])
+            resultado = func(contexto, **parametros) or {}
+            _finalizar(job_id, resultado=resultado)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro no job {job_id}: {e}")
+            _finalizar(job_id, erro=str(e))
+        finally:
+            db.session.remove()
+
+
+def _finalizar(job_id, resultado=None, erro=None):
+    if erro is not None:
+        _atualizar(job_id, status=ERRO, mensagem=erro[:255], concluido_em=datetime.utcnow())
+        return
+    resultado = dict(resultado or {})
+    arquivo = resultado.pop('arquivo', None)
+    nome_download = resultado.pop('nome_download', None)
+    _atualizar(
+        job_id,
+        status=CONCLUIDO,
+        progresso=100,
+        arquivo=arquivo,
+        nome_download=nome_download,
+        resultado=json.dumps(resultado, default=str) if resultado else None,
+        mensagem=resultado.get('mensagem', 'Concluído')[:255],
+        concluido_em=datetime.utcnow(),
+    )
@@ -0,0 +1,160 @@
+"""
+Snapshot de KPIs do painel.
+
+Cada tabela (empenhos, contratos, notas fiscais) é lida em UMA única query
+agrupada por status, com agregações condicionais (SUM(CASE ...)) para os
+contadores derivados. Os endpoints /api/kpis, /api/stats/* e os widgets de
+KPI leem daqui em vez de disparar um COUNT/SUM por status.
+"""
+
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import func, case
+
+from models import db, Empenho, Contrato, NotaFiscal
+
+logger = logging.getLogger(__name__)
+
+# Faixas de vencimento dos contratos ativos (dias restantes)
+DIAS_CRITICO = 30
+DIAS_ATENCAO = 60
+
+
+def _int(v):
+    return int(v or 0)
+
+
+def _float(v):
+    return float(v or 0.0)
+
+
+def _status_expr(model):
+    """Coluna de status já normalizada na gravação (models.normalizar_status): agrupa pelo índice."""
+    return model.status
+
+
+def snapshot_empenhos(hoje=None):
+    """Contadores de empenhos em uma passada: total, valores e por status."""
+    hoje = hoje or date.today()
+    inicio_mes = hoje.replace(day=1)
+    col_data = getattr(Empenho, 'data_criacao', Empenho.data_empenho)
+    status = _status_expr(Empenho)
+
+    rows = db.session.query(
+        status.label('status'),
+        func.count(Empenho.id).label('quantidade'),
+        func.coalesce(func.sum(Empenho.valor_empenhado), 0).label('valor'),
+        func.coalesce(func.sum(case((col_data >= inicio_mes, 1), else_=0)), 0).label('novos_mes'),
+    ).group_by(status).all()
+
+    por_status = {}
+    total = novos_mes = 0
+    valor_total = 0.0
+    for row in rows:
+        por_status[row.status or 'INDEFINIDO'] = {
+            'quantidade': _int(row.quantidade),
+            'valor': _float(row.valor),
+        }
+        total += _int(row.quantidade)
+        valor_total += _float(row.valor)
+        novos_mes += _int(row.novos_mes)
+
+    def qtd(nome):
+        return por_status.get(nome, {}).get('quantidade', 0)
+
+    return {
+        'total': total,
+        'valor_total': valor_total,
+        'pendentes': qtd('PENDENTE'),
+        'aprovados': qtd('APROVADO'),
+        'pagos': qtd('PAGO'),
+        'rejeitados': qtd('REJEITADO'),
+        'novos_mes': novos_mes,
+        'por_status': por_status,
+    }
+
+
+def snapshot_contratos(hoje=None):
+    """Contadores de contratos em uma passada, incluindo faixas de vencimento."""
+    hoje = hoje or date.today()
+    limite_critico = hoje + timedelta(days=DIAS_CRITICO)
+    limite_atencao = hoje + timedelta(days=DIAS_ATENCAO)
+    status = _status_expr(Contrato)
+    com_fim = Contrato.data_fim.isnot(None)
+
+    rows = db.session.query(
+        status.label('status'),
+        func.count(Contrato.id).label('quantidade'),
+        func.coalesce(func.sum(Contrato.valor_total), 0).label('valor'),
+        func.coalesce(func.sum(case(
+            (com_fim & (Contrato.data_fim <= limite_critico), 1), else_=0)), 0).label('criticos'),
+        func.coalesce(func.sum(case(
+            (com_fim & (Contrato.data_fim > limite_critico) & (Contrato.data_fim <= limite_atencao), 1),
+            else_=0)), 0).label('atencao'),
+        func.coalesce(func.sum(case(
+            (com_fim & (Contrato.data_fim > limite_atencao), 1), else_=0)), 0).label('normais'),
+    ).group_by(status).all()
+
+    por_status = {}
+    total = 0
+    valor_total = 0.0
+    ativo = None
+    for row in rows:
+        por_status[row.status or 'INDEFINIDO'] = {
+            'quantidade': _int(row.quantidade),
+            'valor': _float(row.valor),
+        }
+        total += _int(row.quantidade)
+        valor_total += _float(row.valor)
+        if row.status == 'ATIVO':
+            ativo = row
+
+    return {
+        'total': total,
+        'valor_total': valor_total,
+        'ativos': _int(ativo.quantidade) if ativo else 0,
+        'valor_ativos': _float(ativo.valor) if ativo else 0.0,
+        'criticos': _int(ativo.criticos) if ativo else 0,
+        'atencao': _int(ativo.atencao) if ativo else 0,
+        'normais': _int(ativo.normais) if ativo else 0,
+        'por_status': por_status,
+    }
+
+
+def snapshot_notas():
+    """Contadores de notas fiscais em uma passada: total, valor líquido e por status."""
+    status = _status_expr(NotaFiscal)
+
+    rows = db.session.query(
+        status.label('status'),
+        func.count(NotaFiscal.id).label('quantidade'),
+        func.coalesce(func.sum(NotaFiscal.valor_liquido), 0).label('valor'),
+    ).group_by(status).all()
+
+    por_status = {}
+    total = 0
+    valor_total = 0.0
+    for row in rows:
+        por_status[row.status or 'INDEFINIDO'] = {
+            'quantidade': _int(row.quantidade),
+            'valor': _float(row.valor),
+        }
+        total += _int(row.quantidade)
+        valor_total += _float(row.valor)
+
+    return {
+        'total': total,
+        'valor_total': valor_total,
+        'por_status': por_status,
+    }
+
+
+def kpi_snapshot(hoje=None):
+    """Snapshot completo (3 queries, uma por tabela) usado pelos endpoints do painel."""
+    hoje = hoje or date.today()
+    return {
+        'empenhos': snapshot_empenhos(hoje),
+        'contratos': snapshot_contratos(hoje),
+        'notas': snapshot_notas(),
+    }
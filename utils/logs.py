@@ -0,0 +1,183 @@
+"""
+Logs estruturados do app, gravados fora do caminho da requisição.
+
+``configurar_logs`` liga os loggers do app (``LOGGERS_APP``: ``routes.*``,
+``utils.*``, ``requisicoes``, ``auth``...) a um ``QueueHandler``: a thread
+da requisição só põe o registro numa fila (sem esperar, descartando se a
+fila estiver cheia) e uma thread do ``QueueListener`` formata e escreve no
+stdout ou em ``LOG_ARQUIVO``. Assim um terminal lento ou disco ocupado não
+segura as requisições.
+
+Configuração (app.config ou variável de ambiente):
+
+- ``LOG_NIVEL``: DEBUG | INFO | WARNING | ERROR. Padrão DEBUG no modo
+  desenvolvimento e WARNING em producao/alta_demanda (``DB_MODO``), onde os
+  logs de depuração por requisição nem chegam a ser montados;
+- ``LOG_FORMATO``: texto (padrão) ou json (um objeto por linha);
+- ``LOG_AMOSTRAGEM``: fração dos registros abaixo de WARNING mantida por
+  logger, ex. ``requisicoes=0.01,auth=0.1`` (avisos e erros sempre passam);
+- ``LOG_ARQUIVO``: grava em arquivo com rotação em vez do stdout.
+
+Campos extras vão como ``extra={'campo': valor}`` e saem como
+``campo=valor`` (texto) ou chaves do JSON. Em código chamado a cada
+requisição, proteja montagens caras com ``logger.isEnabledFor(logging.DEBUG)``.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from flask.logging import default_handler
+
+from utils.banco import modo_banco
+
+# Loggers do app (e filhos); bibliotecas (sqlalchemy, werkzeug) ficam no nível do root
+LOGGERS_APP = ('app', '__main__', 'auth', 'requisicoes', 'routes', 'utils', 'services', 'models')
+TAMANHO_FILA = 10000
+NIVEL_POR_MODO = {'desenvolvimento': 'DEBUG', 'producao': 'WARNING', 'alta_demanda': 'WARNING'}
+
+# Atributos padrão do LogRecord; o que sobrar veio de ``extra``
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+def _conf(app, nome, padrao=None):
+    return app.config.get(nome) or os.environ.get(nome) or padrao
+
+
+def _extras(record):
+    return {k: v for k, v in vars(record).items() if k not in _ATRIBUTOS_PADRAO}
+
+
+class FormatoTexto(logging.Formatter):
+    """``data nível logger: mensagem chave=valor ...``"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        linha = super().format(record)
+        campos = _extras(record)
+        if campos:
+            linha += ' ' + ' '.join(f'{k}={v}' for k, v in campos.items())
+        return linha
+
+
+class FormatoJson(logging.Formatter):
+    """Um objeto JSON por linha (para agregadores de log)."""
+
+    def format(self, record):
+        dados = {
+            'ts': self.formatTime(record),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        dados.update(_extras(record))
+        if record.exc_info:
+            dados['excecao'] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class Amostragem(logging.Filter):
+    """Mantém só uma fração dos registros abaixo de WARNING dos loggers configurados."""
+
+    def __init__(self, taxas):
+        super().__init__()
+        self.taxas = taxas  # {nome do logger: fração mantida}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.taxas:
+            return True
+        nome = record.name
+        while nome:
+            taxa = self.taxas.get(nome)
+            if taxa is not None:
+                return random.random() < taxa
+            nome = nome.rpartition('.')[0]
+        return True
+
+
+class FilaSemBloqueio(logging.handlers.QueueHandler):
+    """QueueHandler que nunca espera: com a fila cheia o registro é descartado e contado."""
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # Só resolve a mensagem (args podem depender do contexto da requisição);
+        # a formatação completa fica para a thread do listener
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def _taxas(valor):
+    taxas = {}
+    for item in str(valor or '').split(','):
+        nome, _, taxa = item.partition('=')
+        if nome.strip() and taxa.strip():
+            try:
+                taxas[nome.strip()] = min(max(float(taxa), 0.0), 1.0)
+            except ValueError:
+                pass
+    return taxas
+
+
+def nivel_logs(app):
+    nivel = str(_conf(app, 'LOG_NIVEL', NIVEL_POR_MODO.get(modo_banco(app), 'WARNING'))).upper()
+    return nivel if nivel in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL') else 'WARNING'
+
+
+def configurar_logs(app):
+    """Liga os loggers do app à fila assíncrona. Retorna o nível efetivo."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    arquivo = _conf(app, 'LOG_ARQUIVO')
+    if arquivo:
+        saida = logging.handlers.RotatingFileHandler(arquivo, maxBytes=10 * 1024 * 1024, backupCount=5,
+                                                     encoding='utf-8')
+    else:
+        saida = logging.StreamHandler(sys.stdout)
+    saida.setFormatter(FormatoJson() if str(_conf(app, 'LOG_FORMATO', 'texto')).lower() == 'json' else FormatoTexto())
+
+    fila = FilaSemBloqueio(queue.Queue(TAMANHO_FILA))
+    fila.addFilter(Amostragem(_taxas(_conf(app, 'LOG_AMOSTRAGEM'))))
+
+    nivel = nivel_logs(app)
+    for nome in LOGGERS_APP:
+        logger = logging.getLogger(nome)
+        # Sem o handler padrão do Flask (app.logger) e sem a fila de uma configuração anterior
+        for handler in [h for h in logger.handlers if h is default_handler or isinstance(h, FilaSemBloqueio)]:
+            logger.removeHandler(handler)
+        logger.setLevel(nivel)
+        logger.addHandler(fila)
+        logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(fila.queue, saida, respect_handler_level=True)
+    _listener.start()
+    app.extensions['logs'] = fila
+    return nivel
+
+
+def _parar():
+    if _listener is not None:
+        _listener.stop()   # esvazia a fila antes de sair
+
+
+atexit.register(_parar)
@@ -0,0 +1,240 @@
+"""
+Migrações versionadas de schema.
+
+Cada migração é uma função registrada com ``@migracao('NNNN_nome')``; as
+versões aplicadas ficam na tabela ``schema_migracoes`` e só as pendentes rodam,
+em ordem, cada uma na sua transação. Roda uma vez na inicialização do app
+(``aplicar_migracoes``) ou por ``python migrar_schema.py`` — nada de DDL no
+caminho das requisições.
+
+As migrações descrevem as tabelas como eram na versão (``MetaData`` próprio),
+sem importar os modelos atuais, e toleram bancos em que a tabela/coluna já
+existe (criados por ``db.create_all()`` ou pelos antigos autochecks das rotas).
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Integer, MetaData, String, Table, Text,
+                        UniqueConstraint, bindparam, inspect, select, text)
+from sqlalchemy.exc import IntegrityError
+
+from models import db, normalizar_status
+
+logger = logging.getLogger(__name__)
+
+TABELA_VERSOES = 'schema_migracoes'
+
+# versão -> função(conn)
+MIGRACOES = {}
+
+_versoes = Table(
+    TABELA_VERSOES, MetaData(),
+    Column('versao', String(100), primary_key=True),
+    Column('aplicada_em', DateTime, nullable=False),
+)
+
+
+def migracao(versao):
+    """Registra uma migração; a ordem de aplicação é a ordem das versões."""
+    def decorator(func):
+        if versao in MIGRACOES:
+            raise ValueError(f'Migração duplicada: {versao}')
+        MIGRACOES[versao] = func
+        return func
+    return decorator
+
+
+def versoes_aplicadas(conn):
+    _versoes.create(conn, checkfirst=True)
+    return {v for (v,) in conn.execute(select(_versoes.c.versao))}
+
+
+def pendentes():
+    with db.engine.begin() as conn:
+        aplicadas = versoes_aplicadas(conn)
+    return [v for v in sorted(MIGRACOES) if v not in aplicadas]
+
+
+def aplicar_migracoes():
+    """Aplica as migrações pendentes; retorna as versões aplicadas nesta chamada."""
+    aplicadas = []
+    for versao in pendentes():
+        try:
+            with db.engine.begin() as conn:
+                MIGRACOES[versao](conn)
+                conn.execute(_versoes.insert().values(versao=versao, aplicada_em=datetime.utcnow()))
+        except IntegrityError:
+            # Outro worker aplicou a mesma versão ao mesmo tempo
+            logger.info(f"Migração {versao} já aplicada por outro processo")
+            continue
+        logger.info(f"Migração {versao} aplicada")
+        aplicadas.append(versao)
+    return aplicadas
+
+
+def _colunas(conn, tabela):
+    inspetor = inspect(conn)
+    if not inspetor.has_table(tabela):
+        return None
+    return {c['name'] for c in inspetor.get_columns(tabela)}
+
+
+def _metadata_com_usuarios():
+    """MetaData com um esboço de ``users`` para as chaves estrangeiras (não é criada aqui)."""
+    md = MetaData()
+    Table('users', md, Column('id', Integer, primary_key=True))
+    return md
+
+
+# ----------------- Migrações -----------------
+
+@migracao('0001_chat_msn_tabelas')
+def _chat_msn_tabelas(conn):
+    """Tabelas do chat MSN (antes criadas por _ensure_chat_msn_schema a cada página)"""
+    md = _metadata_com_usuarios()
+    Table('chat_msn_rooms', md,
+          Column('id', Integer, primary_key=True),
+          Column('name', String(120), nullable=False),
+          Column('kind', String(20), nullable=False, default='group'),
+          Column('created_by', Integer),
+          Column('created_at', DateTime, nullable=False, default=datetime.utcnow),
+          Column('dm_key', String(64), unique=True))
+    Table('chat_msn_members', md,
+          Column('id', Integer, primary_key=True),
+          Column('room_id', Integer, ForeignKey('chat_msn_rooms.id'), nullable=False),
+          Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('role', String(20), nullable=False, default='member'),
+          Column('joined_at', DateTime, nullable=False, default=datetime.utcnow),
+          UniqueConstraint('room_id', 'user_id'))
+    Table('chat_msn_messages', md,
+          Column('id', Integer, primary_key=True),
+          Column('room_id', Integer, ForeignKey('chat_msn_rooms.id'), nullable=False),
+          Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('content', Text),
+          Column('message_type', String(20), nullable=False, default='text'),
+          Column('created_at', DateTime, nullable=False, default=datetime.utcnow),
+          Column('deleted', Boolean, nullable=False, default=False))
+    Table('chat_msn_attachments', md,
+          Column('id', Integer, primary_key=True),
+          Column('message_id', Integer, ForeignKey('chat_msn_messages.id'), nullable=False),
+          Column('filename', String(255), nullable=False),
+          Column('original_filename', String(255), nullable=False),
+          Column('file_size', Integer, nullable=False),
+          Column('content_type', String(100), nullable=False),
+          Column('file_path', String(500), nullable=False),
+          Column('uploaded_at', DateTime, nullable=False, default=datetime.utcnow))
+    tabelas = [t for nome, t in md.tables.items() if nome != 'users']
+    md.create_all(conn, tables=tabelas, checkfirst=True)
+
+
+@migracao('0002_chat_rooms_kind_dm_key')
+def _chat_rooms_kind_dm_key(conn):
+    """Colunas de DM em chat_rooms (antes adicionadas por _ensure_chat_schema do chat offline)"""
+    colunas = _colunas(conn, 'chat_rooms')
+    if colunas is None:
+        return  # banco novo: create_all cria a tabela já com as colunas
+    if 'kind' not in colunas:
+        conn.execute(text("ALTER TABLE chat_rooms ADD COLUMN kind VARCHAR(20) NOT NULL DEFAULT 'group'"))
+    if 'dm_key' not in colunas:
+        conn.execute(text("ALTER TABLE chat_rooms ADD COLUMN dm_key VARCHAR(64)"))
+
+
+@migracao('0003_chat_anexos_offline')
+def _chat_anexos_offline(conn):
+    """Anexos e tipo de mensagem do chat offline (antes no autocheck de chat_offline_msn)"""
+    colunas = _colunas(conn, 'chat_room_messages')
+    if colunas is None:
+        return
+    if 'message_type' not in colunas:
+        conn.execute(text("ALTER TABLE chat_room_messages ADD COLUMN message_type VARCHAR(20) DEFAULT 'text'"))
+    md = MetaData()
+    Table('chat_room_messages', md, Column('id', Integer, primary_key=True))
+    anexos = Table('chat_attachments', md,
+                   Column('id', Integer, primary_key=True),
+                   Column('message_id', Integer, ForeignKey('chat_room_messages.id'), nullable=False, index=True),
+                   Column('filename', String(255), nullable=False),
+                   Column('original_filename', String(255), nullable=False),
+                   Column('file_size', Integer, nullable=False),
+                   Column('content_type', String(100), nullable=False),
+                   Column('file_path', String(500), nullable=False),
+                   Column('uploaded_at', DateTime, nullable=False, default=datetime.utcnow))
+    anexos.create(conn, checkfirst=True)
+
+
+@migracao('0004_chat_last_read_message_id')
+def _chat_last_read_message_id(conn):
+    """Marca d'água de leitura dos membros (contagem de não lidas)
+
+    Membros existentes começam com tudo lido (marca = última mensagem da sala),
+    para a atualização não mostrar o histórico inteiro como novidade.
+    """
+    for membros, mensagens in (('chat_msn_members', 'chat_msn_messages'), ('chat_members', 'chat_room_messages')):
+        colunas = _colunas(conn, membros)
+        if colunas is None or 'last_read_message_id' in colunas:
+            continue
+        conn.execute(text(f"ALTER TABLE {membros} ADD COLUMN last_read_message_id INTEGER NOT NULL DEFAULT 0"))
+        if _colunas(conn, mensagens) is not None:
+            conn.execute(text(
+                f"UPDATE {membros} SET last_read_message_id = COALESCE("
+                f"(SELECT MAX(m.id) FROM {mensagens} m WHERE m.room_id = {membros}.room_id), 0)"
+            ))
+
+
+@migracao('0005_normalizar_status')
+def _normalizar_status(conn):
+    """Status antigos ('ativo', ' Pago', 'em aberto') no formato canônico ('ATIVO', 'PAGO', 'EM_ABERTO')
+
+    Os filtros comparam ``status == 'ATIVO'`` direto no índice; linhas gravadas
+    antes de models.normalizar_status ficariam de fora das contagens.
+    """
+    for tabela, col_atualizacao in (('contratos', 'data_atualizacao'), ('empenhos', 'data_atualizacao'),
+                                    ('notas_fiscais', 'updated_at')):
+        colunas = _colunas(conn, tabela)
+        if colunas is None or 'status' not in colunas:
+            continue
+        t = Table(tabela, MetaData(), Column('status', String(50)),
+                  *([Column(col_atualizacao, DateTime)] if col_atualizacao in colunas else []))
+        agora = datetime.utcnow()
+        for (antigo,) in conn.execute(select(t.c.status).group_by(t.c.status)).all():
+            novo = normalizar_status(antigo)
+            if antigo is None or novo == antigo:
+                continue
+            valores = {'status': novo}
+            if col_atualizacao in colunas:
+                valores[col_atualizacao] = agora
+            resultado = conn.execute(t.update().where(t.c.status == antigo).values(**valores))
+            logger.info(f"{tabela}: status '{antigo}' -> '{novo}' ({resultado.rowcount} linhas)")
+
+
+@migracao('0006_empenhos_data_criacao_not_null')
+def _empenhos_data_criacao_not_null(conn):
+    """Preenche ``empenhos.data_criacao`` nula e a torna NOT NULL
+
+    A listagem de empenhos pagina pela chave (data_criacao, id): linhas com
+    NULL nunca satisfazem ``data_criacao < :cursor`` e somem das páginas
+    seguintes. O valor vem de data_atualizacao, ou de data_empenho à meia-noite.
+    No SQLite (sem ALTER COLUMN) o NOT NULL fica no modelo e no default dos inserts.
+    """
+    colunas = _colunas(conn, 'empenhos')
+    if colunas is None or 'data_criacao' not in colunas:
+        return
+    t = Table('empenhos', MetaData(), Column('id', Integer, primary_key=True),
+              Column('data_criacao', DateTime), Column('data_empenho', Date),
+              *([Column('data_atualizacao', DateTime)] if 'data_atualizacao' in colunas else []))
+    agora = datetime.utcnow()
+    nulas = conn.execute(select(t).where(t.c.data_criacao.is_(None))).mappings().all()
+    if nulas:
+        valores = [{
+            'b_id': linha['id'],
+            'b_data': linha.get('data_atualizacao')
+                      or (datetime.combine(linha['data_empenho'], datetime.min.time()) if linha['data_empenho'] else agora),
+        } for linha in nulas]
+        conn.execute(t.update().where(t.c.id == bindparam('b_id')).values(data_criacao=bindparam('b_data')), valores)
+        logger.info(f"empenhos: data_criacao preenchida em {len(nulas)} linhas")
+
+    dialeto = conn.dialect.name
+    if dialeto == 'postgresql':
+        conn.execute(text("ALTER TABLE empenhos ALTER COLUMN data_criacao SET NOT NULL"))
+    elif dialeto in ('mysql', 'mariadb'):
+        conn.execute(text("ALTER TABLE empenhos MODIFY data_criacao DATETIME NOT NULL"))
@@ -0,0 +1,139 @@
+"""
+Mensagens não lidas do chat por sala.
+
+Cada membro guarda ``last_read_message_id`` (marca d'água): as mensagens da
+sala com id maior que ela, de outros usuários e não apagadas, são as não
+lidas. ``contar_nao_lidas`` conta todas as salas do usuário numa única
+consulta agregada (membros LEFT JOIN mensagens, índice (room_id, id)).
+
+O ``ContadorNaoLidas`` mantém essas contagens em memória por usuário: a
+primeira leitura carrega com a consulta agregada e depois cada mensagem nova
+soma 1 para os membros carregados da sala e cada "marcar como lida" recalcula
+só aquela sala. As entradas expiram após ``ttl`` segundos para reconciliar
+com mensagens gravadas por outros workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import and_, func
+
+from models import db
+
+TTL_CONTADORES = 60       # segundos até recarregar as contagens de um usuário
+MAXIMO_USUARIOS = 5000    # usuários com contagens em memória (LRU)
+
+
+def _nao_lida(mensagem, room_id, user_id, marca):
+    """Condição de mensagem não lida para o usuário a partir da marca d'água."""
+    return and_(
+        mensagem.room_id == room_id,
+        mensagem.id > marca,
+        mensagem.user_id != user_id,
+        mensagem.deleted == False,
+    )
+
+
+def contar_nao_lidas(membro, mensagem, user_id):
+    """{room_id: não lidas} de todas as salas do usuário em uma consulta (salas sem novidades vêm com 0)."""
+    q = (
+        db.session.query(membro.room_id, func.count(mensagem.id))
+        .outerjoin(mensagem, _nao_lida(mensagem, membro.room_id, user_id, membro.last_read_message_id))
+        .filter(membro.user_id == user_id)
+        .group_by(membro.room_id)
+    )
+    return {room_id: qtd for room_id, qtd in q}
+
+
+def contar_nao_lidas_sala(membro, mensagem, user_id, room_id):
+    """Não lidas de uma sala (recalculo pontual após marcar como lida)."""
+    marca = (
+        db.session.query(membro.last_read_message_id)
+        .filter(membro.room_id == room_id, membro.user_id == user_id)
+        .scalar_subquery()
+    )
+    return db.session.query(func.count(mensagem.id)).filter(
+        _nao_lida(mensagem, room_id, user_id, marca)).scalar() or 0
+
+
+def marcar_lida(membro, mensagem, user_id, room_id, message_id=None):
+    """Avança a marca d'água do membro até ``message_id`` (ou a última mensagem da sala).
+
+    A marca só anda para frente: uma aba atrasada não "desmarca" o que outra já leu.
+    Retorna a marca gravada ou ``None`` se o usuário não é membro.
+    """
+    if message_id is None:
+        message_id = db.session.query(func.max(mensagem.id)).filter(mensagem.room_id == room_id).scalar() or 0
+    filtro = (membro.room_id == room_id, membro.user_id == user_id)
+    db.session.query(membro).filter(*filtro, membro.last_read_message_id < message_id).update(
+        {membro.last_read_message_id: message_id}, synchronize_session=False)
+    db.session.commit()
+    return db.session.query(membro.last_read_message_id).filter(*filtro).scalar()
+
+
+class ContadorNaoLidas:
+    """Contagens de não lidas por usuário, mantidas incrementalmente em memória.
+
+    ``escopo`` separa os chats (MSN e offline têm salas com os mesmos ids).
+    """
+
+    def __init__(self, ttl=TTL_CONTADORES, max_usuarios=MAXIMO_USUARIOS):
+        self.ttl = ttl
+        self.max_usuarios = max_usuarios
+        self._contagens = OrderedDict()  # (escopo, user_id) -> (expira_em, {room_id: qtd})
+        self._por_sala = {}              # (escopo, room_id) -> {user_id} carregados que são membros
+        self._lock = threading.Lock()
+
+    def obter(self, escopo, user_id, carregar):
+        """{room_id: qtd} do usuário; ``carregar()`` roda a consulta agregada quando não há entrada válida."""
+        chave = (escopo, user_id)
+        with self._lock:
+            entrada = self._contagens.get(chave)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self._contagens.move_to_end(chave)
+                return dict(entrada[1])
+        salas = carregar()
+        with self._lock:
+            self._remover(chave)
+            self._contagens[chave] = (time.monotonic() + self.ttl, dict(salas))
+            for room_id in salas:
+                self._por_sala.setdefault((escopo, room_id), set()).add(user_id)
+            while len(self._contagens) > self.max_usuarios:
+                self._remover(next(iter(self._contagens)))
+        return dict(salas)
+
+    def nova_mensagem(self, escopo, room_id, autor_id):
+        """Soma 1 na sala para os membros carregados, exceto o autor."""
+        with self._lock:
+            for user_id in self._por_sala.get((escopo, room_id), ()):
+                if user_id != autor_id:
+                    self._contagens[(escopo, user_id)][1][room_id] += 1
+
+    def definir(self, escopo, user_id, room_id, qtd):
+        """Grava a contagem recalculada de uma sala (após marcar como lida)."""
+        with self._lock:
+            entrada = self._contagens.get((escopo, user_id))
+            if entrada is not None and room_id in entrada[1]:
+                entrada[1][room_id] = qtd
+
+    def invalidar(self, escopo, user_id=None):
+        """Descarta as contagens de um usuário (entrou/saiu de sala) ou do escopo inteiro."""
+        with self._lock:
+            for chave in [c for c in self._contagens if c[0] == escopo and user_id in (None, c[1])]:
+                self._remover(chave)
+
+    def _remover(self, chave):
+        entrada = self._contagens.pop(chave, None)
+        if entrada is None:
+            return
+        escopo, user_id = chave
+        for room_id in entrada[1]:
+            usuarios = self._por_sala.get((escopo, room_id))
+            if usuarios is not None:
+                usuarios.discard(user_id)
+                if not usuarios:
+                    del self._por_sala[(escopo, room_id)]
+
+
+contador_nao_lidas = ContadorNaoLidas()
@@ -0,0 +1,169 @@
+"""
+Paginação por cursor (keyset) para as listagens.
+
+Em vez de ``OFFSET n`` + ``COUNT(*)`` (que ficam mais caros a cada página), a
+próxima página é pedida a partir da última linha vista:
+``WHERE (data, id) < (:data, :id) ORDER BY data DESC, id DESC LIMIT n``.
+Com o índice composto da chave de ordenação, a página 1000 custa o mesmo que
+a página 1. Os cursores são opacos (base64 de JSON) para o cliente apenas
+repassá-los em ``?cursor=`` / ``?antes=``.
+
+As colunas da chave devem ser NOT NULL na prática (o ``id`` desempata).
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, or_
+
+POR_PAGINA_PADRAO = 20
+POR_PAGINA_MAXIMO = 100
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _serializar(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def _desserializar(coluna, valor):
+    if valor is None:
+        return None
+    tipo = coluna.type.python_type
+    if tipo is datetime:
+        return datetime.fromisoformat(valor)
+    if tipo is date:
+        return date.fromisoformat(valor)
+    if tipo is Decimal:
+        return Decimal(valor)
+    return tipo(valor)
+
+
+def codificar_cursor(valores):
+    texto = json.dumps([_serializar(v) for v in valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, colunas):
+    """Valores da chave a partir do cursor; ``CursorInvalido`` se adulterado ou de outra listagem."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        valores = json.loads(texto)
+        if not isinstance(valores, list) or len(valores) != len(colunas):
+            raise ValueError('tamanho')
+        return [_desserializar(col, v) for col, v in zip(colunas, valores)]
+    except Exception as e:
+        raise CursorInvalido(f'Cursor inválido: {cursor}') from e
+
+
+def _depois_de(colunas, valores, descendente):
+    """Condição "linha vem depois de ``valores``" na ordem dada (expansão portátil do row value)."""
+    condicoes = []
+    for i, (coluna, valor) in enumerate(zip(colunas, valores)):
+        iguais = [c == v for c, v in zip(colunas[:i], valores[:i])]
+        passo = coluna < valor if descendente else coluna > valor
+        condicoes.append(and_(*iguais, passo))
+    return or_(*condicoes)
+
+
+class PaginaKeyset:
+    """Uma página de resultados; iterável como a lista ``.items`` (templates que faziam ``for x in lista``)."""
+
+    def __init__(self, items, colunas, per_page, tem_proxima, tem_anterior):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = tem_proxima
+        self.has_prev = tem_anterior
+        self._colunas = colunas
+
+    def _cursor(self, item):
+        return codificar_cursor([getattr(item, col.key) for col in self._colunas])
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1]) if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self._cursor(self.items[0]) if self.has_prev and self.items else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def to_dict(self, serializar):
+        return {
+            'items': [serializar(item) for item in self.items],
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+        }
+
+
+def paginar(query, colunas, cursor=None, antes=None, per_page=POR_PAGINA_PADRAO, descendente=True):
+    """Aplica ordenação + keyset a ``query`` (Query do ORM) e devolve uma ``PaginaKeyset``.
+
+    ``colunas`` é a chave de ordenação, terminando numa coluna única (o id).
+    ``cursor`` pede a página seguinte a ele; ``antes`` a página anterior.
+    """
+    per_page = max(1, min(int(per_page or POR_PAGINA_PADRAO), POR_PAGINA_MAXIMO))
+    voltando = bool(antes)
+    referencia = antes or cursor
+
+    # Para voltar, percorre no sentido inverso a partir do cursor e desinverte o resultado
+    sentido = descendente != voltando
+    if referencia:
+        valores = decodificar_cursor(referencia, colunas)
+        query = query.filter(_depois_de(colunas, valores, sentido))
+    ordem = [c.desc() if sentido else c.asc() for c in colunas]
+    linhas = query.order_by(None).order_by(*ordem).limit(per_page + 1).all()
+
+    ha_mais = len(linhas) > per_page
+    linhas = linhas[:per_page]
+    if voltando:
+        linhas.reverse()
+        return PaginaKeyset(linhas, colunas, per_page, tem_proxima=True, tem_anterior=ha_mais)
+    return PaginaKeyset(linhas, colunas, per_page, tem_proxima=ha_mais, tem_anterior=bool(referencia))
+
+
+def paginar_da_requisicao(query, colunas, args, descendente=True, per_page=POR_PAGINA_PADRAO):
+    """Atalho para views: lê ``cursor``, ``antes`` e ``per_page`` dos argumentos da requisição."""
+    return paginar(query, colunas,
+                   cursor=args.get('cursor') or None,
+                   antes=args.get('antes') or None,
+                   per_page=args.get('per_page', per_page, type=int),
+                   descendente=descendente)
+
+
+def janela_por_id(query, coluna_id, depois_de=None, antes_de=None, limite=POR_PAGINA_PADRAO, maximo=POR_PAGINA_MAXIMO):
+    """Janela de linhas por id crescente, para históricos (chat) em que o id já é a ordem.
+
+    ``depois_de``: as ``limite`` linhas seguintes a esse id (busca incremental);
+    ``antes_de``: as ``limite`` anteriores a ele; sem nenhum dos dois, as mais
+    recentes. Retorna ``(linhas em ordem crescente, ha_mais)``, onde ``ha_mais``
+    indica que há mais linhas no sentido pedido.
+    """
+    limite = max(1, min(int(limite or POR_PAGINA_PADRAO), maximo))
+    if depois_de is not None:
+        linhas = query.filter(coluna_id > depois_de).order_by(None).order_by(coluna_id.asc()).limit(limite + 1).all()
+        return linhas[:limite], len(linhas) > limite
+    if antes_de is not None:
+        query = query.filter(coluna_id < antes_de)
+    linhas = query.order_by(None).order_by(coluna_id.desc()).limit(limite + 1).all()
+    ha_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    linhas.reverse()
+    return linhas, ha_mais
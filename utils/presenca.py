@@ -0,0 +1,152 @@
+"""
+Presença dos usuários do chat (quem está online em cada sala).
+
+Os sinais de vida (heartbeat explícito ou o próprio stream SSE aberto) só
+atualizam dicionários em memória; uma thread grava o último sinal de cada
+usuário em ``presenca_usuarios`` em lote, a cada ``intervalo`` segundos, pela
+fila de gravação (na mesma transação das mensagens de chat que chegarem juntas).
+
+O conjunto de online de cada sala é mantido incrementalmente: entrar (primeiro
+sinal) ou sair (sem sinal por ``ttl`` segundos) publica um evento ``presence``
+no canal da sala, que chega aos clientes pelo stream SSE. A lista de online
+não consulta o banco.
+
+Os conjuntos são locais ao processo; com vários workers,
+``usuarios_vistos_desde`` consulta o último sinal gravado (índice em last_seen).
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, select
+
+from models import db, PresencaUsuario
+from utils.eventos import eventos
+from utils.gravador import gravador
+
+logger = logging.getLogger(__name__)
+
+TTL_ONLINE = 60          # segundos sem sinal até o usuário sair da sala
+INTERVALO_GRAVACAO = 30  # segundos entre gravações em lote / varreduras de expiração
+
+
+class ServicoPresenca:
+    """Online por sala (canal de eventos) em memória + gravação em lote do último sinal."""
+
+    def __init__(self, ttl=TTL_ONLINE):
+        self.ttl = ttl
+        self._vistos = {}     # canal -> {user_id: instante do último sinal (monotonic)}
+        self._nomes = {}      # user_id -> nome exibido
+        self._pendentes = {}  # user_id -> datetime do último sinal ainda não gravado
+        self._lock = threading.Lock()
+
+    def sinal(self, user_id, canais=(), nome=None):
+        """Registra um sinal de vida do usuário nas salas ``canais``; avisa as salas em que ele entrou."""
+        agora = time.monotonic()
+        entrou = []
+        with self._lock:
+            self._pendentes[user_id] = datetime.utcnow()
+            if nome:
+                self._nomes[user_id] = nome
+            for canal in canais:
+                sala = self._vistos.setdefault(canal, {})
+                if user_id not in sala:
+                    entrou.append(canal)
+                sala[user_id] = agora
+            nome = self._nomes.get(user_id)
+        for canal in entrou:
+            eventos.publicar(canal, 'presence', {'user_id': user_id, 'username': nome, 'online': True})
+
+    def expirar(self):
+        """Tira das salas quem passou do TTL sem sinal; retorna quantas saídas houve."""
+        limite = time.monotonic() - self.ttl
+        saidas = []
+        with self._lock:
+            for canal, sala in list(self._vistos.items()):
+                for user_id, visto in list(sala.items()):
+                    if visto < limite:
+                        del sala[user_id]
+                        saidas.append((canal, user_id))
+                if not sala:
+                    del self._vistos[canal]
+        for canal, user_id in saidas:
+            eventos.publicar(canal, 'presence', {'user_id': user_id, 'online': False})
+        return len(saidas)
+
+    def online(self, canal):
+        """[{'id', 'username'}] de quem está online na sala, sem consultar o banco."""
+        limite = time.monotonic() - self.ttl
+        with self._lock:
+            sala = self._vistos.get(canal, {})
+            ids = sorted(uid for uid, visto in sala.items() if visto >= limite)
+            return [{'id': uid, 'username': self._nomes.get(uid)} for uid in ids]
+
+    def esta_online(self, user_id):
+        limite = time.monotonic() - self.ttl
+        with self._lock:
+            return any(sala.get(user_id, 0) >= limite for sala in self._vistos.values())
+
+    def gravar(self):
+        """Grava em lote o último sinal dos usuários pendentes; retorna quantos foram gravados."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        if not pendentes:
+            return 0
+        try:
+            gravador.executar(_gravar_sinais, pendentes)
+        except Exception as e:
+            # Devolve os sinais para a próxima tentativa (sem sobrescrever os mais novos)
+            with self._lock:
+                for uid, visto in pendentes.items():
+                    self._pendentes.setdefault(uid, visto)
+            logger.warning(f"Presença não gravada: {e}")
+            return 0
+        return len(pendentes)
+
+
+def _gravar_sinais(conn, pendentes):
+    """Upsert em lote de {user_id: último sinal} (UPDATE dos existentes + INSERT dos novos)."""
+    tabela = PresencaUsuario.__table__
+    existentes = {uid for (uid,) in conn.execute(
+        select(tabela.c.user_id).where(tabela.c.user_id.in_(list(pendentes))))}
+    atualizar = [{'uid': uid, 'visto': visto} for uid, visto in pendentes.items() if uid in existentes]
+    inserir = [{'user_id': uid, 'last_seen': visto} for uid, visto in pendentes.items() if uid not in existentes]
+    if atualizar:
+        conn.execute(tabela.update().where(tabela.c.user_id == bindparam('uid'))
+                     .values(last_seen=bindparam('visto')), atualizar)
+    if inserir:
+        conn.execute(tabela.insert(), inserir)
+
+
+presenca = ServicoPresenca()
+
+
+def usuarios_vistos_desde(segundos=TTL_ONLINE):
+    """Ids com sinal gravado nos últimos ``segundos`` (visão compartilhada entre workers)."""
+    limite = datetime.utcnow() - timedelta(seconds=segundos)
+    return [uid for (uid,) in db.session.query(PresencaUsuario.user_id)
+            .filter(PresencaUsuario.last_seen >= limite)]
+
+
+def _ciclo(app, intervalo):
+    while True:
+        time.sleep(intervalo)
+        try:
+            with app.app_context():
+                presenca.expirar()
+                presenca.gravar()
+                db.session.remove()
+        except Exception as e:
+            logger.warning(f"Ciclo de presença falhou: {e}")
+
+
+def init_presenca(app):
+    """Cria a tabela e inicia a thread de expiração/gravação em lote."""
+    presenca.ttl = int(app.config.get('PRESENCA_TTL', TTL_ONLINE))
+    intervalo = int(app.config.get('PRESENCA_INTERVALO', INTERVALO_GRAVACAO))
+    with app.app_context():
+        PresencaUsuario.__table__.create(db.engine, checkfirst=True)
+    threading.Thread(target=_ciclo, args=(app, intervalo), name='presenca', daemon=True).start()
+    return presenca
@@ -0,0 +1,85 @@
+"""
+Tarefas executadas pela fila de jobs (utils/jobs.py).
+
+Cada tarefa recebe um ``ContextoJob`` e os parâmetros gravados no job, e
+devolve um dict com ``arquivo``/``nome_download`` quando gera um download.
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import select, func
+
+from models import db
+from utils.jobs import tarefa
+from utils.export_stream import COLUNAS_EMPENHOS, escrever_xlsx, select_empenhos_filtrados
+
+
+def _carimbo():
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+@tarefa('exportar_excel')
+def exportar_excel(ctx, filtros=None):
+    filtros = filtros or {}
+    stmt = select_empenhos_filtrados(filtros, COLUNAS_EMPENHOS)
+    total = db.session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar() or 0
+    ctx.progresso(0, f'Exportando {total} empenhos')
+
+    arquivo = ctx.caminho('relatorio_empenhos.xlsx')
+    escrever_xlsx(arquivo, stmt, COLUNAS_EMPENHOS, titulo='Empenhos',
+                  progresso=lambda n: ctx.progresso(n * 100 / total if total else 99))
+    return {
+        'arquivo': arquivo,
+        'nome_download': f'relatorio_empenhos_{_carimbo()}.xlsx',
+        'linhas': total,
+    }
+
+
+@tarefa('exportar_pdf')
+def exportar_pdf(ctx, filtros=None):
+    from utils.export import ExportUtils
+
+    filtros = filtros or {}
+    ctx.progresso(5, 'Consultando empenhos')
+    empenhos = db.session.scalars(select_empenhos_filtrados(filtros, None)).all()
+    ctx.progresso(30, f'Gerando PDF com {len(empenhos)} empenhos')
+
+    arquivo = ExportUtils.export_to_pdf(empenhos, filtros, filename=ctx.caminho('relatorio_empenhos.pdf'))
+    return {
+        'arquivo': arquivo,
+        'nome_download': f'relatorio_empenhos_{_carimbo()}.pdf',
+        'linhas': len(empenhos),
+    }
+
+
+@tarefa('backup_csv')
+def backup_csv(ctx):
+    from utils.export import ExportUtils
+
+    ctx.progresso(5, 'Gerando backup')
+    arquivo = ExportUtils.create_backup_csv(filename=ctx.caminho('backup_empenhos.csv'))
+    return {
+        'arquivo': arquivo,
+        'nome_download': f'backup_empenhos_{_carimbo()}.csv',
+    }
+
+
+@tarefa('importar_planilha', altera_dados=True)
+def importar_planilha(ctx, arquivo, usuario_id):
+    from utils.import_data import ImportUtils
+
+    resultado = ImportUtils.import_from_file(
+        arquivo, usuario_id,
+        progresso=lambda feitas, total: ctx.progresso(feitas * 100 / total if total else 0,
+                                                     f'{feitas}/{total or "?"} linhas')
+    )
+    if not resultado.get('sucesso'):
+        # O arquivo fica no diretório de jobs para POST /jobs/<id>/retomar continuar do checkpoint
+        raise RuntimeError(resultado.get('erro') or 'Falha na importação')
+
+    if os.path.exists(arquivo):
+        os.remove(arquivo)
+    resultado['mensagem'] = f"{resultado['importados']} empenhos importados, {resultado['erros']} erros"
+    resultado['mensagens_erro'] = resultado['mensagens_erro'][:50]
+    return resultado
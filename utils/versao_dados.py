@@ -0,0 +1,87 @@
+"""
+Versão dos dados (watermark) e GET condicional com ETag.
+
+A versão é formada pela contagem de linhas e pelo maior
+``data_atualizacao``/``updated_at`` de empenhos, contratos e notas fiscais,
+lidos em uma única query. Enquanto nada mudar, os endpoints decorados com
+``etag_condicional`` respondem ``304 Not Modified`` sem rodar as agregações.
+"""
+
+import hashlib
+import logging
+from datetime import date
+from functools import wraps
+
+from flask import request, make_response
+from sqlalchemy import func, select
+
+from models import db, Empenho, Contrato, NotaFiscal
+
+logger = logging.getLogger(__name__)
+
+# tabela -> coluna de última atualização
+_MARCAS = (
+    ('empenhos', Empenho, Empenho.data_atualizacao),
+    ('contratos', Contrato, Contrato.data_atualizacao),
+    ('notas', NotaFiscal, NotaFiscal.updated_at),
+)
+
+
+def versao_dados():
+    """String que muda sempre que alguma das tabelas do painel muda."""
+    colunas = []
+    for _, model, col in _MARCAS:
+        colunas.append(select(func.count(model.id)).scalar_subquery())
+        colunas.append(select(func.max(col)).scalar_subquery())
+    row = db.session.execute(select(*colunas)).first()
+    partes = []
+    for i, (nome, _, _) in enumerate(_MARCAS):
+        partes.append(f"{nome}:{row[2 * i]}:{row[2 * i + 1]}")
+    return '|'.join(partes)
+
+
+def calcular_etag(escopo=''):
+    """ETag forte para a requisição atual (rota + query string + dia + versão dos dados)."""
+    # O dia entra na chave porque vários KPIs dependem de date.today()
+    base = f"{escopo}|{request.full_path}|{date.today().isoformat()}|{versao_dados()}"
+    return hashlib.sha1(base.encode('utf-8')).hexdigest()
+
+
+def _tem_fallback(dados):
+    """True se a resposta (ou algum widget de uma resposta em lote) veio de fallback"""
+    if not isinstance(dados, dict):
+        return False
+    if dados.get('fallback'):
+        return True
+    return any(isinstance(valor, dict) and valor.get('fallback') for valor in dados.values())
+
+
+def etag_condicional(escopo=''):
+    """
+    Decorator: responde 304 quando If-None-Match bate com a versão atual dos dados;
+    caso contrário executa a view e anexa o ETag à resposta.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                etag = calcular_etag(escopo or view.__name__)
+            except Exception as e:
+                logger.error(f"Erro ao calcular ETag: {e}")
+                return view(*args, **kwargs)
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                # Não fixa versão em respostas de fallback (erro ao calcular)
+                dados = response.get_json(silent=True) if response.is_json else None
+                if _tem_fallback(dados):
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
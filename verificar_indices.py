@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Consultor de índices: percorre as rotas GET com o ConsultorIndices ativo,
+roda EXPLAIN QUERY PLAN nas consultas capturadas e lista as varreduras
+completas (SCAN) por rota.
+
+Uso no CI:
+    python verificar_indices.py --gravar-base indices_base.json   # uma vez, aceita o estado atual
+    python verificar_indices.py --base indices_base.json          # falha (exit 1) se surgir varredura nova
+
+Sem ``--base``, falha se houver qualquer varredura de consulta filtrada
+(com WHERE) nas tabelas gerenciadas.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+os.environ['INDEX_ADVISOR'] = '1'
+
+from utils.app_principal import carregar_app
+from models import db, User
+from utils.indices import migrar_indices, TABELAS_GERENCIADAS
+
+app = carregar_app()
+
+# Rotas que não fazem sentido no varredor (efeitos colaterais, streaming, downloads)
+IGNORAR = ('logout', 'exportar', 'backup', 'download', 'stream', 'eventos', 'chat_alias', 'static')
+
+# Rotas com filtros que exercitam os índices além da página padrão
+ROTAS_EXTRAS = (
+    '/empenhos/?status=PENDENTE',
+    '/empenhos/?search=2025',
+    '/notas/?status=EM_ABERTO',
+    '/contratos/?status=ATIVO',
+    '/api/buscar?q=contrato',
+    '/relatorios/filtrado?status=PENDENTE&data_inicio=2024-01-01',
+)
+
+
+def _rotas():
+    rotas = []
+    for regra in app.url_map.iter_rules():
+        if 'GET' not in regra.methods or regra.arguments:
+            continue
+        if any(parte in regra.endpoint for parte in IGNORAR):
+            continue
+        rotas.append(regra.rule)
+    return sorted(set(rotas)) + list(ROTAS_EXTRAS)
+
+
+def _chave(achado):
+    return f"{achado['endpoint']}|{achado['tabela']}|{achado['sql']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aponta consultas que varrem tabelas inteiras')
+    parser.add_argument('--base', help='JSON com varreduras já aceitas; só as novas fazem falhar')
+    parser.add_argument('--gravar-base', help='grava as varreduras atuais como base aceita')
+    parser.add_argument('--todas', action='store_true', help='lista também agregações sem WHERE')
+    args = parser.parse_args()
+
+    consultor = app.extensions['consultor_indices']
+    with app.app_context():
+        db.create_all()
+        migrar_indices()
+        admin = User.query.filter_by(is_admin=True).first()
+        if admin is None:
+            print("❌ Nenhum usuário administrador encontrado (rode criar_admin.py)")
+            return 2
+        admin_id = admin.id
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = str(admin_id)
+        sessao['_fresh'] = True
+
+    rotas = _rotas()
+    print(f"🔎 Percorrendo {len(rotas)} rotas...")
+    # Só interessam as consultas; erros 500 de template não devem poluir o relatório
+    app.logger.setLevel(logging.CRITICAL)
+    for rota in rotas:
+        try:
+            cliente.get(rota)
+        except Exception as e:
+            print(f"   ⚠️ {rota}: {e}")
+
+    with app.app_context():
+        achados = consultor.relatorio()
+    relevantes = [a for a in achados if args.todas or (a['filtrada'] and a['tabela'] in TABELAS_GERENCIADAS)]
+
+    por_rota = {}
+    for achado in relevantes:
+        por_rota.setdefault(achado['endpoint'], []).append(achado)
+    for endpoint, lista in sorted(por_rota.items()):
+        print(f"\n📍 {endpoint}")
+        for achado in lista:
+            print(f"   {achado['detalhe']}")
+            # A lista de colunas do SELECT não ajuda: mostra a partir do FROM
+            sql = achado['sql']
+            print(f"      ...{sql[max(sql.find(' FROM '), 0):][:200]}")
+
+    if args.gravar_base:
+        with open(args.gravar_base, 'w', encoding='utf-8') as f:
+            json.dump(sorted({_chave(a) for a in relevantes}), f, ensure_ascii=False, indent=1)
+        print(f"\n✅ Base gravada em {args.gravar_base} ({len(relevantes)} varreduras aceitas)")
+        return 0
+
+    aceitas = set()
+    if args.base and os.path.exists(args.base):
+        with open(args.base, encoding='utf-8') as f:
+            aceitas = set(json.load(f))
+    novas = [a for a in relevantes if _chave(a) not in aceitas]
+
+    print(f"\n📊 {len(relevantes)} varreduras em {len(por_rota)} rotas; {len(novas)} fora da base")
+    if novas:
+        print("❌ Consultas filtradas sem índice:")
+        for achado in novas:
+            print(f"   {achado['endpoint']}: {achado['detalhe']}")
+        return 1
+    print("✅ Nenhuma varredura nova")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())